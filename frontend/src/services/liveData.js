@@ -1,14 +1,30 @@
 import { ref } from 'vue';
 
 const data = ref(null);
+const connected = ref(false);
+
+// Event kinds of the listener's /events stream (Server-Sent Events).
+const EVENT_KINDS = ['packet', 'nodes', 'status', 'counters', 'reset'];
 
 export function useLiveData() {
+  // `url` is the listener's event stream, e.g. http://host:5555/events. The EventSource reconnects
+  // by itself and resumes after the last event it received; a 'reset' event means events were
+  // missed and the data should be reloaded from the APIs.
   const connect = (url) => {
-    const ws = new WebSocket(url);
-    ws.onmessage = (event) => {
-      data.value = JSON.parse(event.data);
+    const source = new EventSource(url);
+    source.onopen = () => {
+      connected.value = true;
+    };
+    source.onerror = () => {
+      connected.value = false;
     };
+    EVENT_KINDS.forEach((kind) => {
+      source.addEventListener(kind, (event) => {
+        data.value = { kind, id: event.lastEventId, data: JSON.parse(event.data) };
+      });
+    });
+    return source;
   };
 
-  return { data, connect };
+  return { data, connected, connect };
 }
@@ -0,0 +1,152 @@
+# metrastics/batching.py
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Bounded write-behind queue in front of the database.
+
+    Producers only enqueue records; a dedicated writer thread groups them into batches (flushed
+    when `batch_size` is reached or `flush_interval` seconds after the first record of the batch
+    arrived) and hands every batch to `flush_callback`. `tick_callback` runs whenever the queue
+    was idle for `flush_interval` and after every batch. Log messages name the writer by `name`.
+    """
+
+    def __init__(self, flush_callback: Callable[[List[Any]], None], batch_size: int = 100,
+                 flush_interval: float = 1.0, max_queue_size: int = 5000,
+                 tick_callback: Optional[Callable[[], None]] = None, name: str = 'batch-writer',
+                 record_queue: Optional[Any] = None):
+        self.flush_callback = flush_callback
+        self.tick_callback = tick_callback
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.name = name
+        # Any object with the queue.Queue interface, e.g. a SheddingQueue with an overload policy.
+        self._queue = record_queue if record_queue is not None else queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._thread = None
+        self._running = False
+        self.submitted_count = 0
+        self.dropped_count = 0
+        self.flushed_batches = 0
+        self.flushed_items = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"Batch writer '{self.name}' started (batch size {self.batch_size}, flush interval {self.flush_interval}s, "
+                    f"queue size {self._queue.maxsize}).")
+
+    def submit(self, item: Any) -> bool:
+        """Enqueues a record without blocking the caller. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped_count += 1
+            logger.warning(f"Batch writer '{self.name}': queue full ({self._queue.maxsize} records), dropping record. "
+                           f"Dropped so far: {self.dropped_count}")
+            return False
+        self.submitted_count += 1
+        return True
+
+    def stop(self, timeout: Optional[float] = 30.0):
+        """Stops the writer thread after all queued records have been flushed."""
+        if not self._thread:
+            return
+        self._running = False
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Batch writer '{self.name}' did not finish within {timeout}s, {self._queue.qsize()} records left.")
+        else:
+            logger.info(f"Batch writer '{self.name}' stopped. {self.flushed_items} records in {self.flushed_batches} batches written.")
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'submitted': self.submitted_count,
+            'dropped': self.dropped_count,
+            'flushed_batches': self.flushed_batches,
+            'flushed_items': self.flushed_items,
+        }
+
+    def _flush(self, batch: List[Any]):
+        if not batch:
+            return
+        try:
+            close_old_connections()
+            self.flush_callback(batch)
+        except Exception as e:
+            logger.exception(f"Batch writer '{self.name}' failed to flush a batch of {len(batch)} records: {e}")
+        finally:
+            self.flushed_batches += 1
+            self.flushed_items += len(batch)
+
+    def _tick(self):
+        if self.tick_callback is None:
+            return
+        try:
+            self.tick_callback()
+        except Exception as e:
+            logger.exception(f"Batch writer '{self.name}' tick failed: {e}")
+
+    def _run(self):
+        stop_seen = False
+        while not stop_seen:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._tick()
+                continue
+
+            if item is _STOP:
+                stop_seen = True
+            else:
+                batch.append(item)
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop_seen = True
+                        break
+                    batch.append(item)
+
+            if stop_seen:
+                # Drain whatever is still queued so a clean shutdown loses nothing.
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            for start in range(0, len(batch), self.batch_size):
+                self._flush(batch[start:start + self.batch_size])
+            self._tick()
+        close_old_connections()
@@ -0,0 +1,163 @@
+# metrastics/database.py
+"""
+SQLite production profile.
+
+The listener's ingest writer, its periodic jobs and the dashboard's request threads all write
+to the same database file. `sqlite_options()` builds the DATABASES OPTIONS that make this work
+well on SQLite: WAL journaling (readers no longer block the writer), synchronous=NORMAL, a busy
+timeout, page cache and mmap sizes applied to every new connection, and write transactions that
+take the write lock up front (BEGIN IMMEDIATE) so lock waits go through the busy timeout instead
+of failing halfway through a transaction.
+
+`retry_on_lock()` retries a transaction that still hit "database is locked" with bounded,
+jittered backoff, and `run_maintenance()` is the periodic ANALYZE / PRAGMA optimize /
+incremental vacuum job.
+"""
+import logging
+import random
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import OperationalError, connections
+
+from metrastics import metrics
+
+logger = logging.getLogger(__name__)
+
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+AUTO_VACUUM_INCREMENTAL = 2
+
+LOCK_RETRIES = metrics.counter('metrastics_db_lock_retries_total',
+                               'Transactions retried after "database is locked".', ['operation'])
+LOCK_FAILURES = metrics.counter('metrastics_db_lock_failures_total',
+                                'Transactions given up after the last lock retry.', ['operation'])
+MAINTENANCE_SECONDS = metrics.histogram('metrastics_db_maintenance_seconds',
+                                        'Duration of the periodic SQLite maintenance job.')
+
+
+def sqlite_options(busy_timeout: float = 20.0, synchronous: str = 'NORMAL', cache_size_mb: int = 64,
+                   mmap_size_mb: int = 256, journal_size_limit_mb: int = 64) -> dict:
+    """
+    OPTIONS of a SQLite database entry. The pragmas are run by Django on every new connection
+    (`init_command`); journal_mode=WAL is persistent, the others are per connection.
+    """
+    synchronous = str(synchronous).upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SYNCHRONOUS_MODES)}, not {synchronous}.")
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        f'PRAGMA synchronous={synchronous}',
+        f'PRAGMA cache_size={-int(cache_size_mb) * 1024}',  # Negative values are KiB
+        f'PRAGMA mmap_size={int(mmap_size_mb) * 1024 * 1024}',
+        f'PRAGMA journal_size_limit={int(journal_size_limit_mb) * 1024 * 1024}',
+        'PRAGMA temp_store=MEMORY',
+    ]
+    return {
+        'timeout': float(busy_timeout),  # sqlite3 busy handler, in seconds
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': ';'.join(pragmas),
+    }
+
+
+def is_sqlite(using: str = 'default') -> bool:
+    return connections[using].vendor == 'sqlite'
+
+
+def is_lock_error(error: BaseException) -> bool:
+    if not isinstance(error, OperationalError):
+        return False
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_lock(function: Callable, *args, operation: Optional[str] = None, attempts: Optional[int] = None,
+                  backoff: Optional[float] = None, backoff_max: Optional[float] = None, **kwargs):
+    """
+    Calls `function(*args, **kwargs)`, which must run its own transaction, and calls it again
+    if it failed with "database is locked". Waits between attempts double from `backoff` up to
+    `backoff_max` seconds (half of each wait jittered); after `attempts` retries the error is raised.
+
+    With BEGIN IMMEDIATE transactions the lock error is raised when the transaction starts, before
+    the function changed anything, so retrying it is safe.
+    """
+    operation = operation or getattr(function, '__name__', 'transaction')
+    if attempts is None:
+        attempts = getattr(settings, 'DATABASE_LOCK_RETRIES', 5)
+    if backoff is None:
+        backoff = getattr(settings, 'DATABASE_LOCK_RETRY_BACKOFF', 0.1)
+    if backoff_max is None:
+        backoff_max = getattr(settings, 'DATABASE_LOCK_RETRY_BACKOFF_MAX', 2.0)
+
+    attempt = 0
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            if attempt >= attempts:
+                LOCK_FAILURES.labels(operation).inc()
+                raise
+            delay = min(backoff_max, backoff * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            attempt += 1
+            LOCK_RETRIES.labels(operation).inc()
+            logger.warning(f"{operation}: database is locked, retry {attempt}/{attempts} in {delay:.2f}s.")
+            time.sleep(delay)
+
+
+def run_maintenance(using: str = 'default', vacuum_pages: Optional[int] = None, full_vacuum: bool = False) -> dict:
+    """
+    Keeps the query planner statistics current and returns free pages to the file system.
+
+    The first run (no sqlite_stat1 yet) runs a full ANALYZE, later runs PRAGMA optimize, which only
+    re-analyzes tables whose size changed a lot. With auto_vacuum=INCREMENTAL up to `vacuum_pages`
+    free pages are released; `full_vacuum` switches a database to incremental auto-vacuum with a
+    one-off VACUUM, which rewrites the whole file and blocks all writers while it runs.
+    Does nothing on other databases than SQLite.
+    """
+    if not is_sqlite(using):
+        return {'vendor': connections[using].vendor, 'skipped': True}
+    if vacuum_pages is None:
+        vacuum_pages = getattr(settings, 'SQLITE_INCREMENTAL_VACUUM_PAGES', 1000)
+
+    started_at = time.perf_counter()
+    result = {'vendor': 'sqlite', 'skipped': False}
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            cursor.execute('ANALYZE')
+            result['analyzed'] = 'full'
+        else:
+            cursor.execute('PRAGMA optimize')
+            cursor.fetchall()
+            result['analyzed'] = 'optimize'
+
+        if full_vacuum:
+            cursor.execute(f'PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}')
+            cursor.execute('VACUUM')
+            result['vacuumed'] = 'full'
+
+        cursor.execute('PRAGMA auto_vacuum')
+        auto_vacuum = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        free_pages = cursor.fetchone()[0]
+        if auto_vacuum == AUTO_VACUUM_INCREMENTAL and free_pages and vacuum_pages > 0:
+            cursor.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+            cursor.fetchall()
+            result['vacuumed'] = min(free_pages, int(vacuum_pages))
+        elif auto_vacuum != AUTO_VACUUM_INCREMENTAL and free_pages:
+            logger.info(f"{free_pages} free database pages can only be released with a full VACUUM "
+                        f"(python manage.py optimize_database --vacuum).")
+        cursor.execute('PRAGMA freelist_count')
+        result['free_pages'] = cursor.fetchone()[0]
+        cursor.execute('PRAGMA journal_mode')
+        result['journal_mode'] = cursor.fetchone()[0]
+
+    duration = time.perf_counter() - started_at
+    MAINTENANCE_SECONDS.observe(duration)
+    result['seconds'] = round(duration, 3)
+    logger.info(f"Database maintenance done: {result}")
+    return result
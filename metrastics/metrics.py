@@ -0,0 +1,306 @@
+# metrastics/metrics.py
+"""
+Process-wide metrics registry in the Prometheus text exposition format.
+
+The listener (which runs inside the Django process when started by runserver) and the
+Django views record into the same registry; both the listener's Flask app and Django serve
+it at /metrics.
+
+Updates are lock-free on the hot path: every thread increments its own cell, and cells are
+only summed when the metrics are rendered. A lock is taken once per thread and metric child,
+when the thread's cell is created and when it is folded into the child's total as the thread ends.
+"""
+import bisect
+import math
+import threading
+import weakref
+from time import perf_counter as _perf_counter
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Seconds; from sub-millisecond helpers up to slow batches, ChatGPT calls and queued replies.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _ThreadCell:
+    """Holder of a thread's cell, only referenced by the thread-local; collected when the thread ends."""
+    __slots__ = ('values', '__weakref__')
+
+    def __init__(self, values: list):
+        self.values = values
+
+
+class _ThreadCells:
+    """
+    Per-thread value cells of one metric child. `size` values per cell. When a thread ends, its
+    cell is folded into a shared base, so short-lived threads (one per request with threaded
+    servers) do not leave cells behind.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells: Dict[int, list] = {}
+        self._base = [0] * size
+        self._lock = threading.Lock()
+
+    def cell(self) -> list:
+        try:
+            return self._local.cell.values
+        except AttributeError:
+            values = [0] * self._size
+            holder = _ThreadCell(values)
+            with self._lock:
+                self._cells[id(values)] = values
+            weakref.finalize(holder, self._retire, values)
+            self._local.cell = holder
+            return values
+
+    def _retire(self, values: list):
+        with self._lock:
+            del self._cells[id(values)]
+            for index, value in enumerate(values):
+                self._base[index] += value
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def totals(self) -> list:
+        with self._lock:
+            totals = list(self._base)
+            cells = list(self._cells.values())
+        for cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class CounterChild:
+    def __init__(self):
+        self._cells = _ThreadCells(1)
+
+    def inc(self, amount: float = 1):
+        self._cells.cell()[0] += amount
+
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def dec(self, amount: float = 1):
+        self._value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """The gauge reads its value from `function` whenever the metrics are rendered."""
+        self._function = function
+
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return math.nan
+        return self._value
+
+
+class HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # One counter per bucket, then sum and count.
+        self._cells = _ThreadCells(len(buckets) + 3)
+
+    def observe(self, value: float):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def time(self) -> '_Timer':
+        """Context manager that observes the duration of its block."""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[list, float, int]:
+        totals = self._cells.totals()
+        cumulative = []
+        running = 0
+        for count in totals[:len(self._buckets) + 1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-2], totals[-1]
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_started_at')
+
+    def __init__(self, histogram: HistogramChild):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started_at = _perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(_perf_counter() - self._started_at)
+        return False
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """Returns the child for one combination of label values. Keep it around on hot paths."""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default_child(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use labels().")
+        return self.labels()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(list(zip(self.labelnames, values)), child))
+        return lines
+
+    def _render_child(self, labels: list, child) -> list:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(child.value())}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default_child().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self._default_child().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default_child().set_function(function)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default_child().observe(value)
+
+    def time(self):
+        return self._default_child().time()
+
+    def _render_child(self, labels: list, child) -> list:
+        cumulative, total, count = child.snapshot()
+        lines = []
+        for bound, bucket_count in zip(self.buckets + (math.inf,), cumulative):
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {bucket_count}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered as a different {metric.kind}.")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
@@ -16,6 +16,8 @@ import os
 import dotenv
 import dj_database_url
 
+from metrastics.database import SQLITE_ENGINE, sqlite_options
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -56,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'metrastics_dashboard.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,7 +94,51 @@ WSGI_APPLICATION = 'metrastics.wsgi.application'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 DATABASE_URL = os.getenv('DATABASE_URL', f"sqlite:///{BASE_DIR / 'db.sqlite3'}")
-DATABASES = {'default': dj_database_url.parse(DATABASE_URL)}
+# Persistent connections: seconds a connection is reused (0 = a new connection per request/batch); checked before reuse
+DATABASE_CONN_MAX_AGE = int(os.getenv('DATABASE_CONN_MAX_AGE', '600'))
+DATABASES = {'default': dj_database_url.parse(DATABASE_URL, conn_max_age=DATABASE_CONN_MAX_AGE,
+                                              conn_health_checks=True)}
+# SQLite profile (WAL, pragmas on every connection, BEGIN IMMEDIATE), see metrastics/database.py
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '20')) # Seconds a connection waits for the write lock
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL') # NORMAL is durable in WAL mode except on power loss
+SQLITE_CACHE_SIZE_MB = int(os.getenv('SQLITE_CACHE_SIZE_MB', '64')) # Page cache per connection
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', '256')) # 0 disables memory-mapped reads
+SQLITE_JOURNAL_SIZE_LIMIT_MB = int(os.getenv('SQLITE_JOURNAL_SIZE_LIMIT_MB', '64')) # WAL file is truncated to this after checkpoints
+if DATABASES['default']['ENGINE'] == SQLITE_ENGINE:
+    DATABASES['default'].setdefault('OPTIONS', {}).update(sqlite_options(
+        busy_timeout=SQLITE_BUSY_TIMEOUT, synchronous=SQLITE_SYNCHRONOUS, cache_size_mb=SQLITE_CACHE_SIZE_MB,
+        mmap_size_mb=SQLITE_MMAP_SIZE_MB, journal_size_limit_mb=SQLITE_JOURNAL_SIZE_LIMIT_MB))
+# Transactions that still find the database locked are retried with jittered exponential backoff
+DATABASE_LOCK_RETRIES = int(os.getenv('DATABASE_LOCK_RETRIES', '5'))
+DATABASE_LOCK_RETRY_BACKOFF = float(os.getenv('DATABASE_LOCK_RETRY_BACKOFF', '0.1')) # Seconds before the first retry
+DATABASE_LOCK_RETRY_BACKOFF_MAX = float(os.getenv('DATABASE_LOCK_RETRY_BACKOFF_MAX', '2.0')) # Seconds
+# Periodic ANALYZE / PRAGMA optimize / incremental vacuum, run by the listener
+DATABASE_MAINTENANCE_INTERVAL = float(os.getenv('DATABASE_MAINTENANCE_INTERVAL', '3600')) # Seconds; 0 disables
+SQLITE_INCREMENTAL_VACUUM_PAGES = int(os.getenv('SQLITE_INCREMENTAL_VACUUM_PAGES', '1000')) # Free pages released per run
+# Network metric rollups (AverageMetricsHistory), written by the listener and read by the dashboard stats and charts
+ROLLUP_BUCKET_SECONDS = float(os.getenv('ROLLUP_BUCKET_SECONDS', '300'))
+ROLLUP_INTERVAL = float(os.getenv('ROLLUP_INTERVAL', '60')) # Seconds between rollup runs; 0 disables the listener job
+ROLLUP_DELAY = float(os.getenv('ROLLUP_DELAY', '60')) # Seconds a bucket must be complete before it is rolled up
+ROLLUP_BACKFILL_DAYS = float(os.getenv('ROLLUP_BACKFILL_DAYS', '30')) # History computed from existing packets on the first run
+ROLLUP_MAX_BUCKETS = int(os.getenv('ROLLUP_MAX_BUCKETS', '288')) # Buckets computed per run while catching up
+# Polled dashboard APIs answer unchanged data with 304 Not Modified (ETags from change sequences)
+ETAG_SEQUENCE_MAX_AGE = float(os.getenv('ETAG_SEQUENCE_MAX_AGE', '1.0')) # Seconds the sequences are reused per process
+# Node names of the dashboard lists (live packets, messages, traceroutes) are served from a per-process cache
+NODE_NAME_CACHE_SIZE = int(os.getenv('NODE_NAME_CACHE_SIZE', '10000'))
+NODE_NAME_CACHE_TTL = float(os.getenv('NODE_NAME_CACHE_TTL', '300')) # Seconds; bounds staleness of names changed outside the listener
+NODE_NAME_CHECK_INTERVAL = float(os.getenv('NODE_NAME_CHECK_INTERVAL', '1.0')) # Seconds between checks for renamed or new nodes
+# v2 node listing (/dashboard/api/v2/nodes/) is paginated with cursors
+NODE_LIST_MAX_PAGE_SIZE = int(os.getenv('NODE_LIST_MAX_PAGE_SIZE', '1000')) # Max nodes per page, also the default ?limit=
+# Retention of old rows, applied by the listener in small chunks (and by the apply_retention command); 0 days disables a policy
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600')) # Seconds between runs; 0 disables the listener job
+RETENTION_MAX_SECONDS = float(os.getenv('RETENTION_MAX_SECONDS', '60')) # Time budget of one listener run
+RETENTION_PACKET_DAYS = float(os.getenv('RETENTION_PACKET_DAYS', '30')) # Message packets are kept, without their JSON
+RETENTION_TELEMETRY_DAYS = float(os.getenv('RETENTION_TELEMETRY_DAYS', '7')) # Older telemetry is downsampled to means ...
+RETENTION_TELEMETRY_BUCKET = float(os.getenv('RETENTION_TELEMETRY_BUCKET', '3600')) # ... per node and this many seconds
+RETENTION_POSITION_DAYS = float(os.getenv('RETENTION_POSITION_DAYS', '7')) # Older positions are thinned to one ...
+RETENTION_POSITION_BUCKET = float(os.getenv('RETENTION_POSITION_BUCKET', '600')) # ... per node and this many seconds
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', '500')) # Max rows deleted per transaction
+RETENTION_CHUNK_PAUSE = float(os.getenv('RETENTION_CHUNK_PAUSE', '0.05')) # Seconds between chunks, leaves the write lock to ingest
 
 
 # Password validation
@@ -143,8 +190,43 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Meshtastic Settings from .env
 MESHTASTIC_DEVICE_HOST = os.getenv('MESHTASTIC_DEVICE_HOST', 'localhost')
 MESHTASTIC_DEVICE_PORT = int(os.getenv('MESHTASTIC_DEVICE_PORT', '4403'))
+# Several gateways in one listener: comma-separated "name=host:port" entries. Empty means the single device above.
+MESHTASTIC_GATEWAYS = os.getenv('MESHTASTIC_GATEWAYS', '')
 # Port for the Flask app in listen_device.py that handles sending messages
 LISTENER_FLASK_PORT = os.getenv('LISTENER_FLASK_PORT', '5555')
+# Listener supervisor: a dropped gateway is reconnected right away, then with jittered exponential backoff
+LISTENER_RECONNECT_BACKOFF_BASE = float(os.getenv('LISTENER_RECONNECT_BACKOFF_BASE', '1.0')) # Seconds
+LISTENER_RECONNECT_BACKOFF_MAX = float(os.getenv('LISTENER_RECONNECT_BACKOFF_MAX', '60.0')) # Seconds
+LISTENER_HEARTBEAT_INTERVAL = float(os.getenv('LISTENER_HEARTBEAT_INTERVAL', '10.0')) # Socket check and status row refresh
+LISTENER_RESTART_POLL_INTERVAL = float(os.getenv('LISTENER_RESTART_POLL_INTERVAL', '1.0')) # Seconds
+# Batched write-behind ingest: packets are queued by the reader thread and written by a dedicated writer thread
+LISTENER_INGEST_BATCH_SIZE = int(os.getenv('LISTENER_INGEST_BATCH_SIZE', '100'))
+LISTENER_INGEST_FLUSH_INTERVAL = float(os.getenv('LISTENER_INGEST_FLUSH_INTERVAL', '1.0')) # Seconds
+LISTENER_INGEST_QUEUE_SIZE = int(os.getenv('LISTENER_INGEST_QUEUE_SIZE', '5000'))
+# Overload policy: above the high-water mark (share of the queue size) Telemetry/Position samples of a node are
+# coalesced and low-value packets (Other, Encrypted) are sampled; Messages and Routing packets are never dropped
+LISTENER_INGEST_HIGH_WATER = float(os.getenv('LISTENER_INGEST_HIGH_WATER', '0.5'))
+LISTENER_INGEST_SAMPLE_RATE = int(os.getenv('LISTENER_INGEST_SAMPLE_RATE', '10')) # Keep 1 of N low-value packets
+# In-memory node cache: node changes are coalesced and written back with bulk_update
+LISTENER_NODE_CACHE_SIZE = int(os.getenv('LISTENER_NODE_CACHE_SIZE', '10000'))
+LISTENER_NODE_FLUSH_INTERVAL = float(os.getenv('LISTENER_NODE_FLUSH_INTERVAL', '5.0')) # Seconds
+LISTENER_DEDUPE_WINDOW_SECONDS = float(os.getenv('LISTENER_DEDUPE_WINDOW_SECONDS', '600')) # Seconds
+LISTENER_DEDUPE_MAX_ENTRIES = int(os.getenv('LISTENER_DEDUPE_MAX_ENTRIES', '50000'))
+# Live event stream (Server-Sent Events on the listener's /events endpoint)
+LISTENER_EVENTS_BUFFER_SIZE = int(os.getenv('LISTENER_EVENTS_BUFFER_SIZE', '1000')) # Events kept for clients that reconnect
+LISTENER_EVENTS_KEEPALIVE = float(os.getenv('LISTENER_EVENTS_KEEPALIVE', '15')) # Seconds between keep-alive comments
+LISTENER_EVENTS_MAX_SUBSCRIBERS = int(os.getenv('LISTENER_EVENTS_MAX_SUBSCRIBERS', '100')) # Each open stream holds a server thread
+
+# Outbound messages (commander replies and dashboard sends) are paced against the LoRa duty cycle
+OUTBOUND_DUTY_CYCLE_PERCENT = float(os.getenv('OUTBOUND_DUTY_CYCLE_PERCENT', '10')) # Share of airtime we may use
+OUTBOUND_DUTY_CYCLE_WINDOW = float(os.getenv('OUTBOUND_DUTY_CYCLE_WINDOW', '600')) # Seconds; limits bursts
+OUTBOUND_BITRATE_BPS = float(os.getenv('OUTBOUND_BITRATE_BPS', '1070')) # LongFast; used to estimate airtime
+OUTBOUND_MIN_INTERVAL = float(os.getenv('OUTBOUND_MIN_INTERVAL', '1.0')) # Seconds between two packets
+OUTBOUND_MAX_PART_BYTES = int(os.getenv('OUTBOUND_MAX_PART_BYTES', '200'))
+OUTBOUND_MAX_PARTS = int(os.getenv('OUTBOUND_MAX_PARTS', '5'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+OUTBOUND_RETRY_BACKOFF = float(os.getenv('OUTBOUND_RETRY_BACKOFF', '2.0')) # Seconds, doubled per attempt
+OUTBOUND_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', '200'))
 
 
 LOGGING = {
@@ -177,6 +259,11 @@ LOGGING = {
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO').upper(),
             'propagate': True,
         },
+        'metrastics_listener': {
+            'handlers': ['console'],
+            'level': os.getenv('LISTENER_LOG_LEVEL', 'INFO').upper(),
+            'propagate': False,
+        },
         'metrastics_listener.management.commands.listen_device': {
             'handlers': ['console'],
             'level': os.getenv('LISTENER_LOG_LEVEL', 'INFO').upper(),
@@ -209,10 +296,25 @@ LOGGING = {
     }
 }
 
+# Commander worker pool (rules, ChatGPT calls and replies run outside the ingest writer)
+COMMANDER_WORKERS = int(os.getenv('COMMANDER_WORKERS', '2')) # Parallel commander jobs (rules, ChatGPT, replies)
+COMMANDER_QUEUE_SIZE = int(os.getenv('COMMANDER_QUEUE_SIZE', '200')) # Queued jobs per worker before new ones are dropped
+COMMANDER_COOLDOWN_FLUSH_INTERVAL = float(os.getenv('COMMANDER_COOLDOWN_FLUSH_INTERVAL', '5.0')) # Seconds between cooldown writes
+COMMANDER_RULES_CHECK_INTERVAL = float(os.getenv('COMMANDER_RULES_CHECK_INTERVAL', '2.0')) # Seconds between rule version checks
+
 # ChatGPT Integration Settings from .env
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', "your_openai_api_key_here")
 CHATGPT_TRIGGER_COMMAND = os.getenv('CHATGPT_TRIGGER_COMMAND', "!chat")
 CHATGPT_SYSTEM_PROMPT = os.getenv('CHATGPT_SYSTEM_PROMPT', "You are a helpful assistant on a Meshtastic network. Keep your answers concise due to message length limitations. Max 200byte Answer")
+CHATGPT_MODEL = os.getenv('CHATGPT_MODEL', 'gpt-3.5-turbo')
+CHATGPT_MAX_TOKENS = int(os.getenv('CHATGPT_MAX_TOKENS', '150'))
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None # Any OpenAI-compatible server; default is api.openai.com
+CHATGPT_WORKERS = int(os.getenv('CHATGPT_WORKERS', '2')) # Max concurrent ChatGPT requests
+CHATGPT_TIMEOUT = float(os.getenv('CHATGPT_TIMEOUT', '20')) # Seconds before a request is given up
+CHATGPT_CACHE_SIZE = int(os.getenv('CHATGPT_CACHE_SIZE', '256')) # Cached answers for repeated queries; 0 disables
+CHATGPT_CACHE_TTL = float(os.getenv('CHATGPT_CACHE_TTL', '600')) # Seconds
+CHATGPT_BREAKER_THRESHOLD = int(os.getenv('CHATGPT_BREAKER_THRESHOLD', '3')) # Consecutive failures before failing fast
+CHATGPT_BREAKER_RESET = float(os.getenv('CHATGPT_BREAKER_RESET', '60')) # Seconds before trying again
 
 if OPENAI_API_KEY == "your_openai_api_key_here" or not OPENAI_API_KEY:
     print("Warning: OPENAI_API_KEY is not set or using placeholder. ChatGPT features will not work.")
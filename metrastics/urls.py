@@ -2,8 +2,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from metrastics_dashboard.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Prometheus scrape endpoint; shares its registry with the listener when both run in one process
+    path('metrics', metrics_view, name='metrics'),
     # Provide a unique instance namespace for the '/dashboard/' path
     path('dashboard/', include('metrastics_dashboard.urls', namespace='dashboard_main')),
     path('commander/', include('metrastics_commander.urls')),
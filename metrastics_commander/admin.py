@@ -1,6 +1,6 @@
 # metrastics_commander/admin.py
 from django.contrib import admin
-from .models import CommanderRule, CommanderSettings
+from .models import CommanderCooldown, CommanderRule, CommanderSettings
 
 @admin.register(CommanderRule)
 class CommanderRuleAdmin(admin.ModelAdmin):
@@ -13,10 +13,10 @@ class CommanderRuleAdmin(admin.ModelAdmin):
         }),
         ('Status (Automatisch verwaltet)', {
             'classes': ('collapse',),
-            'fields': ('last_triggered_for_nodes', 'created_at', 'updated_at'),
+            'fields': ('created_at', 'updated_at'),
         }),
     )
-    readonly_fields = ('last_triggered_for_nodes', 'created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at')
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -35,6 +35,15 @@ class CommanderRuleAdmin(admin.ModelAdmin):
         return form
 
 
+@admin.register(CommanderCooldown)
+class CommanderCooldownAdmin(admin.ModelAdmin):
+    list_display = ('rule', 'node_num', 'expires_at')
+    list_filter = ('rule',)
+    search_fields = ('rule__name', 'node_num')
+    raw_id_fields = ('rule',)
+
+
 @admin.register(CommanderSettings)
 class CommanderSettingsAdmin(admin.ModelAdmin):
-    list_display = ('chatbot_mode_enabled',)
\ No newline at end of file
+    list_display = ('chatbot_mode_enabled',)
+    readonly_fields = ('rules_version',)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MetrasticsCommanderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'metrastics_commander'
+
+    def ready(self):
+        from . import signals  # noqa: F401
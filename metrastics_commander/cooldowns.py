@@ -0,0 +1,133 @@
+# metrastics_commander/cooldowns.py
+import heapq
+import logging
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+
+from metrastics.batching import BatchWriter
+from metrastics_commander.models import CommanderCooldown, CommanderRule
+
+logger = logging.getLogger(__name__)
+
+
+class CooldownStore:
+    """
+    Commander cooldowns per (rule id, sender node num).
+
+    Expiries are kept in memory as monotonic timestamps, so a cooldown check is a single dict
+    lookup. Expired entries are evicted through a heap ordered by expiry. Every trigger is also
+    written to the CommanderCooldown table by a background writer, so cooldowns survive restarts.
+    """
+
+    def __init__(self, flush_interval: float = 5.0, purge_interval: float = 300.0):
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        self._expiry = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._writer: Optional[BatchWriter] = None
+        self._next_purge = 0.0
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear()
+            self._heap.clear()
+
+    def load(self):
+        """Loads the cooldowns that have not expired yet from the database."""
+        now_epoch = time.time()
+        now = time.monotonic()
+        rows = CommanderCooldown.objects.filter(expires_at__gt=now_epoch).values_list('rule_id', 'node_num', 'expires_at')
+        with self._lock:
+            self._expiry.clear()
+            self._heap.clear()
+            for rule_id, node_num, expires_at in rows:
+                self._set((rule_id, node_num), now + (expires_at - now_epoch))
+        logger.info(f"Loaded {len(self._expiry)} active commander cooldowns.")
+
+    def is_active(self, rule_id: int, node_num: Optional[int]) -> bool:
+        expiry = self._expiry.get((rule_id, node_num))
+        return expiry is not None and expiry > time.monotonic()
+
+    def trigger(self, rule_id: int, node_num: Optional[int], cooldown_seconds: int):
+        """Starts the cooldown of a rule for a node and queues it for the database."""
+        if node_num is None or cooldown_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            self._set((rule_id, node_num), now + cooldown_seconds)
+        record = {'rule_id': rule_id, 'node_num': node_num, 'expires_at': time.time() + cooldown_seconds}
+        if self._writer is not None and self._writer.is_running:
+            self._writer.submit(record)
+        else:
+            self.write([record])
+
+    def _set(self, key: tuple, expiry: float):
+        self._expiry[key] = expiry
+        heapq.heappush(self._heap, (expiry, key))
+
+    def _evict(self, now: float):
+        while self._heap and self._heap[0][0] <= now:
+            expiry, key = heapq.heappop(self._heap)
+            # Only drop the entry if it was not re-triggered since this heap item was pushed.
+            if self._expiry.get(key) == expiry:
+                del self._expiry[key]
+
+    def write(self, records: list):
+        latest = {}
+        for record in records:
+            latest[(record['rule_id'], record['node_num'])] = record['expires_at']
+        existing_rule_ids = set(CommanderRule.objects.filter(
+            pk__in={rule_id for rule_id, _ in latest}).values_list('pk', flat=True))
+        cooldowns = [CommanderCooldown(rule_id=rule_id, node_num=node_num, expires_at=expires_at)
+                     for (rule_id, node_num), expires_at in latest.items() if rule_id in existing_rule_ids]
+        if cooldowns:
+            CommanderCooldown.objects.bulk_create(cooldowns, update_conflicts=True, unique_fields=['rule', 'node_num'],
+                                                  update_fields=['expires_at'])
+
+    def purge_if_due(self):
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        with self._lock:
+            self._evict(now)
+        deleted, _ = CommanderCooldown.objects.filter(expires_at__lt=time.time()).delete()
+        if deleted:
+            logger.debug(f"Purged {deleted} expired commander cooldowns.")
+
+    def start_writer(self):
+        if self._writer is not None and self._writer.is_running:
+            return
+        self._writer = BatchWriter(flush_callback=self.write, tick_callback=self.purge_if_due,
+                                   batch_size=500, flush_interval=self.flush_interval, max_queue_size=10000,
+                                   name='cooldown-writer')
+        self._writer.start()
+
+    def stop_writer(self):
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
+    def stats(self) -> dict:
+        stats = {'active': len(self._expiry)}
+        if self._writer is not None:
+            stats['writer'] = self._writer.stats()
+        return stats
+
+
+_cooldown_store: Optional[CooldownStore] = None
+
+
+def get_cooldown_store() -> CooldownStore:
+    global _cooldown_store
+    if _cooldown_store is None:
+        _cooldown_store = CooldownStore(flush_interval=getattr(settings, 'COMMANDER_COOLDOWN_FLUSH_INTERVAL', 5.0))
+    return _cooldown_store
@@ -0,0 +1,143 @@
+# metrastics_commander/dispatcher.py
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Optional
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class CommanderDispatcher:
+    """
+    Worker pool that runs commander jobs (rule evaluation, ChatGPT calls, replies) away from
+    the ingest writer.
+
+    Every worker owns a bounded queue. Jobs with the same key (the sender node) always go to
+    the same worker, so messages of one node are handled in order and rule cooldowns are not
+    checked by two workers at once. Queue wait and run times are tracked for `stats()`.
+    """
+
+    def __init__(self, handler: Callable[..., None], workers: int = 2, max_queue_size: int = 200,
+                 name: str = 'commander-worker'):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.name = name
+        self._queues = [queue.Queue(maxsize=self.max_queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self._running = False
+        self._lock = threading.Lock()
+        self.submitted_count = 0
+        self.dropped_count = 0
+        self.completed_count = 0
+        self.failed_count = 0
+        self.busy_workers = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._run_seconds_total = 0.0
+        self._run_seconds_max = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._running and any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        if self.is_running:
+            return
+        self._running = True
+        self._threads = []
+        for index, job_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(job_queue,), name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Commander dispatcher started ({self.workers} workers, queue size {self.max_queue_size} each).")
+
+    def submit(self, key: Optional[str], *args: Any) -> bool:
+        """Queues a job for `handler(*args)` without blocking. Returns False if the worker's queue is full."""
+        job_queue = self._queues[zlib.crc32(str(key).encode('utf-8')) % self.workers]
+        try:
+            job_queue.put_nowait((time.monotonic(), args))
+        except queue.Full:
+            with self._lock:
+                self.dropped_count += 1
+            logger.warning(f"Commander queue full ({self.max_queue_size} jobs), dropping job for {key}. "
+                           f"Dropped so far: {self.dropped_count}")
+            return False
+        with self._lock:
+            self.submitted_count += 1
+        return True
+
+    def stop(self, timeout: Optional[float] = 30.0):
+        """Stops the workers after the queued jobs have been processed."""
+        if not self._threads:
+            return
+        self._running = False
+        for job_queue in self._queues:
+            job_queue.put(_STOP)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in self._threads):
+            logger.error(f"Commander workers did not finish within {timeout}s, {self.queue_depth()} jobs left.")
+        else:
+            logger.info(f"Commander dispatcher stopped. {self.completed_count} jobs done, {self.failed_count} failed.")
+        self._threads = []
+
+    def queue_depth(self) -> int:
+        return sum(job_queue.qsize() for job_queue in self._queues)
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.completed_count + self.failed_count
+            return {
+                'workers': self.workers,
+                'busy_workers': self.busy_workers,
+                'queue_depth': self.queue_depth(),
+                'queue_size': self.max_queue_size * self.workers,
+                'submitted': self.submitted_count,
+                'dropped': self.dropped_count,
+                'completed': self.completed_count,
+                'failed': self.failed_count,
+                'avg_wait_ms': round(self._wait_seconds_total / finished * 1000, 1) if finished else 0.0,
+                'max_wait_ms': round(self._wait_seconds_max * 1000, 1),
+                'avg_run_ms': round(self._run_seconds_total / finished * 1000, 1) if finished else 0.0,
+                'max_run_ms': round(self._run_seconds_max * 1000, 1),
+            }
+
+    def _run(self, job_queue: queue.Queue):
+        while True:
+            item = job_queue.get()
+            if item is _STOP:
+                break
+            enqueued_at, args = item
+            started_at = time.monotonic()
+            with self._lock:
+                self.busy_workers += 1
+            failed = False
+            try:
+                close_old_connections()
+                self.handler(*args)
+            except Exception as e:
+                failed = True
+                logger.exception(f"Commander job failed: {e}")
+            finally:
+                finished_at = time.monotonic()
+                with self._lock:
+                    self.busy_workers -= 1
+                    if failed:
+                        self.failed_count += 1
+                    else:
+                        self.completed_count += 1
+                    wait_seconds = started_at - enqueued_at
+                    run_seconds = finished_at - started_at
+                    self._wait_seconds_total += wait_seconds
+                    self._wait_seconds_max = max(self._wait_seconds_max, wait_seconds)
+                    self._run_seconds_total += run_seconds
+                    self._run_seconds_max = max(self._run_seconds_max, run_seconds)
+        close_old_connections()
@@ -0,0 +1,316 @@
+# metrastics_commander/llm_client.py
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Base class for errors raised by the LLM client itself (not by the backend)."""
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+class LLMUnavailableError(LLMError):
+    """The circuit breaker is open or all workers are busy; the request was not sent."""
+
+
+class OpenAIBackend:
+    """
+    Chat completion backend using one long-lived OpenAI client, so connections (and TLS
+    sessions) are reused between queries. `base_url` points the client at any
+    OpenAI-compatible server, e.g. a local fake in tests.
+    """
+
+    def __init__(self, api_key: str, model: str = 'gpt-3.5-turbo', max_tokens: int = 150,
+                 base_url: Optional[str] = None, timeout: float = 20.0):
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.base_url = base_url or None
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import openai
+                    # Retries are left to the caller: a retry would run past the request deadline.
+                    self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                 timeout=self.timeout, max_retries=0)
+        return self._client
+
+    def complete(self, system_prompt: str, user_query: str) -> str:
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_query}
+            ],
+            max_tokens=self.max_tokens
+        )
+        return (completion.choices[0].message.content or "").strip()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds. After that a single trial call is let through; its outcome closes or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def release_trial(self):
+        """Gives back a trial call that `allow()` let through but that never reached the backend."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"LLM circuit breaker opened after {self._failures} consecutive failures.")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class ResponseCache:
+    """LRU cache of answers with a time to live, keyed by the normalized query."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600.0):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value: str):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace are ignored, so "!chat Weather" and "!chat  weather " share a cache entry."""
+    return _WHITESPACE_RE.sub(' ', query).strip().lower()
+
+
+class LLMClient:
+    """
+    Runs chat completions on a bounded worker pool with a deadline per request.
+
+    Callers wait at most `deadline` seconds; a request still running after that is left to
+    finish in its worker, but keeps its worker slot, so a hung upstream can occupy at most
+    `workers` threads. When all slots are taken, or the circuit breaker is open, requests fail
+    fast with LLMUnavailableError. Successful answers are cached by normalized query.
+    """
+
+    def __init__(self, backend, system_prompt: str = '', workers: int = 2, deadline: float = 20.0,
+                 cache_size: int = 256, cache_ttl: float = 600.0, failure_threshold: int = 3,
+                 reset_timeout: float = 60.0):
+        self.backend = backend
+        self.system_prompt = system_prompt
+        self.workers = max(1, int(workers))
+        self.deadline = float(deadline)
+        self.cache = ResponseCache(cache_size, cache_ttl)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='llm-worker')
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.cache_hits = 0
+        self.rejected_count = 0
+        self.timeout_count = 0
+        self.error_count = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._backend_calls = 0
+
+    def ask(self, user_query: str) -> str:
+        """Returns the answer for `user_query`. Raises LLMError or the backend's exception."""
+        with self._lock:
+            self.request_count += 1
+        cache_key = (self.system_prompt, normalize_query(user_query))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            with self._lock:
+                self.cache_hits += 1
+            return cached
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected_count += 1
+            raise LLMUnavailableError(f"All {self.workers} LLM workers are busy")
+        if not self.breaker.allow():
+            self._slots.release()
+            with self._lock:
+                self.rejected_count += 1
+            raise LLMUnavailableError("LLM backend is failing, circuit breaker open")
+
+        started_at = time.monotonic()
+        try:
+            future = self._executor.submit(self._call_backend, user_query)
+        except RuntimeError:
+            self._slots.release()
+            self.breaker.release_trial()
+            raise LLMUnavailableError("LLM client is shut down")
+        try:
+            answer = future.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            self.breaker.record_failure()
+            with self._lock:
+                self.timeout_count += 1
+            raise LLMTimeoutError(f"No answer from LLM backend within {self.deadline:.0f}s")
+        except Exception:
+            self.breaker.record_failure()
+            with self._lock:
+                self.error_count += 1
+            raise
+
+        self.breaker.record_success()
+        latency = time.monotonic() - started_at
+        with self._lock:
+            self._backend_calls += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+        if answer:
+            self.cache.put(cache_key, answer)
+        return answer
+
+    def _call_backend(self, user_query: str) -> str:
+        try:
+            return self.backend.complete(self.system_prompt, user_query)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        close_backend = getattr(self.backend, 'close', None)
+        if close_backend is not None:
+            close_backend()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'requests': self.request_count,
+                'cache_hits': self.cache_hits,
+                'cache_entries': len(self.cache),
+                'rejected': self.rejected_count,
+                'timeouts': self.timeout_count,
+                'errors': self.error_count,
+                'circuit': self.breaker.state,
+                'avg_latency_ms': round(self._latency_total / self._backend_calls * 1000, 1) if self._backend_calls else 0.0,
+                'max_latency_ms': round(self._latency_max * 1000, 1),
+            }
+
+
+_llm_client: Optional[LLMClient] = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                deadline = getattr(settings, 'CHATGPT_TIMEOUT', 20.0)
+                backend = OpenAIBackend(
+                    api_key=settings.OPENAI_API_KEY,
+                    model=getattr(settings, 'CHATGPT_MODEL', 'gpt-3.5-turbo'),
+                    max_tokens=getattr(settings, 'CHATGPT_MAX_TOKENS', 150),
+                    base_url=getattr(settings, 'OPENAI_BASE_URL', None),
+                    timeout=deadline,
+                )
+                _llm_client = LLMClient(
+                    backend,
+                    system_prompt=settings.CHATGPT_SYSTEM_PROMPT,
+                    workers=getattr(settings, 'CHATGPT_WORKERS', 2),
+                    deadline=deadline,
+                    cache_size=getattr(settings, 'CHATGPT_CACHE_SIZE', 256),
+                    cache_ttl=getattr(settings, 'CHATGPT_CACHE_TTL', 600.0),
+                    failure_threshold=getattr(settings, 'CHATGPT_BREAKER_THRESHOLD', 3),
+                    reset_timeout=getattr(settings, 'CHATGPT_BREAKER_RESET', 60.0),
+                )
+    return _llm_client
+
+
+def close_llm_client():
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is not None:
+            _llm_client.close()
+            _llm_client = None
@@ -0,0 +1,115 @@
+# metrastics_commander/management/commands/benchmark_rules.py
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metrastics_commander.models import CommanderRule
+from metrastics_commander.rule_engine import RuleSnapshot
+
+WORDS = ['wetter', 'status', 'ping', 'hilfe', 'info', 'batterie', 'position', 'relay', 'repeater', 'gateway',
+         'berlin', 'hamburg', 'münchen', 'node', 'mesh', 'test', 'signal', 'snr', 'route', 'funk', 'solar',
+         'antenne', 'lora', 'kanal', 'notruf', 'treffen', 'heute', 'morgen', 'abend', 'danke']
+
+
+def legacy_first_match(rules: list, message_text: str):
+    """The linear rule loop the commander used before the compiled snapshot (baseline)."""
+    for rule in rules:
+        trigger = rule.trigger_phrase
+        if rule.match_type == 'exact':
+            match = (message_text == trigger)
+        elif rule.match_type == 'contains':
+            match = (trigger.lower() in message_text.lower())
+        elif rule.match_type == 'startswith':
+            match = message_text.lower().startswith(trigger.lower())
+        elif rule.match_type == 'regex':
+            try:
+                match = bool(re.search(trigger, message_text, re.IGNORECASE))
+            except re.error:
+                continue
+        else:
+            match = False
+        if match:
+            return rule
+    return None
+
+
+def build_rules(count: int, rng: random.Random) -> list:
+    rules = []
+    kinds = rng.choices(['contains', 'startswith', 'exact', 'regex'], weights=[40, 30, 25, 5], k=count)
+    for i, kind in enumerate(kinds):
+        if kind == 'regex':
+            trigger = rf"^!{rng.choice(WORDS)}{i}\s+(\d+|{rng.choice(WORDS)})$"
+        elif kind == 'startswith':
+            trigger = f"!{rng.choice(WORDS)}{i}"
+        elif kind == 'exact':
+            trigger = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}"
+        else:
+            trigger = f"{rng.choice(WORDS)}-{i}"
+        rules.append(CommanderRule(id=i + 1, name=f"rule-{i:04d}", trigger_phrase=trigger, match_type=kind,
+                                   response_template="ok", cooldown_seconds=0))
+    return rules
+
+
+def build_messages(count: int, rules: list, rng: random.Random) -> list:
+    messages = []
+    for _ in range(count):
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 25)))
+        if rng.random() < 0.3:
+            rule = rng.choice(rules)
+            if rule.match_type == 'exact':
+                text = rule.trigger_phrase
+            elif rule.match_type == 'startswith':
+                text = f"{rule.trigger_phrase.upper()} {text}"
+            elif rule.match_type == 'contains':
+                text = f"{text} {rule.trigger_phrase}"
+        messages.append(text[:200])
+    return messages
+
+
+class Command(BaseCommand):
+    help = 'Compares the compiled commander rule snapshot against the linear rule loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=1000, help='Number of rules.')
+        parser.add_argument('--messages', type=int, default=2000, help='Number of messages to match.')
+        parser.add_argument('--rounds', type=int, default=3, help='Timed rounds per matcher (best round counts).')
+
+    def _best_round(self, matcher, messages, rounds):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for message in messages:
+                matcher(message)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        rules = sorted(build_rules(options['rules'], rng), key=lambda rule: rule.name)
+        messages = build_messages(options['messages'], rules, rng)
+
+        start = time.perf_counter()
+        snapshot = RuleSnapshot(rules)
+        build_seconds = time.perf_counter() - start
+
+        matched = 0
+        for message in messages:
+            expected = legacy_first_match(rules, message)
+            actual = snapshot.first_match(message)
+            if expected is not actual:
+                raise CommandError(f"Matchers disagree on {message!r}: {expected} vs. {actual}")
+            matched += expected is not None
+
+        legacy_seconds = self._best_round(lambda message: legacy_first_match(rules, message), messages,
+                                          options['rounds'])
+        snapshot_seconds = self._best_round(snapshot.first_match, messages, options['rounds'])
+
+        count = len(messages)
+        self.stdout.write(f"Rules: {len(rules)}, messages: {count} ({matched} matching), results identical.")
+        self.stdout.write(f"snapshot build:        {build_seconds * 1000:8.1f} ms")
+        self.stdout.write(f"linear rule loop:      {legacy_seconds / count * 1e6:8.1f} us/message")
+        self.stdout.write(f"compiled rule matcher: {snapshot_seconds / count * 1e6:8.1f} us/message")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {legacy_seconds / snapshot_seconds:.1f}x"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_commander', '0002_commandersettings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commandersettings',
+            name='rules_version',
+            field=models.PositiveBigIntegerField(default=0, help_text='Wird bei jeder Änderung an Regeln oder Einstellungen erhöht, damit laufende Prozesse ihren Regel-Cache neu aufbauen.'),
+        ),
+    ]
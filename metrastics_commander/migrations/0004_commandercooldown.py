@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:13
+
+from datetime import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_cooldowns_to_table(apps, schema_editor):
+    """Converts the still running cooldowns of CommanderRule.last_triggered_for_nodes into CommanderCooldown rows."""
+    CommanderRule = apps.get_model('metrastics_commander', 'CommanderRule')
+    CommanderCooldown = apps.get_model('metrastics_commander', 'CommanderCooldown')
+    now = datetime.now().astimezone().timestamp()
+    cooldowns = []
+    for rule in CommanderRule.objects.exclude(cooldown_seconds=0).iterator():
+        if not isinstance(rule.last_triggered_for_nodes, dict):
+            continue
+        for node_id, last_triggered_iso in rule.last_triggered_for_nodes.items():
+            try:
+                node_num = int(str(node_id).lstrip('!'), 16)
+                expires_at = datetime.fromisoformat(last_triggered_iso).timestamp() + rule.cooldown_seconds
+            except (TypeError, ValueError):
+                continue
+            if expires_at > now:
+                cooldowns.append(CommanderCooldown(rule_id=rule.pk, node_num=node_num, expires_at=expires_at))
+    CommanderCooldown.objects.bulk_create(cooldowns, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_commander', '0003_commandersettings_rules_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommanderCooldown',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node_num', models.BigIntegerField(help_text='Knotennummer des Absenders, für den der Cooldown gilt.')),
+                ('expires_at', models.FloatField(db_index=True, help_text='Unix-Zeitstempel, bis zu dem die Regel für diesen Knoten pausiert.')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooldowns', to='metrastics_commander.commanderrule')),
+            ],
+            options={
+                'verbose_name': 'Commander Cooldown',
+                'verbose_name_plural': 'Commander Cooldowns',
+                'constraints': [models.UniqueConstraint(fields=('rule', 'node_num'), name='unique_commander_cooldown')],
+            },
+        ),
+        migrations.RunPython(move_cooldowns_to_table, migrations.RunPython.noop),
+    ]
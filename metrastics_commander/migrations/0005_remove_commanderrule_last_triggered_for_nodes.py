@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:13
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_commander', '0004_commandercooldown'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='commanderrule',
+            name='last_triggered_for_nodes',
+        ),
+    ]
@@ -26,10 +26,6 @@ class CommanderRule(models.Model):
         default=60,
         help_text="Minimale Zeit in Sekunden, bevor diese Regel für denselben Absenderknoten erneut ausgelöst wird. 0 für keinen Cooldown."
     )
-    # Stores last trigger time for each node_id to manage cooldowns
-    # Format: {"!nodeid1": "iso_timestamp", "!nodeid2": "iso_timestamp"}
-    last_triggered_for_nodes = models.JSONField(default=dict, blank=True, help_text="Zeitstempel der letzten Auslösung pro Knoten-ID für Cooldown-Management.")
-
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -42,12 +38,45 @@ class CommanderRule(models.Model):
         verbose_name_plural = "Commander Regeln"
 
 
+class CommanderCooldown(models.Model):
+    """Persisted cooldowns of the commander; the listener keeps them in memory (see cooldowns.py)."""
+    rule = models.ForeignKey(CommanderRule, related_name='cooldowns', on_delete=models.CASCADE)
+    node_num = models.BigIntegerField(help_text="Knotennummer des Absenders, für den der Cooldown gilt.")
+    expires_at = models.FloatField(db_index=True, help_text="Unix-Zeitstempel, bis zu dem die Regel für diesen Knoten pausiert.")
+
+    def __str__(self):
+        return f"Cooldown {self.rule_id} für !{self.node_num:08x}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'node_num'], name='unique_commander_cooldown'),
+        ]
+        verbose_name = "Commander Cooldown"
+        verbose_name_plural = "Commander Cooldowns"
+
+
 class CommanderSettings(models.Model):
     """Singleton model to store commander-wide settings."""
     chatbot_mode_enabled = models.BooleanField(
         default=False,
         help_text="Wenn aktiviert, werden alle Nachrichten direkt an ChatGPT weitergeleitet.",
     )
+    rules_version = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Wird bei jeder Änderung an Regeln oder Einstellungen erhöht, damit laufende Prozesse ihren Regel-Cache neu aufbauen.",
+    )
+
+    def save(self, *args, **kwargs):
+        # rules_version only changes through bump_rules_version(); saving a stale instance must not reset it.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'rules_version']
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump_rules_version(cls):
+        cls.get_solo()
+        cls.objects.filter(pk=1).update(rules_version=models.F('rules_version') + 1)
 
     @classmethod
     def get_solo(cls):
@@ -0,0 +1,199 @@
+# metrastics_commander/rule_engine.py
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+
+from metrastics_commander.models import CommanderRule, CommanderSettings
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher: finds all patterns in a text in O(len(text) + matches)."""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._built = True
+
+    def add(self, pattern: str, value):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(value)
+        self._built = False
+
+    def build(self):
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(char, 0)
+                # Outputs of the fallback state are reachable from here as well.
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+        self._built = True
+
+    def find_all(self, text: str) -> Iterator:
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        yield from out[0]
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if state:
+                yield from out[state]
+
+
+class PrefixTrie:
+    """Finds all patterns that are a prefix of a text in O(len(text))."""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, pattern: str, value):
+        node = self._root
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def find_all(self, text: str) -> Iterator:
+        node = self._root
+        yield from node.get(None, ())
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return
+            yield from node.get(None, ())
+
+
+class RuleSnapshot:
+    """
+    Immutable, pre-compiled view of the enabled commander rules.
+
+    `exact` triggers are looked up in a dict, `contains` triggers run through one Aho-Corasick
+    automaton and `startswith` triggers through one prefix trie, all on the lower-cased message.
+    Regex triggers are compiled once and only evaluated up to the first matching rule.
+    """
+
+    def __init__(self, rules: list, chatbot_mode_enabled: bool = False, version: int = 0):
+        self.rules = list(rules)
+        self.chatbot_mode_enabled = chatbot_mode_enabled
+        self.version = version
+        self._exact = {}
+        self._contains = AhoCorasick()
+        self._startswith = PrefixTrie()
+        self._regexes = []
+
+        for position, rule in enumerate(self.rules):
+            trigger = rule.trigger_phrase
+            if rule.match_type == 'exact':
+                self._exact.setdefault(trigger, []).append(position)
+            elif rule.match_type == 'contains':
+                self._contains.add(trigger.lower(), position)
+            elif rule.match_type == 'startswith':
+                self._startswith.add(trigger.lower(), position)
+            elif rule.match_type == 'regex':
+                try:
+                    self._regexes.append((position, re.compile(trigger, re.IGNORECASE)))
+                except re.error as e:
+                    logger.error(f"Regex error in rule '{rule.name}': {e}. Rule is ignored.")
+        self._contains.build()
+
+    def iter_matches(self, message_text: str) -> Iterator:
+        """Yields the matching rules in rule order (the order of the rule list)."""
+        lowered = message_text.lower()
+        candidates = set(self._exact.get(message_text, ()))
+        candidates.update(self._contains.find_all(lowered))
+        candidates.update(self._startswith.find_all(lowered))
+        ordered = sorted(candidates)
+
+        regex_index = 0
+        for position in heapq.merge(ordered, (position for position, _ in self._regexes)):
+            if regex_index < len(self._regexes) and self._regexes[regex_index][0] == position:
+                pattern = self._regexes[regex_index][1]
+                regex_index += 1
+                if not pattern.search(message_text):
+                    continue
+            yield self.rules[position]
+
+    def first_match(self, message_text: str):
+        return next(self.iter_matches(message_text), None)
+
+
+class RuleEngine:
+    """
+    Keeps the current RuleSnapshot of a process.
+
+    Changes in this process invalidate the snapshot immediately (see signals.py). Changes made
+    by other processes are picked up through CommanderSettings.rules_version, which is checked
+    at most every `check_interval` seconds.
+    """
+
+    def __init__(self, check_interval: Optional[float] = None):
+        if check_interval is None:
+            check_interval = getattr(settings, 'COMMANDER_RULES_CHECK_INTERVAL', 2.0)
+        self.check_interval = float(check_interval)
+        self._snapshot: Optional[RuleSnapshot] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.rebuild_count = 0
+
+    def invalidate(self):
+        self._next_check = 0.0
+        self._snapshot = None
+
+    def snapshot(self) -> RuleSnapshot:
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now < self._next_check:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not snapshot and self._snapshot is not None:
+                return self._snapshot
+            version = CommanderSettings.objects.filter(pk=1).values_list('rules_version', flat=True).first()
+            if snapshot is None or version != snapshot.version:
+                snapshot = self._build()
+            self._next_check = time.monotonic() + self.check_interval
+            return snapshot
+
+    def _build(self) -> RuleSnapshot:
+        settings_obj = CommanderSettings.get_solo()
+        rules: List[CommanderRule] = list(CommanderRule.objects.filter(enabled=True))
+        snapshot = RuleSnapshot(rules, chatbot_mode_enabled=settings_obj.chatbot_mode_enabled,
+                                version=settings_obj.rules_version)
+        self._snapshot = snapshot
+        self.rebuild_count += 1
+        logger.info(f"Commander rule snapshot rebuilt: {len(rules)} enabled rules (version {snapshot.version}).")
+        return snapshot
+
+
+_rule_engine: Optional[RuleEngine] = None
+
+
+def get_rule_engine() -> RuleEngine:
+    global _rule_engine
+    if _rule_engine is None:
+        _rule_engine = RuleEngine()
+    return _rule_engine
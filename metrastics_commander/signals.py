@@ -0,0 +1,21 @@
+# metrastics_commander/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from metrastics_commander.models import CommanderRule, CommanderSettings
+from metrastics_commander.rule_engine import get_rule_engine
+
+
+@receiver(post_save, sender=CommanderRule)
+@receiver(post_delete, sender=CommanderRule)
+def commander_rule_changed(sender, instance, **kwargs):
+    CommanderSettings.bump_rules_version()
+    get_rule_engine().invalidate()
+
+
+@receiver(post_save, sender=CommanderSettings)
+def commander_settings_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    if created or update_fields and frozenset(update_fields) <= {'rules_version'}:
+        return
+    CommanderSettings.bump_rules_version()
+    get_rule_engine().invalidate()
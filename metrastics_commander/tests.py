@@ -1,8 +1,16 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
+import threading
+import time
 
-from .models import CommanderSettings
+from .cooldowns import CooldownStore
+from .dispatcher import CommanderDispatcher
+from .llm_client import LLMClient, LLMTimeoutError, LLMUnavailableError, OpenAIBackend
+from .management.commands.benchmark_rules import legacy_first_match
+from .models import CommanderCooldown, CommanderRule, CommanderSettings
+from .rule_engine import RuleEngine, RuleSnapshot
 
 
 class ChatbotModeAPITestCase(TestCase):
@@ -22,3 +30,211 @@ class ChatbotModeAPITestCase(TestCase):
         response = self.client.post(self.url, data=json.dumps({'enabled': False}), content_type='application/json')
         self.assertEqual(response.status_code, 200)
         self.assertFalse(response.json()['enabled'])
+
+
+class CommanderDispatcherTestCase(SimpleTestCase):
+    def test_slow_jobs_do_not_block_submit(self):
+        release = threading.Event()
+        handled = []
+
+        def handler(key, value):
+            release.wait(5)
+            handled.append((key, value))
+
+        dispatcher = CommanderDispatcher(handler, workers=2, max_queue_size=10)
+        dispatcher.start()
+        started = time.monotonic()
+        for i in range(6):
+            self.assertTrue(dispatcher.submit(f"!node{i % 2}", f"!node{i % 2}", i))
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        release.set()
+        dispatcher.stop(timeout=5)
+        self.assertEqual(len(handled), 6)
+        # Jobs of one sender stay in order.
+        self.assertEqual([v for k, v in handled if k == '!node0'], [0, 2, 4])
+        stats = dispatcher.stats()
+        self.assertEqual(stats['completed'], 6)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_full_queue_drops_job(self):
+        dispatcher = CommanderDispatcher(lambda: None, workers=1, max_queue_size=1)
+        self.assertTrue(dispatcher.submit('!a'))
+        self.assertFalse(dispatcher.submit('!a'))
+        self.assertEqual(dispatcher.stats()['dropped'], 1)
+
+
+class RuleEngineTestCase(TestCase):
+    def make_rule(self, name, trigger, match_type, **kwargs):
+        return CommanderRule.objects.create(name=name, trigger_phrase=trigger, match_type=match_type,
+                                            response_template="ok", **kwargs)
+
+    def test_snapshot_matches_like_linear_rule_loop(self):
+        rules = [
+            CommanderRule(name='a', trigger_phrase='Wetter', match_type='contains'),
+            CommanderRule(name='b', trigger_phrase='!ping', match_type='startswith'),
+            CommanderRule(name='c', trigger_phrase='status', match_type='exact'),
+            CommanderRule(name='d', trigger_phrase=r'^node\s+\d+$', match_type='regex'),
+            CommanderRule(name='e', trigger_phrase='[broken', match_type='regex'),
+            CommanderRule(name='f', trigger_phrase='ping', match_type='contains'),
+            CommanderRule(name='g', trigger_phrase='she', match_type='contains'),
+            CommanderRule(name='h', trigger_phrase='hers', match_type='contains'),
+        ]
+        snapshot = RuleSnapshot(rules)
+        for text in ['wie ist das WETTER?', '!PING bitte', 'status', 'Status', 'Node 42', 'nix', 'ushers', 'ping',
+                     '']:
+            self.assertIs(snapshot.first_match(text), legacy_first_match(rules, text), text)
+        self.assertEqual([rule.name for rule in snapshot.iter_matches('!ping wetter')], ['a', 'b', 'f'])
+
+    def test_snapshot_is_rebuilt_only_when_rules_change(self):
+        engine = RuleEngine(check_interval=0)
+        rule = self.make_rule('ping', 'ping', 'contains')
+        self.assertIs(engine.snapshot().first_match('ping'), engine.snapshot().first_match('ping'))
+        self.assertEqual(engine.rebuild_count, 1)
+
+        # Simulates a change made by another process.
+        CommanderRule.objects.filter(pk=rule.pk).update(trigger_phrase='pong')
+        CommanderSettings.bump_rules_version()
+        self.assertIsNone(engine.snapshot().first_match('ping'))
+        self.assertEqual(engine.rebuild_count, 2)
+
+        settings_obj = CommanderSettings.get_solo()
+        settings_obj.chatbot_mode_enabled = True
+        settings_obj.save(update_fields=['chatbot_mode_enabled'])
+        self.assertTrue(engine.snapshot().chatbot_mode_enabled)
+
+    def test_saving_stale_settings_still_bumps_the_rules_version(self):
+        engine = RuleEngine(check_interval=0)
+        stale = CommanderSettings.get_solo()
+        CommanderSettings.bump_rules_version()
+        self.assertFalse(engine.snapshot().chatbot_mode_enabled)
+        version = CommanderSettings.get_solo().rules_version
+
+        stale.chatbot_mode_enabled = True
+        stale.save()  # e.g. an admin form opened before the last bump
+        self.assertEqual(CommanderSettings.get_solo().rules_version, version + 1)
+        self.assertTrue(engine.snapshot().chatbot_mode_enabled)
+
+
+class CooldownStoreTestCase(TestCase):
+    def setUp(self):
+        self.rule = CommanderRule.objects.create(name='ping', trigger_phrase='ping', response_template='pong',
+                                                 cooldown_seconds=60)
+
+    def test_trigger_is_persisted_and_survives_restart(self):
+        store = CooldownStore()
+        self.assertFalse(store.is_active(self.rule.id, 0x11223344))
+        store.trigger(self.rule.id, 0x11223344, self.rule.cooldown_seconds)
+        store.trigger(self.rule.id, 0x11223344, self.rule.cooldown_seconds)
+        self.assertTrue(store.is_active(self.rule.id, 0x11223344))
+        self.assertFalse(store.is_active(self.rule.id, 0x55667788))
+        self.assertEqual(CommanderCooldown.objects.get().node_num, 0x11223344)
+
+        restarted = CooldownStore()
+        restarted.load()
+        self.assertTrue(restarted.is_active(self.rule.id, 0x11223344))
+
+    def test_expired_cooldowns_are_evicted(self):
+        store = CooldownStore(purge_interval=0)
+        store.trigger(self.rule.id, 0x11223344, self.rule.cooldown_seconds)
+        CommanderCooldown.objects.update(expires_at=time.time() - 1)
+        store._expiry[(self.rule.id, 0x11223344)] = time.monotonic() - 1
+        store._heap = [(store._expiry[(self.rule.id, 0x11223344)], (self.rule.id, 0x11223344))]
+
+        self.assertFalse(store.is_active(self.rule.id, 0x11223344))
+        store.purge_if_due()
+        self.assertEqual(len(store), 0)
+        self.assertFalse(CommanderCooldown.objects.exists())
+
+
+class FakeLLMBackend:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.queries = []
+
+    def complete(self, system_prompt, user_query):
+        self.queries.append(user_query)
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("upstream down")
+        return f"answer to {user_query}"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        payload = json.dumps({
+            'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': f" sunny in {body['messages'][-1]['content']} "}}],
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LLMClientTestCase(SimpleTestCase):
+    def test_repeated_queries_are_cached(self):
+        backend = FakeLLMBackend()
+        client = LLMClient(backend)
+        self.assertEqual(client.ask("Weather"), "answer to Weather")
+        self.assertEqual(client.ask("  weather "), "answer to Weather")
+        self.assertEqual(backend.queries, ["Weather"])
+        self.assertEqual(client.stats()['cache_hits'], 1)
+        client.close()
+
+    def test_deadline_and_busy_workers(self):
+        client = LLMClient(FakeLLMBackend(delay=0.5), workers=1, deadline=0.05, failure_threshold=10)
+        with self.assertRaises(LLMTimeoutError):
+            client.ask("slow")
+        # The timed out request still occupies the only worker.
+        with self.assertRaises(LLMUnavailableError):
+            client.ask("other")
+        self.assertEqual(client.stats()['timeouts'], 1)
+        client.close()
+
+    def test_circuit_breaker_fails_fast_and_recovers(self):
+        backend = FakeLLMBackend(fail=True)
+        client = LLMClient(backend, failure_threshold=2, reset_timeout=0.1)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                client.ask("ping")
+        with self.assertRaises(LLMUnavailableError):
+            client.ask("ping")
+        self.assertEqual(len(backend.queries), 2)
+
+        time.sleep(0.15)
+        backend.fail = False
+        self.assertEqual(client.ask("ping"), "answer to ping")
+        self.assertEqual(client.stats()['circuit'], 'closed')
+        client.close()
+
+    def test_rejected_trial_call_does_not_block_the_circuit(self):
+        client = LLMClient(FakeLLMBackend(fail=True), failure_threshold=1, reset_timeout=0.05)
+        with self.assertRaises(ConnectionError):
+            client.ask("ping")
+        time.sleep(0.1)
+        client._executor.shutdown()
+        with self.assertRaises(LLMUnavailableError):
+            client.ask("ping")
+        self.assertTrue(client.breaker.allow())
+        client.close()
+
+    def test_openai_backend_against_local_server(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAIHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            backend = OpenAIBackend(api_key='sk-test', base_url=f"http://127.0.0.1:{server.server_port}/v1", timeout=5)
+            client = LLMClient(backend, system_prompt='Be brief.')
+            self.assertEqual(client.ask("Berlin"), "sunny in Berlin")
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
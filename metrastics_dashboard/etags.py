@@ -0,0 +1,69 @@
+# metrastics_dashboard/etags.py
+"""
+Conditional GET for the polled dashboard APIs.
+
+The ETag of an API response is made of the change sequences (see metrastics_listener.counters)
+of the data it shows. The sequences of all APIs are read with one query on the StatCounter table
+and reused for ETAG_SEQUENCE_MAX_AGE seconds, so a poll with a matching If-None-Match is answered
+with 304 Not Modified without running the view, and usually without any query. A response can
+therefore lag a change by up to that many seconds.
+"""
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from metrastics import metrics
+from metrastics_listener import counters
+from metrastics_listener.models import StatCounter
+
+NOT_MODIFIED = metrics.counter('metrastics_http_not_modified_total',
+                               'API polls answered with 304 Not Modified, by view.', ['view'])
+
+_lock = threading.Lock()
+_sequences: Dict[str, int] = {}
+_read_at = float('-inf')
+
+
+def read_sequences() -> Dict[str, int]:
+    global _sequences, _read_at
+    max_age = getattr(settings, 'ETAG_SEQUENCE_MAX_AGE', 1.0)
+    with _lock:
+        if time.monotonic() - _read_at >= max_age:
+            _sequences = dict(StatCounter.objects.filter(key__in=counters.SEQUENCES).values_list('key', 'value'))
+            _read_at = time.monotonic()
+        return _sequences
+
+
+def conditional_on(*sequences: str, unless: Optional[Callable] = None):
+    """
+    View decorator: the response gets an ETag from `sequences`, and a request whose If-None-Match
+    matches it is answered with 304 before the view runs. Browsers are told to revalidate every poll.
+    Requests for which `unless(request)` is true get no ETag, for responses that also depend on
+    something the sequences do not track, such as the clock.
+    """
+    def etag(request, *args, **kwargs) -> str:
+        values = read_sequences()
+        return '-'.join(str(values.get(sequence, 0)) for sequence in sequences)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if unless is not None and unless(request):
+                response = view(request, *args, **kwargs)
+            else:
+                response = conditional_view(request, *args, **kwargs)
+                if response.status_code == 304:
+                    NOT_MODIFIED.labels(view.__name__).inc()
+            patch_cache_control(response, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
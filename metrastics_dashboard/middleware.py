@@ -0,0 +1,42 @@
+# metrastics_dashboard/middleware.py
+import time
+
+from django.db import connection
+
+from metrastics import metrics
+
+REQUEST_SECONDS = metrics.histogram('metrastics_http_request_seconds', 'Django request latency per view.',
+                                    ['view', 'method'])
+REQUEST_QUERIES = metrics.histogram('metrastics_http_request_queries', 'Database queries per Django request and view.',
+                                    ['view', 'method'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+class _QueryCounter:
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class RequestMetricsMiddleware:
+    """Records latency and query count of every request, labelled with the URL name of its view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_counter = _QueryCounter()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(query_counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started_at
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.url_name if resolver_match is not None and resolver_match.url_name else 'unmatched'
+        REQUEST_SECONDS.labels(view, request.method).observe(elapsed)
+        REQUEST_QUERIES.labels(view, request.method).observe(query_counter.count)
+        return response
@@ -0,0 +1,138 @@
+# metrastics_dashboard/node_listing.py
+"""
+Keyset-paginated node listing behind the v2 nodes API.
+
+A page is one range scan on an index of the sort key (see the Node indexes): it continues
+after the (sort value, node_id) of the last row of the previous page, which the client passes
+back as an opaque cursor, instead of an OFFSET that re-reads every row before the page.
+
+Nodes without a value for the sort key (e.g. never heard) come after all others in both
+directions. They are read as a second phase ordered by node_id, so both phases stay plain
+index scans on every database; a cursor with a null sort value points into that phase.
+"""
+import base64
+import binascii
+import json
+from typing import List, Optional, Sequence, Tuple
+
+from django.db.models import Q
+
+# Fields a client can ask for with ?fields=; the JSON blobs are left to the node detail API.
+LISTING_FIELDS = (
+    'node_id', 'node_num', 'long_name', 'short_name', 'hw_model', 'role', 'firmware_version', 'is_local',
+    'last_heard', 'battery_level', 'voltage', 'channel_utilization', 'air_util_tx', 'uptime_seconds',
+    'snr', 'rssi', 'latitude', 'longitude', 'altitude', 'position_time',
+)
+# The fields of the v1 all_nodes API.
+DEFAULT_FIELDS = (
+    'node_id', 'node_num', 'long_name', 'short_name', 'hw_model', 'last_heard', 'battery_level', 'voltage',
+    'snr', 'rssi', 'position_time', 'latitude', 'longitude',
+)
+SORT_KEYS = ('last_heard', 'long_name', 'hw_model', 'role', 'node_id')
+DEFAULT_SORT = '-last_heard'
+
+
+class ListingError(ValueError):
+    """An invalid listing parameter; the API answers it with 400."""
+
+
+def parse_sort(value: Optional[str]) -> Tuple[str, bool]:
+    """'-last_heard' -> ('last_heard', True). Returns the sort field and whether it is descending."""
+    value = (value or DEFAULT_SORT).strip()
+    field = value.lstrip('-')
+    if field not in SORT_KEYS or len(value) - len(field) > 1:
+        raise ListingError(f"Invalid sort '{value}', expected one of {', '.join(SORT_KEYS)} (prefix - for descending).")
+    return field, value.startswith('-')
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """The requested fields in the given order; node_id is always included (first if not given)."""
+    if not value:
+        return list(DEFAULT_FIELDS)
+    fields = []
+    for field in (part.strip() for part in value.split(',')):
+        if not field or field in fields:
+            continue
+        if field not in LISTING_FIELDS:
+            raise ListingError(f"Unknown field '{field}', available: {', '.join(LISTING_FIELDS)}.")
+        fields.append(field)
+    if 'node_id' not in fields:
+        fields.insert(0, 'node_id')
+    return fields
+
+
+def encode_cursor(sort: str, value, node_id: str) -> str:
+    raw = json.dumps([sort, value, node_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, str]:
+    """The (sort value, node_id) a cursor continues after. It must come from a listing with the same sort."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, node_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ListingError("Invalid cursor.")
+    if not isinstance(node_id, str) or not isinstance(value, (str, int, float, type(None))):
+        raise ListingError("Invalid cursor.")
+    if cursor_sort != sort:
+        raise ListingError("The cursor belongs to a listing with another sort order.")
+    return value, node_id
+
+
+def list_nodes(queryset, sort: str, fields: Sequence[str], limit: int,
+               cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of `queryset` (a filtered Node queryset): up to `limit` rows with `fields`, and the
+    cursor of the next page (None on the last page).
+    """
+    field, descending = parse_sort(sort)
+    direction = '-' if descending else ''
+    sort = f"{direction}{field}"
+    after = decode_cursor(cursor, sort) if cursor else None
+    columns = list(dict.fromkeys([*fields, field, 'node_id']))
+    node_id_after = 'node_id__lt' if descending else 'node_id__gt'
+    value_after = f"{field}__lt" if descending else f"{field}__gt"
+
+    rows: List[dict] = []
+    # Phase 1: nodes with a sort value. Skipped once a cursor has reached the null phase.
+    if after is None or after[0] is not None:
+        phase = queryset if field == 'node_id' else queryset.filter(**{f"{field}__isnull": False})
+        if after is not None:
+            value, node_id = after
+            phase = phase.filter(Q(**{value_after: value}) | Q(**{field: value, node_id_after: node_id}))
+        order = [f"{direction}{field}"] if field == 'node_id' else [f"{direction}{field}", f"{direction}node_id"]
+        rows = list(phase.order_by(*order).values(*columns)[:limit + 1])
+    # Phase 2: nodes without a sort value, by node_id.
+    if field != 'node_id' and len(rows) <= limit:
+        phase = queryset.filter(**{f"{field}__isnull": True})
+        if after is not None and after[0] is None:
+            phase = phase.filter(**{node_id_after: after[1]})
+        rows += list(phase.order_by(f"{direction}node_id").values(*columns)[:limit + 1 - len(rows)])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, last[field], last['node_id'])
+    if len(columns) != len(fields):
+        rows = [{name: row[name] for name in fields} for row in rows]
+    return rows, next_cursor
+
+
+def filter_nodes(queryset, hw_models: Sequence[str] = (), roles: Sequence[str] = (),
+                 heard_since: Optional[float] = None, search: Optional[str] = None):
+    if hw_models:
+        queryset = queryset.filter(hw_model__in=hw_models)
+    if roles:
+        queryset = queryset.filter(role__in=roles)
+    if heard_since is not None:
+        queryset = queryset.filter(last_heard__gte=heard_since)
+    if search:
+        queryset = queryset.filter(
+            Q(long_name__icontains=search) |
+            Q(short_name__icontains=search) |
+            Q(node_id__icontains=search) |
+            Q(hw_model__icontains=search)
+        )
+    return queryset
@@ -1,3 +1,203 @@
-from django.test import TestCase
+import threading
+import time
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from metrastics.metrics import MetricsRegistry
+from metrastics_dashboard.middleware import REQUEST_QUERIES, REQUEST_SECONDS
+from metrastics_listener import message_search
+from metrastics_listener.counters import NODES_CHANGED, bump_sequences
+from metrastics_listener.models import AverageMetricsHistory, Message, Node, Packet
+from metrastics_listener.node_names import get_node_name_resolver
+
+
+class MetricsRegistryTestCase(SimpleTestCase):
+    def test_counts_from_all_threads_are_rendered(self):
+        registry = MetricsRegistry()
+        packets = registry.counter('test_packets_total', 'Packets.', ['packet_type'])
+        latency = registry.histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        threads = [threading.Thread(target=lambda: [packets.labels('Message').inc() for _ in range(1000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latency.observe(0.05)
+        latency.observe(0.5)
+
+        text = registry.render()
+        self.assertIn('# TYPE test_packets_total counter', text)
+        self.assertIn('test_packets_total{packet_type="Message"} 4000', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('test_latency_seconds_count 2', text)
+
+    def test_cells_of_finished_threads_are_folded_into_the_total(self):
+        registry = MetricsRegistry()
+        requests = registry.counter('test_requests_total', 'Requests.')
+        for _ in range(50):  # One short-lived thread per request, as with threaded servers
+            thread = threading.Thread(target=requests.inc)
+            thread.start()
+            thread.join()
+        requests.inc()
+
+        self.assertIn('test_requests_total 51', registry.render())
+        self.assertEqual(len(requests.labels()._cells), 1)  # Only the cell of this thread is left
+
+
+class MetricsEndpointTestCase(TestCase):
+    def test_api_requests_are_measured(self):
+        requests_before = REQUEST_SECONDS.labels('api_counters', 'GET').snapshot()[2]
+        self.client.get(reverse('dashboard_root:api_counters'))
+        _, queries, requests = REQUEST_QUERIES.labels('api_counters', 'GET').snapshot()
+        self.assertEqual(requests, requests_before + 1)
+        self.assertGreater(queries, 0)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(f'metrastics_http_request_seconds_count{{view="api_counters",method="GET"}} {requests}',
+                      response.content.decode('utf-8'))
+
+
+class MetricsRollupApiTestCase(TestCase):
+    def setUp(self):
+        now = time.time()
+        for minutes_ago, snr, packets in ((30, 8.0, 10), (90, 2.0, 30), (3 * 24 * 60, -10.0, 100)):
+            AverageMetricsHistory.objects.create(timestamp=now - minutes_ago * 60, average_snr=snr, snr_count=packets,
+                                                 packet_count=packets, active_node_count=3, total_node_count=5)
+
+    def test_signal_stats_are_weighted_over_the_window(self):
+        data = self.client.get(reverse('dashboard_root:api_average_signal_stats'), {'window': '1h'}).json()
+        self.assertEqual(data['average_snr'], 8.0)
+        self.assertEqual(data['packet_count_for_avg'], 10)
+
+        data = self.client.get(reverse('dashboard_root:api_average_signal_stats')).json()
+        self.assertAlmostEqual(data['average_snr'], (8.0 * 10 + 2.0 * 30) / 40)
+        self.assertEqual(data['period_hours'], 12)
+
+    def test_history_covers_long_windows_and_rejects_bad_ones(self):
+        data = self.client.get(reverse('dashboard_root:api_metrics_history'), {'window': '7d'}).json()
+        self.assertEqual(sum(point['packet_count'] for point in data['points']), 140)
+
+        response = self.client.get(reverse('dashboard_root:api_metrics_history'), {'window': 'forever'})
+        self.assertEqual(response.status_code, 400)
+
+
+class NodeNamesApiTestCase(TestCase):
+    def setUp(self):
+        get_node_name_resolver().invalidate()
+        for i in range(1, 4):
+            Node.objects.create(node_id=f'!0000aa0{i}', node_num=0xaa00 + i, long_name=f'Node {i}', short_name=f'N{i}')
+        for i in range(20):
+            Packet.objects.create(event_id=f'names-{i}', timestamp=time.time() - i, packet_type='Telemetry',
+                                  from_node_id_str=f'!0000aa0{i % 3 + 1}', to_node_id_str='^all' if i % 2 else '!0000aa01')
+
+    def test_live_packets_look_up_node_names_once_per_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            packets = self.client.get(reverse('dashboard_root:api_live_packets')).json()
+        node_queries = [q['sql'] for q in ctx.captured_queries if 'metrastics_listener_node' in q['sql']]
+        self.assertEqual(len(node_queries), 1)
+        self.assertEqual(len(packets), 20)
+        self.assertEqual(packets[0]['from_node_info'], {'long_name': 'Node 1', 'short_name': 'N1', 'node_id': '!0000aa01'})
+        self.assertEqual(packets[0]['to_node_info']['node_id'], '!0000aa01')
+        self.assertIsNone(packets[1]['to_node_info'])
+
+
+@override_settings(ETAG_SEQUENCE_MAX_AGE=0)
+class ConditionalGetTestCase(TestCase):
+    def test_unchanged_data_is_answered_with_not_modified(self):
+        url = reverse('dashboard_root:api_nodes')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):  # Only the change sequences
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Node.objects.create(node_id='!0000bb01', node_num=0xbb01, long_name='Fresh')
+        bump_sequences(NODES_CHANGED)  # As the ingest writer does
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['node_id'], '!0000bb01')
+
+
+class NodeListingApiTestCase(TestCase):
+    def setUp(self):
+        for i in range(1, 8):
+            Node.objects.create(node_id=f'!0000cc0{i}', node_num=0xcc00 + i, long_name=f'Node {i}',
+                                hw_model='TBEAM' if i % 2 else 'HELTEC_V3', role='ROUTER' if i == 1 else 'CLIENT',
+                                last_heard=1000.0 + i // 2 if i < 6 else None)  # Ties on last_heard, two never heard
+
+    def read_all_pages(self, **params):
+        nodes, cursor, pages = [], None, 0
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            page = self.client.get(reverse('dashboard_root:api_nodes_v2'), query).json()
+            nodes += page['nodes']
+            pages += 1
+            cursor = page['next_cursor']
+            if not cursor:
+                return nodes, pages
+
+    def test_pages_follow_the_sort_order_with_never_heard_nodes_last(self):
+        nodes, pages = self.read_all_pages(limit=2, fields='last_heard')
+        self.assertEqual(pages, 4)
+        self.assertEqual([node['node_id'][-1] for node in nodes], ['5', '4', '3', '2', '1', '7', '6'])
+        self.assertEqual(set(nodes[0]), {'node_id', 'last_heard'})
+
+        nodes, _ = self.read_all_pages(limit=3, sort='last_heard', fields='node_id')
+        self.assertEqual([node['node_id'][-1] for node in nodes], ['1', '2', '3', '4', '5', '6', '7'])
+
+    def test_filters_and_columns_format(self):
+        response = self.client.get(reverse('dashboard_root:api_nodes_v2'), {
+            'hw_model': 'TBEAM', 'role': 'CLIENT', 'heard_since': '1001', 'sort': 'node_id',
+            'fields': 'long_name,role', 'format': 'columns'})
+        self.assertEqual(response.json(), {
+            'columns': ['node_id', 'long_name', 'role'],
+            'rows': [['!0000cc03', 'Node 3', 'CLIENT'], ['!0000cc05', 'Node 5', 'CLIENT']],
+            'next_cursor': None,
+        })
+
+    def test_invalid_parameters_are_rejected(self):
+        url = reverse('dashboard_root:api_nodes_v2')
+        cursor = self.client.get(url, {'limit': 1}).json()['next_cursor']
+        for params in ({'sort': 'macaddr'}, {'fields': 'user_info'}, {'format': 'xml'}, {'cursor': 'garbage'},
+                       {'cursor': cursor, 'sort': 'long_name'}, {'heard_within': 'soon'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    @override_settings(ETAG_SEQUENCE_MAX_AGE=0)
+    def test_time_windows_are_not_answered_from_the_etag(self):
+        url = reverse('dashboard_root:api_nodes_v2')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(url, {'heard_within': '1h'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+@skipUnless(connection.vendor in message_search.VENDORS, 'Message search index')
+class MessageSearchApiTestCase(TestCase):
+    def setUp(self):
+        Node.objects.create(node_id='!0000dd01', node_num=0xdd01, long_name='Harbour Gateway', short_name='HGW')
+        texts = ['Storm warning for the harbour', 'All quiet tonight', 'Harbour lights are out', 'Testing 1 2 3']
+        for i, text in enumerate(texts):
+            packet = Packet.objects.create(event_id=f'search-{i}', timestamp=1700000000 + i, packet_type='Message')
+            Message.objects.create(packet=packet, text=text, timestamp=1700000000 + i,
+                                   from_node_id_str='!0000dd01' if i == 1 else '!0000dd02', to_node_id_str='^all')
+        message_search.index_messages(Message.objects.values_list('pk', flat=True))
+
+    def test_search_matches_text_and_sender_names(self):
+        url = reverse('dashboard_root:api_get_messages')
+        data = self.client.get(url, {'q': 'harb'}).json()
+        self.assertEqual([message['text'] for message in data['messages']],
+                         ['Harbour lights are out', 'All quiet tonight', 'Storm warning for the harbour'])
+        self.assertEqual(data['total_messages'], 3)
+        self.assertEqual(data['messages'][1]['from_node_name'], 'Harbour Gateway')
+
+        ranked = self.client.get(url, {'q': 'harbour', 'order': 'relevance'}).json()
+        self.assertEqual(ranked['messages'][-1]['text'], 'All quiet tonight')  # Only the sender name matches
+        self.assertEqual(self.client.get(url, {'q': 'storm harb', 'page': 7}).json()['total_messages'], 1)
@@ -15,9 +15,11 @@ urlpatterns = [
     path('api/counters/', views.api_counters, name='api_counters'),
     path('api/nodes/', views.api_nodes, name='api_nodes'),
     path('api/all_nodes/', views.api_get_all_nodes, name='api_get_all_nodes'),
+    path('api/v2/nodes/', views.api_nodes_v2, name='api_nodes_v2'),
     path('api/node_detail/<str:node_id>/', views.api_node_detail, name='api_node_detail'),
     path('api/live_packets/', views.api_live_packets, name='api_live_packets'),
     path('api/average_signal_stats/', views.api_average_signal_stats, name='api_average_signal_stats'),
+    path('api/metrics_history/', views.api_metrics_history, name='api_metrics_history'),
     path('api/request_listener_restart/', views.api_request_listener_restart_view, name='api_request_listener_restart'),
     path('api/get_messages/', views.api_get_messages, name='api_get_messages'), # NEU
     path('api/get_traceroutes/', views.api_get_traceroutes, name='api_get_traceroutes'), # NEU
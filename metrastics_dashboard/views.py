@@ -1,9 +1,10 @@
 # metrastics_dashboard/views.py
 from django.shortcuts import render
-from django.http import JsonResponse, Http404
+from django.http import HttpResponse, JsonResponse, Http404
 from django.utils import timezone
-from datetime import timedelta, datetime
+from datetime import datetime
 import logging
+import re
 from django.forms.models import model_to_dict
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.conf import settings # Import Django settings
@@ -12,7 +13,15 @@ import os # Import os for getenv, though settings is preferred
 # Make sure Traceroute is imported from metrastics_listener.models
 from metrastics_listener.models import Node, Packet, Message, Position, Telemetry, \
     ListenerState, Traceroute
-from django.db.models import Count, Avg, Q
+from django.db import transaction
+from django.db.models import Count, Q
+
+from metrastics import metrics
+from metrastics_dashboard import node_listing
+from metrastics_dashboard.etags import conditional_on
+from metrastics_listener import counters, message_search
+from metrastics_listener.node_names import display_name, get_node_name_resolver
+from metrastics_listener.rollups import history_points, window_signal_stats
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +36,8 @@ def nodes_page(request):
 
 def map_page(request):
     """Renders the new page that will display a map of all nodes."""
-    return render(request, 'metrastics_dashboard/map.html')
+    context = {'FLASK_PORT': getattr(settings, 'LISTENER_FLASK_PORT', '5555')}
+    return render(request, 'metrastics_dashboard/map.html', context)
 
 def messages_page(request):
     """Renders the page that lists all messages and allows sending."""
@@ -39,9 +49,11 @@ def messages_page(request):
 
 def traceroutes_page(request):
     """Renders the page that lists all traceroutes."""
-    return render(request, 'metrastics_dashboard/traceroutes.html')
+    context = {'FLASK_PORT': getattr(settings, 'LISTENER_FLASK_PORT', '5555')}
+    return render(request, 'metrastics_dashboard/traceroutes.html', context)
 
 
+@conditional_on(counters.LISTENER_STATE_CHANGED)
 def api_connection_status(request):
     """
     Liefert den aktuellen Verbindungsstatus des Meshtastic-Listeners aus der Datenbank.
@@ -59,7 +71,30 @@ def api_connection_status(request):
                 "channel_map": state.local_node_channel_map_json
             },
             "updated_at": state.updated_at.isoformat() if state.updated_at else None,
-            "restart_requested": state.restart_requested
+            "restart_requested": state.restart_requested,
+            "ingest_overload": {
+                "shed": state.ingest_shed_count,
+                "coalesced": state.ingest_coalesced_count,
+                "last_shed_at": state.ingest_last_shed_at.isoformat() if state.ingest_last_shed_at else None,
+            },
+            # The top-level fields describe the primary gateway; one entry per configured gateway.
+            "gateways": [
+                {
+                    "name": gateway.gateway_name,
+                    "address": gateway.gateway_address,
+                    "status": gateway.get_status_display(),
+                    "raw_status": gateway.status,
+                    "error": gateway.last_error_message,
+                    "local_node_info": {
+                        "node_id": gateway.local_node_id,
+                        "node_num": gateway.local_node_num,
+                        "name": gateway.local_node_name,
+                        "channel_map": gateway.local_node_channel_map_json
+                    },
+                    "updated_at": gateway.updated_at.isoformat() if gateway.updated_at else None,
+                }
+                for gateway in ListenerState.objects.order_by('singleton_id')
+            ],
         }
     except ListenerState.DoesNotExist:
         status_data = {
@@ -68,33 +103,34 @@ def api_connection_status(request):
             "error": "Listener-Status nicht in der Datenbank gefunden.",
             "local_node_info": {},
             "updated_at": None,
-            "restart_requested": False
+            "restart_requested": False,
+            "gateways": [],
         }
     return JsonResponse(status_data)
 
 
+@conditional_on(counters.PACKETS_CHANGED, counters.NODES_CHANGED, counters.TRACEROUTES_CHANGED)
 def api_counters(request):
-    total_packets = Packet.objects.count()
-    total_nodes = Node.objects.count()
-    message_packets = Packet.objects.filter(packet_type='Message').count()
-    position_packets = Packet.objects.filter(packet_type='Position').count()
-    telemetry_packets = Packet.objects.filter(packet_type='Telemetry').count()
-    userinfo_packets = Packet.objects.filter(
-        packet_type__in=['User Info', 'NODEINFO_APP']).count()
-    traceroute_packets_count = Traceroute.objects.count()
+    """Row counts from the incrementally maintained StatCounter table (one query)."""
+    stored = counters.read_counters()
+    by_packet_type = counters.grouped(stored, counters.PACKET_TYPE_PREFIX)
 
     data = {
-        'total_packets': total_packets,
-        'total_nodes': total_nodes,
-        'message_packets': message_packets,
-        'position_packets': position_packets,
-        'telemetry_packets': telemetry_packets,
-        'userinfo_packets': userinfo_packets,
-        'traceroute_packets': traceroute_packets_count,
+        'total_packets': stored.get(counters.PACKETS, 0),
+        'total_nodes': stored.get(counters.NODES, 0),
+        'message_packets': by_packet_type.get('Message', 0),
+        'position_packets': by_packet_type.get('Position', 0),
+        'telemetry_packets': by_packet_type.get('Telemetry', 0),
+        'userinfo_packets': by_packet_type.get('User Info', 0) + by_packet_type.get('NODEINFO_APP', 0),
+        'traceroute_packets': stored.get(counters.TRACEROUTES, 0),
+        'by_packet_type': by_packet_type,
+        'by_portnum': counters.grouped(stored, counters.PORTNUM_PREFIX),
+        'by_channel': counters.grouped(stored, counters.CHANNEL_PREFIX),
     }
     return JsonResponse(data)
 
 
+@conditional_on(counters.NODES_CHANGED)
 def api_nodes(request):
     """ API endpoint for the dashboard - returns top N recently active nodes. """
     nodes = Node.objects.order_by('-last_heard').values(
@@ -104,6 +140,7 @@ def api_nodes(request):
     )[:50]
     return JsonResponse(list(nodes), safe=False)
 
+@conditional_on(counters.NODES_CHANGED)
 def api_get_all_nodes(request):
     """ API endpoint for the Nodes page, Map page, and Message Send Recipient list - returns all nodes. """
     search_query = request.GET.get('q', None)
@@ -125,6 +162,55 @@ def api_get_all_nodes(request):
     return JsonResponse(list(nodes), safe=False)
 
 
+def _split_param(value: str) -> list:
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+# A ?heard_within= window moves with the clock, so the node change sequence alone does not identify the response.
+@conditional_on(counters.NODES_CHANGED, unless=lambda request: bool(request.GET.get('heard_within')))
+def api_nodes_v2(request):
+    """
+    Node listing, one keyset-paginated page at a time (see node_listing).
+    ?sort= last_heard, long_name, hw_model, role or node_id, prefix - for descending (default -last_heard);
+    ?limit=, ?cursor= (next_cursor of the previous page), ?fields= (comma-separated);
+    filters ?hw_model= and ?role= (comma-separated), ?heard_within= (e.g. 24h) or ?heard_since= (unix time), ?q=;
+    ?format=columns lists the field names once and every node as an array of values.
+    """
+    try:
+        fields = node_listing.parse_fields(request.GET.get('fields'))
+        max_limit = getattr(settings, 'NODE_LIST_MAX_PAGE_SIZE', 1000)
+        limit = min(max(int(request.GET.get('limit', max_limit)), 1), max_limit)
+        heard_since = None
+        if request.GET.get('heard_within'):
+            heard_since = timezone.now().timestamp() - _parse_window(request.GET['heard_within'], 0)
+        elif request.GET.get('heard_since'):
+            heard_since = float(request.GET['heard_since'])
+        output_format = request.GET.get('format', 'objects')
+        if output_format not in ('objects', 'columns'):
+            raise ValueError(f"Invalid format '{output_format}', expected objects or columns.")
+
+        nodes_query = node_listing.filter_nodes(
+            Node.objects.all(),
+            hw_models=_split_param(request.GET.get('hw_model')),
+            roles=_split_param(request.GET.get('role')),
+            heard_since=heard_since,
+            search=request.GET.get('q'),
+        )
+        nodes, next_cursor = node_listing.list_nodes(
+            nodes_query, request.GET.get('sort'), fields, limit, cursor=request.GET.get('cursor'))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    if output_format == 'columns':
+        return JsonResponse({
+            'columns': fields,
+            'rows': [[node[field] for field in fields] for node in nodes],
+            'next_cursor': next_cursor,
+        })
+    return JsonResponse({'nodes': nodes, 'next_cursor': next_cursor})
+
+
+@conditional_on(counters.NODES_CHANGED)
 def api_node_detail(request, node_id):
     """ Returns all available details for a single node. """
     try:
@@ -165,57 +251,71 @@ def api_node_detail(request, node_id):
         return JsonResponse({"error": "An unexpected error occurred processing node details.", "detail": str(e)}, status=500)
 
 
+@conditional_on(counters.PACKETS_CHANGED, counters.NODES_CHANGED)
 def api_live_packets(request):
-    recent_packets = Packet.objects.order_by('-timestamp').select_related('from_node', 'to_node').values(
+    recent_packets = list(Packet.objects.order_by('-timestamp').values(
         'event_id', 'timestamp', 'from_node_id_str', 'to_node_id_str',
-        'packet_type', 'portnum', 'channel', 'rx_snr', 'rx_rssi',
+        'packet_type', 'portnum', 'channel', 'rx_snr', 'rx_rssi', 'copies_heard',
         'decoded_json'
-    )[:20]
+    )[:20])
 
+    names = get_node_name_resolver().resolve(
+        node_id for p in recent_packets for node_id in (p['from_node_id_str'], p['to_node_id_str']))
     packets_data = []
     for p in recent_packets:
         packet_data = dict(p)
-        if p['from_node_id_str']:
-            try:
-                from_node = Node.objects.values('long_name', 'short_name', 'node_id').get(node_id=p['from_node_id_str'])
-                packet_data['from_node_info'] = from_node
-            except Node.DoesNotExist:
-                packet_data['from_node_info'] = None
-        else:
-            packet_data['from_node_info'] = None
-
-        if p['to_node_id_str'] and p['to_node_id_str'] != '^all':
-            try:
-                to_node = Node.objects.values('long_name', 'short_name', 'node_id').get(node_id=p['to_node_id_str'])
-                packet_data['to_node_info'] = to_node
-            except Node.DoesNotExist:
-                packet_data['to_node_info'] = None
-        else:
-            packet_data['to_node_info'] = None
+        packet_data['from_node_info'] = names.get(p['from_node_id_str'])
+        packet_data['to_node_info'] = names.get(p['to_node_id_str'])
         packets_data.append(packet_data)
 
     return JsonResponse(packets_data, safe=False)
 
 
-def api_average_signal_stats(request):
-    twelve_hours_ago = timezone.now() - timedelta(hours=12)
-    twelve_hours_ago_ts = twelve_hours_ago.timestamp()
-    relevant_packets = Packet.objects.filter(timestamp__gte=twelve_hours_ago_ts)
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+MAX_WINDOW_SECONDS = 366 * 86400
 
-    aggregates = relevant_packets.aggregate(
-        avg_snr=Avg('rx_snr'),
-        avg_rssi=Avg('rx_rssi')
-    )
+
+def _parse_window(value: str, default_seconds: int) -> int:
+    """Parses a time window like 90m, 12h or 30d into seconds."""
+    if not value:
+        return default_seconds
+    match = re.fullmatch(r'(\d+)([mhd])', value.strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid window '{value}', expected e.g. 1h, 12h, 7d or 30d.")
+    return min(int(match.group(1)) * WINDOW_UNITS[match.group(2)], MAX_WINDOW_SECONDS)
+
+
+def api_average_signal_stats(request):
+    """Average SNR/RSSI over ?window= (default 12h), from the metric rollups."""
+    try:
+        window_seconds = _parse_window(request.GET.get('window'), 12 * 3600)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    now_ts = timezone.now().timestamp()
+    stats = window_signal_stats(now_ts - window_seconds, now_ts)
 
     data = {
-        'average_snr': aggregates['avg_snr'] if aggregates['avg_snr'] is not None else None,
-        'average_rssi': aggregates['avg_rssi'] if aggregates['avg_rssi'] is not None else None,
-        'period_hours': 12,
-        'packet_count_for_avg': relevant_packets.count()
+        'average_snr': stats['average_snr'],
+        'average_rssi': stats['average_rssi'],
+        'period_hours': window_seconds / 3600,
+        'packet_count_for_avg': stats['packet_count'],
     }
     return JsonResponse(data)
 
 
+def api_metrics_history(request):
+    """Network metric history over ?window= (default 24h), at most ?points= (default 300) points."""
+    try:
+        window_seconds = _parse_window(request.GET.get('window'), 24 * 3600)
+        max_points = min(max(int(request.GET.get('points', 300)), 1), 2000)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    now_ts = timezone.now().timestamp()
+    history = history_points(now_ts - window_seconds, now_ts, max_points=max_points,
+                             bucket_seconds=getattr(settings, 'ROLLUP_BUCKET_SECONDS', 300))
+    return JsonResponse({'window_seconds': window_seconds, **history})
+
+
 def api_request_listener_restart_view(request):
     if request.method == 'POST':
         logger.info("API request to restart listener received by dashboard view.")
@@ -226,7 +326,9 @@ def api_request_listener_restart_view(request):
 
             state.restart_requested = True
             state.last_error_message = "Restart requested via API."
-            state.save()
+            with transaction.atomic():
+                state.save()
+                counters.bump_sequences(counters.LISTENER_STATE_CHANGED)
             logger.info("Listener restart flag set in database.")
             return JsonResponse({'status': 'success', 'message': 'Listener restart request successfully submitted.'})
         except Exception as e:
@@ -234,13 +336,20 @@ def api_request_listener_restart_view(request):
             return JsonResponse({'status': 'error', 'message': f'An error occurred: {str(e)}'}, status=500)
     return JsonResponse({'status': 'error', 'message': 'Only POST requests allowed.'}, status=405)
 
+@conditional_on(counters.MESSAGES_CHANGED, counters.NODES_CHANGED)
 def api_get_messages(request):
+    """
+    Messages, 25 per page, newest first. ?q= searches text and sender/recipient names and ids
+    (full-text index, word prefixes); ?order=relevance ranks the matches instead.
+    """
     page_number = request.GET.get('page', 1)
     search_query = request.GET.get('q', '')
 
-    message_list = Message.objects.select_related('from_node', 'to_node').order_by('-timestamp')
+    message_list = Message.objects.order_by('-timestamp')
 
-    if search_query:
+    if search_query and message_search.available() and message_search.search_terms(search_query):
+        message_list = message_search.MessageSearch(search_query, order=request.GET.get('order'))
+    elif search_query:
         message_list = message_list.filter(
             Q(text__icontains=search_query) |
             Q(from_node_id_str__icontains=search_query) |
@@ -259,14 +368,17 @@ def api_get_messages(request):
     except EmptyPage:
         page_obj = paginator.page(paginator.num_pages)
 
+    messages_on_page = list(page_obj.object_list)
+    names = get_node_name_resolver().resolve(
+        node_id for msg in messages_on_page for node_id in (msg.from_node_id_str, msg.to_node_id_str))
     data = []
-    for msg in page_obj.object_list:
+    for msg in messages_on_page:
         msg_data = {
             'id': msg.pk,
             'from_node_id_str': msg.from_node_id_str,
-            'from_node_name': msg.from_node.long_name if msg.from_node else (msg.from_node.short_name if msg.from_node else msg.from_node_id_str),
+            'from_node_name': display_name(names.get(msg.from_node_id_str), msg.from_node_id_str),
             'to_node_id_str': msg.to_node_id_str,
-            'to_node_name': msg.to_node.long_name if msg.to_node else (msg.to_node.short_name if msg.to_node else msg.to_node_id_str),
+            'to_node_name': display_name(names.get(msg.to_node_id_str), msg.to_node_id_str),
             'text': msg.text,
             'timestamp': msg.timestamp,
             'channel': msg.channel,
@@ -286,11 +398,12 @@ def api_get_messages(request):
     })
 
 
+@conditional_on(counters.TRACEROUTES_CHANGED, counters.NODES_CHANGED)
 def api_get_traceroutes(request):
     page_number = request.GET.get('page', 1)
     search_query = request.GET.get('q', '')
 
-    traceroute_list = Traceroute.objects.select_related('requester_node', 'responder_node').order_by('-timestamp')
+    traceroute_list = Traceroute.objects.order_by('-timestamp')
 
     if search_query:
          traceroute_list = traceroute_list.filter(
@@ -311,15 +424,18 @@ def api_get_traceroutes(request):
     except EmptyPage:
         page_obj = paginator.page(paginator.num_pages)
 
+    traceroutes_on_page = list(page_obj.object_list)
+    names = get_node_name_resolver().resolve(
+        node_id for tr in traceroutes_on_page for node_id in (tr.requester_node_id_str, tr.responder_node_id_str))
     data = []
-    for tr in page_obj.object_list:
+    for tr in traceroutes_on_page:
         tr_data = {
             'id': tr.id,
             'packet_event_id': tr.packet_event_id,
             'requester_node_id_str': tr.requester_node_id_str,
-            'requester_node_name': tr.requester_node.long_name if tr.requester_node else (tr.requester_node.short_name if tr.requester_node else tr.requester_node_id_str),
+            'requester_node_name': display_name(names.get(tr.requester_node_id_str), tr.requester_node_id_str),
             'responder_node_id_str': tr.responder_node_id_str,
-            'responder_node_name': tr.responder_node.long_name if tr.responder_node else (tr.responder_node.short_name if tr.responder_node else tr.responder_node_id_str),
+            'responder_node_name': display_name(names.get(tr.responder_node_id_str), tr.responder_node_id_str),
             'route_json': tr.route_json,
             'timestamp': tr.timestamp,
             'created_at': tr.created_at.isoformat(),
@@ -333,4 +449,8 @@ def api_get_traceroutes(request):
         'has_next': page_obj.has_next(),
         'has_previous': page_obj.has_previous(),
         'total_traceroutes': paginator.count
-    })
\ No newline at end of file
+    })
+
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
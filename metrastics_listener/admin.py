@@ -1,4 +1,5 @@
 from django.contrib import admin
+from . import counters, node_names
 from .models import (
     Node,
     Packet,
@@ -37,11 +38,18 @@ class NodeAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # The admin saves in a transaction; the dashboards' name caches drop the node after it commits.
+        if change and any(field in form.changed_data for field in node_names.NAME_FIELDS):
+            node_names.names_changed([obj.node_id])
+        counters.bump_sequences(counters.NODES_CHANGED)
+
 @admin.register(Packet)
 class PacketAdmin(admin.ModelAdmin):
     list_display = (
         'event_id', 'timestamp', 'from_node_id_str', 'to_node_id_str',
-        'packet_type', 'portnum', 'channel', 'rx_snr', 'rx_rssi', 'created_at'
+        'packet_type', 'portnum', 'channel', 'rx_snr', 'rx_rssi', 'copies_heard', 'created_at'
     )
     search_fields = ('event_id', 'from_node_id_str', 'to_node_id_str', 'portnum', 'packet_type')
     list_filter = ('packet_type', 'portnum', 'channel', 'want_ack')
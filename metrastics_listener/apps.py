@@ -1,5 +1,6 @@
 # metrastics_listener/apps.py
 import os
+import sys
 import threading
 from django.apps import AppConfig
 from django.core.management import call_command
@@ -20,6 +21,11 @@ class MetrasticsListenerConfig(AppConfig):
         # In einer Produktionsumgebung (DEBUG=False) wollen wir den Listener ebenfalls starten.
         should_run_listener = os.environ.get('RUN_MAIN') or not settings.DEBUG
 
+        # Andere Management-Befehle (migrate, test, listen_device selbst, ...) sollen keinen zweiten Listener starten.
+        running_management_command = len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py'
+        if running_management_command and sys.argv[1] != 'runserver':
+            return
+
         if should_run_listener:
             print("Attempting to start listen_device command in a new thread...")
             try:
@@ -0,0 +1,112 @@
+# metrastics_listener/capture.py
+"""
+Append-only capture files of listener input, for replaying real traffic offline.
+
+A capture starts with MAGIC, followed by one record per event: a header (event kind, seconds
+since the capture started, payload length) and the payload. Packets are stored as the raw
+MeshPacket protobuf and turned back into the dictionary the meshtastic library publishes on
+replay; node updates are stored as their JSON-serialized dictionary.
+"""
+import json
+import logging
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from meshtastic.protobuf import mesh_pb2
+
+from metrastics_listener.packet_fixtures import mesh_packet_to_dict
+from metrastics_listener.serialization import ensure_serializable
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MTSCAP1\n'
+KIND_PACKET = b'P'
+KIND_NODE_UPDATE = b'N'
+_HEADER = struct.Struct('<cdI')
+
+
+class CaptureWriter:
+    """Writes pubsub events to a capture file. Safe to call from several threads."""
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file: Optional[BinaryIO] = None
+        self._lock = threading.Lock()
+        self._started_at = 0.0
+        self._last_flush = 0.0
+        self.packet_count = 0
+        self.node_update_count = 0
+
+    def open(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._started_at = self._last_flush = time.monotonic()
+        logger.info(f"Capturing listener input to {self.path}.")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logger.info(f"Capture {self.path} closed: {self.packet_count} packets, "
+                            f"{self.node_update_count} node updates.")
+
+    def flush(self):
+        """Called periodically by the listener, so the last records are on disk when traffic stops."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def write_packet(self, packet: dict):
+        mesh_packet = packet.get('raw') if isinstance(packet, dict) else None
+        if not isinstance(mesh_packet, mesh_pb2.MeshPacket):
+            logger.debug("Packet without raw MeshPacket, not captured.")
+            return
+        self._write(KIND_PACKET, mesh_packet.SerializeToString())
+        self.packet_count += 1
+
+    def write_node_update(self, node):
+        self._write(KIND_NODE_UPDATE, json.dumps(ensure_serializable(node), separators=(',', ':')).encode('utf-8'))
+        self.node_update_count += 1
+
+    def _write(self, kind: bytes, payload: bytes):
+        with self._lock:
+            if self._file is None:
+                return
+            now = time.monotonic()
+            self._file.write(_HEADER.pack(kind, now - self._started_at, len(payload)))
+            self._file.write(payload)
+            if now - self._last_flush >= self.flush_interval:
+                # Keep the file usable if the listener is killed.
+                self._file.flush()
+                self._last_flush = now
+
+
+def read_capture(path: str) -> Iterator[Tuple[bytes, float, object]]:
+    """
+    Yields (kind, offset_seconds, event) for every record of a capture file. Events are packet
+    dictionaries for KIND_PACKET and node dictionaries for KIND_NODE_UPDATE. A truncated last
+    record (listener killed while writing) is ignored.
+    """
+    with open(path, 'rb') as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a listener capture file.")
+        while True:
+            header = capture_file.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            kind, offset, length = _HEADER.unpack(header)
+            payload = capture_file.read(length)
+            if len(payload) < length:
+                logger.warning(f"Capture {path} ends with a truncated record, ignoring it.")
+                return
+            if kind == KIND_PACKET:
+                yield kind, offset, mesh_packet_to_dict(mesh_pb2.MeshPacket.FromString(payload))
+            elif kind == KIND_NODE_UPDATE:
+                yield kind, offset, json.loads(payload)
+            else:
+                logger.warning(f"Unknown record kind {kind!r} in capture {path}, skipping it.")
@@ -0,0 +1,121 @@
+# metrastics_listener/counters.py
+"""
+Incrementally maintained row counts for the dashboard counters.
+
+The ingest writer adds the packets, nodes and traceroutes of a batch and the retention policies
+subtract what they delete, in the same transaction as the rows themselves, so reading all
+counters is a single query on the small StatCounter table instead of COUNT(*) scans of Packet.
+`rebuild_counters()` (the rebuild_counters command) recounts everything from the tables.
+
+The same table holds the change sequences: numbers that only ever go up, bumped in the
+transaction that changes the rows behind a dashboard API. The dashboard derives its ETags from
+them, so an unchanged poll is answered without running the API's queries.
+"""
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from metrastics_listener.models import Node, Packet, StatCounter, Traceroute
+
+PACKETS = 'packets'
+NODES = 'nodes'
+TRACEROUTES = 'traceroutes'
+PACKET_TYPE_PREFIX = 'packets.type.'
+PORTNUM_PREFIX = 'packets.portnum.'
+CHANNEL_PREFIX = 'packets.channel.'
+NONE_LABEL = 'none'
+# Not a row count: bumped whenever node names change (see node_names), and left alone by rebuilds.
+NODE_NAME_CHANGES = 'nodes.name_changes'
+# Change sequences, also left alone by rebuilds.
+SEQUENCE_PREFIX = 'seq.'
+NODES_CHANGED = 'seq.nodes'
+PACKETS_CHANGED = 'seq.packets'
+MESSAGES_CHANGED = 'seq.messages'
+TRACEROUTES_CHANGED = 'seq.traceroutes'
+LISTENER_STATE_CHANGED = 'seq.listener_state'
+SEQUENCES = (NODES_CHANGED, PACKETS_CHANGED, MESSAGES_CHANGED, TRACEROUTES_CHANGED, LISTENER_STATE_CHANGED)
+
+
+def packet_keys(packet_type: Optional[str], portnum: Optional[str], channel: Optional[int]) -> Tuple[str, ...]:
+    """Counter keys a stored packet counts towards."""
+    return (
+        PACKETS,
+        f"{PACKET_TYPE_PREFIX}{packet_type if packet_type is not None else NONE_LABEL}",
+        f"{PORTNUM_PREFIX}{portnum if portnum is not None else NONE_LABEL}",
+        f"{CHANNEL_PREFIX}{channel if channel is not None else NONE_LABEL}",
+    )
+
+
+def count_packets(deltas: Counter, packets: Iterable[Tuple[Optional[str], Optional[str], Optional[int]]],
+                  sign: int = 1):
+    """Adds (packet_type, portnum, channel) tuples to `deltas`; sign=-1 for deleted packets."""
+    for packet_type, portnum, channel in packets:
+        for key in packet_keys(packet_type, portnum, channel):
+            deltas[key] += sign
+
+
+def apply_counter_deltas(deltas: Dict[str, int]):
+    """
+    Adds `deltas` to the stored counters with one atomic UPDATE per key. Call it inside the
+    transaction that writes (or deletes) the counted rows.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        missing = [key for key, delta in deltas.items()
+                   if not StatCounter.objects.filter(key=key).update(value=F('value') + delta)]
+        if missing:
+            StatCounter.objects.bulk_create([StatCounter(key=key, value=0) for key in missing], ignore_conflicts=True)
+            for key in missing:
+                StatCounter.objects.filter(key=key).update(value=F('value') + deltas[key])
+
+
+def bump_sequences(*keys: str):
+    """Advances change sequences. Call it inside the transaction that changes the rows."""
+    apply_counter_deltas({key: 1 for key in keys})
+
+
+def is_recounted(key: str) -> bool:
+    """False for the keys that are maintained only, not counted from the tables."""
+    return key != NODE_NAME_CHANGES and not key.startswith(SEQUENCE_PREFIX)
+
+
+def read_counters() -> Dict[str, int]:
+    return dict(StatCounter.objects.values_list('key', 'value'))
+
+
+def grouped(counters: Dict[str, int], prefix: str) -> Dict[str, int]:
+    """Counters below `prefix` by their suffix, e.g. grouped(counters, PACKET_TYPE_PREFIX)['Message']."""
+    return {key[len(prefix):]: value for key, value in counters.items() if key.startswith(prefix) and value}
+
+
+def compute_counters() -> Dict[str, int]:
+    """Counts every counter from the tables (full scans; used by the rebuild)."""
+    counters: Dict[str, int] = {
+        PACKETS: Packet.objects.count(),
+        NODES: Node.objects.count(),
+        TRACEROUTES: Traceroute.objects.count(),
+    }
+    for field, prefix in (('packet_type', PACKET_TYPE_PREFIX), ('portnum', PORTNUM_PREFIX),
+                          ('channel', CHANNEL_PREFIX)):
+        for row in Packet.objects.order_by().values(field).annotate(count=Count('pk')):
+            value = row[field] if row[field] is not None else NONE_LABEL
+            counters[f"{prefix}{value}"] = row['count']
+    return counters
+
+
+def rebuild_counters() -> Dict[str, int]:
+    """
+    Replaces all counters with fresh counts. Runs in one transaction, which on SQLite holds the
+    write lock (and so pauses ingest) for the duration of the counting queries.
+    """
+    with transaction.atomic():
+        counters = compute_counters()
+        StatCounter.objects.exclude(key=NODE_NAME_CHANGES).exclude(key__startswith=SEQUENCE_PREFIX).delete()
+        StatCounter.objects.bulk_create([StatCounter(key=key, value=value) for key, value in counters.items()])
+        # The counters API may now answer differently.
+        bump_sequences(PACKETS_CHANGED, NODES_CHANGED, TRACEROUTES_CHANGED)
+    return counters
@@ -0,0 +1,83 @@
+# metrastics_listener/dedupe.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+def packet_identity(gateway_key: int, from_num, packet_id, rx_time) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Deterministic identity of a received packet: (gateway, sender node num, mesh packet id, rx time).
+    The same reception replayed, re-delivered after a reconnect or imported again has the same
+    identity. None if the packet lacks one of the parts (no id or no receive time).
+    """
+    if not all(isinstance(part, int) and not isinstance(part, bool) for part in (from_num, packet_id, rx_time)):
+        return None
+    if not packet_id:
+        return None
+    return gateway_key, from_num, packet_id, rx_time
+
+
+def identity_event_id(identity: Tuple[int, int, int, int]) -> str:
+    gateway_key, from_num, packet_id, rx_time = identity
+    return f"pkt_{gateway_key:08x}_{from_num:08x}_{packet_id:08x}_{rx_time}"
+
+
+class PacketDeduplicator:
+    """
+    Detects rebroadcast copies of a mesh packet by (sender node num, mesh packet id).
+
+    Entries live in insertion order and are evicted once they are older than `window_seconds`
+    or when more than `max_entries` packets are tracked. For every repeated copy `observe()`
+    returns the update for the stored packet: the number of copies heard so far and, if the
+    copy arrived with a better SNR, its signal values.
+    """
+
+    def __init__(self, window_seconds: float = 600.0, max_entries: int = 50000):
+        self.window_seconds = float(window_seconds)
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicate_count = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.duplicate_count = 0
+
+    def _evict(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry['first_seen'] >= cutoff and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def observe(self, from_num: Optional[int], packet_id: Optional[int], event_id: str, rx_snr: Optional[float] = None,
+                rx_rssi: Optional[int] = None, hop_limit: Optional[int] = None) -> Optional[dict]:
+        """Returns None for the first copy of a packet, otherwise the update for the stored packet."""
+        if not isinstance(from_num, int) or not isinstance(packet_id, int) or not packet_id:
+            return None
+
+        key = (from_num, packet_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = {'first_seen': now, 'event_id': event_id, 'copies': 1, 'best_snr': rx_snr}
+                return None
+
+            entry['copies'] += 1
+            self.duplicate_count += 1
+            update = {'event_id': entry['event_id'], 'copies_heard': entry['copies']}
+            if rx_snr is not None and (entry['best_snr'] is None or rx_snr > entry['best_snr']):
+                entry['best_snr'] = rx_snr
+                update.update({'rx_snr': rx_snr, 'rx_rssi': rx_rssi, 'hop_limit': hop_limit})
+            return update
+
+    def stats(self) -> dict:
+        return {'tracked': len(self._entries), 'duplicates': self.duplicate_count}
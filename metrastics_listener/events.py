@@ -0,0 +1,224 @@
+# metrastics_listener/events.py
+"""
+Live event stream of the listener (Server-Sent Events on the listener's /events endpoint).
+
+The ingest writer publishes compact events once their transaction has committed: 'packet' for
+every stored packet, 'counters' with the counter deltas of a batch, 'nodes' with the node fields
+a node cache flush wrote, and 'status' when a gateway's connection status changes.
+
+`EventBroker.publish()` serializes an event once into a ready-to-send SSE frame and keeps the
+last `buffer_size` frames in a ring buffer; every subscriber sends the same bytes. Event ids
+are "<epoch>:<sequence>", so a client that reconnects with Last-Event-ID gets the events it
+missed. If they are no longer buffered, or the listener restarted in between (new epoch), the
+client gets a 'reset' event instead and should reload its data from the APIs.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+from metrastics import metrics
+
+logger = logging.getLogger(__name__)
+
+EVENT_PACKET = 'packet'
+EVENT_COUNTERS = 'counters'
+EVENT_NODES = 'nodes'
+EVENT_STATUS = 'status'
+EVENT_RESET = 'reset'
+
+RECONNECT_DELAY_MS = 3000  # Sent as the SSE retry field
+# Packet types whose decoded payload the live feed shows (message text, coordinates); others are sent without it.
+PAYLOAD_PACKET_TYPES = ('Message', 'Position')
+NODE_EVENT_FIELDS = ('long_name', 'short_name', 'hw_model', 'role', 'last_heard', 'battery_level', 'voltage',
+                     'channel_utilization', 'air_util_tx', 'snr', 'rssi', 'latitude', 'longitude', 'altitude',
+                     'position_time')
+STATUS_EVENT_FIELDS = ('status', 'last_error_message', 'local_node_id', 'local_node_name', 'restart_requested')
+
+EVENTS_PUBLISHED = metrics.counter('metrastics_events_published_total', 'Live events published, by kind.', ['kind'])
+EVENT_SUBSCRIBERS = metrics.gauge('metrastics_event_subscribers', 'Open live event streams.')
+
+
+def _frame(event_id: str, kind: str, payload: str) -> bytes:
+    return f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class EventBroker:
+    def __init__(self, buffer_size: int = 1000, keepalive: float = 15.0):
+        self.buffer_size = max(1, int(buffer_size))
+        self.keepalive = float(keepalive)
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._frames: "deque[tuple]" = deque(maxlen=self.buffer_size)  # (sequence, frame)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._generation = 0  # Bumped by close()
+        self.subscribers = 0
+        self.published = 0
+        self.resets = 0
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    def publish(self, kind: str, data) -> int:
+        """Adds an event for all subscribers. Returns its sequence number."""
+        payload = json.dumps(data, separators=(',', ':'), default=str)
+        with self._condition:
+            self._sequence += 1
+            sequence = self._sequence
+            self._frames.append((sequence, _frame(f"{self.epoch}:{sequence}", kind, payload)))
+            self.published += 1
+            self._condition.notify_all()
+        EVENTS_PUBLISHED.labels(kind).inc()
+        return sequence
+
+    def resume_point(self, last_event_id: Optional[str]) -> Optional[int]:
+        """
+        The sequence number a client that last saw `last_event_id` continues after, or None if
+        the events it missed are gone (other epoch, unknown format or no longer buffered).
+        """
+        epoch, separator, sequence = (last_event_id or '').strip().rpartition(':')
+        if not separator or epoch != self.epoch:
+            return None
+        try:
+            sequence = int(sequence)
+        except ValueError:
+            return None
+        with self._condition:
+            if sequence > self._sequence:
+                return None
+            oldest = self._frames[0][0] if self._frames else self._sequence + 1
+            if sequence < oldest - 1:
+                return None
+        return sequence
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> Iterator[bytes]:
+        """
+        SSE byte stream of one subscriber: the missed events (or a 'reset'), then every new
+        event as it is published, with keep-alive comments in between. Ends when close() is called.
+        """
+        with self._condition:
+            self.subscribers += 1
+            generation = self._generation
+        try:
+            yield f"retry: {RECONNECT_DELAY_MS}\n\n".encode('utf-8')
+            position = self.resume_point(last_event_id) if last_event_id else None
+            if position is None:
+                with self._condition:
+                    position = self._sequence
+                if last_event_id:
+                    self.resets += 1
+                    yield _frame(f"{self.epoch}:{position}", EVENT_RESET, '{}')
+
+            while True:
+                with self._condition:
+                    if self._generation == generation and self._sequence == position:
+                        self._condition.wait(self.keepalive)
+                    if self._generation != generation:
+                        return
+                    oldest = self._frames[0][0] if self._frames else position + 1
+                    if position < oldest - 1:
+                        # The client fell further behind than the buffer reaches.
+                        frames = None
+                        position = self._sequence
+                    else:
+                        frames = [frame for _, frame in
+                                  itertools.islice(self._frames, position - oldest + 1, None)]
+                        position = self._sequence
+                if frames is None:
+                    self.resets += 1
+                    yield _frame(f"{self.epoch}:{position}", EVENT_RESET, '{}')
+                elif frames:
+                    yield b''.join(frames)
+                else:
+                    yield b': keep-alive\n\n'
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+    def close(self):
+        """Ends the open subscriptions, e.g. when the listener's web server shuts down."""
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            'epoch': self.epoch,
+            'sequence': self._sequence,
+            'buffered': len(self._frames),
+            'buffer_size': self.buffer_size,
+            'subscribers': self.subscribers,
+            'published': self.published,
+            'resets': self.resets,
+        }
+
+
+_event_broker: Optional[EventBroker] = None
+_broker_lock = threading.Lock()
+
+
+def get_event_broker() -> EventBroker:
+    global _event_broker
+    if _event_broker is None:
+        with _broker_lock:
+            if _event_broker is None:
+                _event_broker = EventBroker(
+                    buffer_size=getattr(settings, 'LISTENER_EVENTS_BUFFER_SIZE', 1000),
+                    keepalive=getattr(settings, 'LISTENER_EVENTS_KEEPALIVE', 15.0),
+                )
+    return _event_broker
+
+
+EVENT_SUBSCRIBERS.set_function(lambda: _event_broker.subscribers if _event_broker is not None else 0)
+
+
+def publish(kind: str, data) -> int:
+    return get_event_broker().publish(kind, data)
+
+
+def node_info(node) -> Optional[dict]:
+    """The node reference of a packet event, as in the live packets API."""
+    if node is None:
+        return None
+    return {'long_name': node.long_name, 'short_name': node.short_name, 'node_id': node.node_id}
+
+
+def packet_event(packet, from_node=None, to_node=None) -> dict:
+    """A stored packet in the shape of an api_live_packets entry."""
+    return {
+        'event_id': packet.event_id,
+        'timestamp': packet.timestamp,
+        'from_node_id_str': packet.from_node_id_str,
+        'to_node_id_str': packet.to_node_id_str,
+        'packet_type': packet.packet_type,
+        'portnum': packet.portnum,
+        'channel': packet.channel,
+        'rx_snr': packet.rx_snr,
+        'rx_rssi': packet.rx_rssi,
+        'copies_heard': packet.copies_heard,
+        'decoded_json': packet.decoded_json if packet.packet_type in PAYLOAD_PACKET_TYPES else None,
+        'from_node_info': node_info(from_node),
+        'to_node_info': node_info(to_node) if packet.to_node_id_str != '^all' else None,
+    }
+
+
+def node_change(node, fields) -> dict:
+    """The changed fields of a node that the dashboards display."""
+    change = {'node_id': node.node_id}
+    change.update({field: getattr(node, field) for field in NODE_EVENT_FIELDS if field in fields})
+    return change
+
+
+def publish_batch(packets: list, counter_deltas: dict):
+    """Publishes the packets and counter changes of a committed ingest batch."""
+    for packet in packets:
+        publish(EVENT_PACKET, packet)
+    deltas = {key: delta for key, delta in counter_deltas.items() if delta}
+    if deltas:
+        publish(EVENT_COUNTERS, {'deltas': deltas})
@@ -0,0 +1,140 @@
+# metrastics_listener/gateways.py
+"""
+The Meshtastic radios ("gateways") one listener process is connected to.
+
+Every gateway has its own TCP interface, channel map, local node info, reconnect loop and
+ListenerState row (singleton_id 1 is the first gateway). Packets of all gateways go into the
+same ingest pipeline, whose deduplicator merges copies heard by several gateways.
+"""
+import logging
+import zlib
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GATEWAY_NAME = 'default'
+
+
+class Gateway:
+    def __init__(self, name: str, host: str, port: int, state_id: int = 1):
+        self.name = name
+        self.host = host
+        self.port = int(port)
+        self.state_id = state_id
+        self.interface = None
+        # Internal channel id (hex) -> channel index the users see, from the local node's channel settings.
+        self.channel_map: Dict[str, int] = {}
+        # 'id', 'num' and 'name' of the gateway's own node, for the LOCAL_NODE_* template placeholders.
+        self.local_node_info: Dict[str, object] = {}
+        self.outbound = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def key(self) -> int:
+        """Stable 31-bit number of the gateway name; part of the identity of the packets it receives."""
+        return zlib.crc32(self.name.encode('utf-8')) & 0x7FFFFFFF
+
+    def matches_interface(self, interface) -> bool:
+        if interface is None:
+            return False
+        if interface is self.interface:
+            return True
+        # Connection events and node updates arrive while the TCPInterface is still being constructed,
+        # i.e. before it is assigned to self.interface.
+        return getattr(interface, 'hostname', None) == self.host and getattr(interface, 'portNumber', None) == self.port
+
+    def map_channel(self, internal_channel_id) -> Optional[int]:
+        return self.channel_map.get(internal_channel_id)
+
+    def reset_local_node(self):
+        self.channel_map = {}
+        self.local_node_info = {}
+
+    def send_text(self, text: str, destination_id: str, channel_index: Optional[int], want_ack: bool):
+        """Send callback of the gateway's outbound scheduler; exceptions make the scheduler retry."""
+        interface = self.interface
+        if not interface:
+            raise ConnectionError(f"Meshtastic interface of gateway {self.name} not available")
+        send_args = {
+            "text": text,
+            "destinationId": destination_id,
+            "wantAck": want_ack
+        }
+        if channel_index is not None:
+            send_args["channelIndex"] = channel_index
+        interface.sendText(**send_args)
+
+    def close_interface(self):
+        interface, self.interface = self.interface, None
+        if interface is not None:
+            try:
+                interface.close()
+            except Exception as e:
+                logger.error(f"Error closing Meshtastic interface of gateway {self.name}: {e}")
+
+    def __repr__(self):
+        return f"<Gateway {self.name} {self.address}>"
+
+
+class GatewayRegistry:
+    """The configured gateways, in configuration order. The first one is the primary gateway."""
+
+    def __init__(self, gateways: List[Gateway]):
+        if not gateways:
+            raise ValueError("At least one gateway is required.")
+        self._gateways = list(gateways)
+        self._by_name = {gateway.name: gateway for gateway in self._gateways}
+
+    @property
+    def primary(self) -> Gateway:
+        return self._gateways[0]
+
+    def get(self, name: Optional[str]) -> Optional[Gateway]:
+        return self._by_name.get(name)
+
+    def for_interface(self, interface) -> Optional[Gateway]:
+        for gateway in self._gateways:
+            if gateway.matches_interface(interface):
+                return gateway
+        return None
+
+    def __iter__(self) -> Iterator[Gateway]:
+        return iter(self._gateways)
+
+    def __len__(self) -> int:
+        return len(self._gateways)
+
+
+def parse_gateways(spec: str, default_host: str, default_port: int) -> List[Gateway]:
+    """
+    Parses MESHTASTIC_GATEWAYS, a comma-separated list of `name=host:port` entries (name and port
+    are optional, e.g. "roof=192.168.20.105:4403,valley=192.168.20.106"). An empty spec means a
+    single gateway at MESHTASTIC_DEVICE_HOST/PORT.
+    """
+    entries = [entry.strip() for entry in (spec or '').split(',') if entry.strip()]
+    if not entries:
+        return [Gateway(DEFAULT_GATEWAY_NAME, default_host, default_port, state_id=1)]
+
+    gateways = []
+    for state_id, entry in enumerate(entries, start=1):
+        name, separator, address = entry.partition('=')
+        if not separator:
+            name, address = '', entry
+        host, separator, port = address.strip().rpartition(':')
+        if not separator:
+            host, port = port, ''
+        host = host.strip().strip('[]')
+        if not host:
+            raise ValueError(f"Gateway entry '{entry}' has no host.")
+        try:
+            port = int(port) if port.strip() else int(default_port)
+        except ValueError:
+            raise ValueError(f"Gateway entry '{entry}' has an invalid port.")
+        name = name.strip() or f"{host}:{port}"
+        if any(gateway.name == name for gateway in gateways):
+            raise ValueError(f"Gateway name '{name}' is configured twice.")
+        gateways.append(Gateway(name, host, port, state_id=state_id))
+    return gateways
@@ -0,0 +1,21 @@
+# metrastics_listener/ingest.py
+from typing import Any, Callable, List, Optional
+
+from metrastics.batching import BatchWriter
+
+
+class IngestPipeline(BatchWriter):
+    """
+    Bounded write-behind queue between the Meshtastic reader thread and the database.
+
+    The pubsub callbacks only enqueue prepared records; the writer thread hands them to
+    `flush_callback` in batches (see BatchWriter).
+    """
+
+    def __init__(self, flush_callback: Callable[[List[Any]], None], batch_size: int = 100,
+                 flush_interval: float = 1.0, max_queue_size: int = 5000,
+                 tick_callback: Optional[Callable[[], None]] = None, name: str = 'ingest-writer',
+                 record_queue: Optional[Any] = None):
+        super().__init__(flush_callback, batch_size=batch_size, flush_interval=flush_interval,
+                         max_queue_size=max_queue_size, tick_callback=tick_callback, name=name,
+                         record_queue=record_queue)
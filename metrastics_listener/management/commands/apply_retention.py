@@ -0,0 +1,24 @@
+# metrastics_listener/management/commands/apply_retention.py
+from django.core.management.base import BaseCommand
+
+from metrastics_listener.retention import get_retention_manager
+
+
+class Command(BaseCommand):
+    help = ('Applies the retention policies once: deletes old packets, downsamples old telemetry to hourly means and '
+            'thins old positions, in small chunks. Safe to run while the listener is running.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-seconds', type=float,
+                            help='Stop after this many seconds; the next run continues where this one stopped.')
+
+    def handle(self, *args, **options):
+        results = get_retention_manager().run(max_seconds=options['max_seconds'])
+        if not results:
+            self.stdout.write(self.style.WARNING("All retention policies are disabled."))
+            return
+        for policy, result in results.items():
+            details = ', '.join(f"{key} {value}" for key, value in result.items() if key != 'done')
+            state = 'done' if result['done'] else 'stopped early, run again to continue'
+            self.stdout.write(f"{policy:10} {details} ({state})")
+        self.stdout.write(self.style.SUCCESS("Retention applied."))
@@ -0,0 +1,161 @@
+# metrastics_listener/management/commands/benchmark_listener.py
+import json
+import logging
+import platform
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from metrastics_commander.dispatcher import CommanderDispatcher
+from metrastics_listener import packet_fixtures
+from metrastics_listener.management.commands import listen_device
+from metrastics_listener.models import Message, Node
+from metrastics_listener.serialization import ensure_serializable
+
+ALL_PLACEHOLDERS_TEMPLATE = (
+    "Hallo <SENDER_LONG_NAME> (<SENDER_ID>/<SENDER_NUM>, <SENDER_SHORT_NAME>, <SENDER_HW_MODEL>, <SENDER_ROLE>, "
+    "lokal: <SENDER_IS_LOCAL>), zuletzt <SENDER_LAST_HEARD>, SNR <SENDER_SNR> RSSI <SENDER_RSSI>, "
+    "<LOCATION> um <SENDER_POSITION_TIME>, Akku <SENDER_BATTERY_LEVEL> <SENDER_VOLTAGE>, up <SENDER_UPTIME_SECONDS>s. "
+    "Du schriebst '<RECEIVED_MESSAGE_TEXT>' auf Kanal <RECEIVED_MESSAGE_CHANNEL_INDEX> um "
+    "<RECEIVED_MESSAGE_TIMESTAMP>. Gruss von <LOCAL_NODE_NAME> (<LOCAL_NODE_ID>) um <CURRENT_TIME_UTC_HHMMSS>."
+)
+
+
+def _sample_node() -> Node:
+    return Node(node_id='!11223344', node_num=0x11223344, long_name="Berlin Mitte Router", short_name="BMR",
+                hw_model='HELTEC_V3', role='ROUTER', is_local=False, last_heard=1700000000.0, snr=7.5, rssi=-87,
+                latitude=52.52, longitude=13.405, altitude=34, position_time=1699999990, battery_level=87,
+                voltage=4.01, uptime_seconds=86400)
+
+
+class Command(BaseCommand):
+    help = ('Runs microbenchmarks of the listener hot paths without a Meshtastic device and writes the results as '
+            'JSON. The on_receive_django case runs against a fresh test database (in memory for SQLite).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--packets', type=int, default=500, help='Number of packets in the traffic mix.')
+        parser.add_argument('--rounds', type=int, default=5, help='Timed rounds per case (best round counts).')
+        parser.add_argument('--cases', help='Comma-separated subset of cases to run (default: all).')
+        parser.add_argument('--output', metavar='PATH', help='Write the results as JSON to PATH.')
+        parser.add_argument('--compare', metavar='PATH', help='JSON results of an earlier run to compare against.')
+
+    def _run_case(self, function, inputs: list, rounds: int) -> dict:
+        round_seconds = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for item in inputs:
+                function(item)
+            round_seconds.append(time.perf_counter() - start)
+        count = len(inputs)
+        return {
+            'ops': count,
+            'rounds': rounds,
+            'best_us_per_op': round(min(round_seconds) / count * 1e6, 3),
+            'mean_us_per_op': round(sum(round_seconds) / rounds / count * 1e6, 3),
+        }
+
+    def _bench_on_receive(self, packet_count: int, rounds: int) -> dict:
+        """Every round gets fresh packet ids, otherwise all rounds after the first would only store duplicates."""
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        commander = CommanderDispatcher(handler=lambda *job: None, workers=1, max_queue_size=1000000,
+                                        name='benchmark-commander')
+        commander.start()
+        listen_device._commander_dispatcher = commander
+        try:
+            round_seconds = []
+            for _ in range(rounds):
+                listen_device.get_node_cache().clear()
+                listen_device.get_deduplicator().clear()
+                packets = packet_fixtures.packet_mix(count=packet_count)
+                start = time.perf_counter()
+                for packet in packets:
+                    listen_device.on_receive_django(packet, None)
+                round_seconds.append(time.perf_counter() - start)
+        finally:
+            listen_device._commander_dispatcher = None
+            commander.stop()
+            listen_device.get_node_cache().clear()
+            listen_device.get_deduplicator().clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        return {
+            'ops': packet_count,
+            'rounds': rounds,
+            'best_us_per_op': round(min(round_seconds) / packet_count * 1e6, 3),
+            'mean_us_per_op': round(sum(round_seconds) / rounds / packet_count * 1e6, 3),
+        }
+
+    def handle(self, *args, **options):
+        rounds = max(1, options['rounds'])
+        packets = packet_fixtures.packet_mix(count=options['packets'])
+        node_nums = [packet['from'] for packet in packets]
+        node_ids = [listen_device.get_node_id_str(node_num) for node_num in node_nums]
+        channel_ids = [packet.get('channel', 0) for packet in packets]
+        node = _sample_node()
+        message = Message(text="!status bitte", timestamp=1700000000.0, channel=0)
+        now_utc = datetime.now(dt_timezone.utc)
+
+        cases = {
+            'classify_packet_type': lambda: self._run_case(listen_device.classify_packet_type, packets, rounds),
+            'ensure_serializable': lambda: self._run_case(ensure_serializable, packets, rounds),
+            'get_node_id_str': lambda: self._run_case(listen_device.get_node_id_str, node_nums, rounds),
+            'get_node_num_from_id_str': lambda: self._run_case(listen_device.get_node_num_from_id_str, node_ids, rounds),
+            'map_internal_channel_to_user_index': lambda: self._run_case(
+                listen_device.map_internal_channel_to_user_index, channel_ids, rounds),
+            'render_response_template': lambda: self._run_case(
+                lambda channel: listen_device.render_response_template(ALL_PLACEHOLDERS_TEMPLATE, message, node,
+                                                                       channel, now_utc), channel_ids, rounds),
+            'on_receive_django': lambda: self._bench_on_receive(options['packets'], rounds),
+        }
+        selected = list(cases)
+        if options['cases']:
+            selected = [name.strip() for name in options['cases'].split(',') if name.strip()]
+            unknown = set(selected) - set(cases)
+            if unknown:
+                raise CommandError(f"Unknown cases: {', '.join(sorted(unknown))}. Available: {', '.join(cases)}")
+
+        baseline = {}
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file).get('results', {})
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read {options['compare']}: {e}")
+
+        # The packets use channel hash 0 only; map it like a connected node with a primary channel would.
+        gateway = listen_device.get_gateways().primary
+        saved_channel_map = gateway.channel_map
+        gateway.channel_map = {**saved_channel_map, **{channel_id: 0 for channel_id in set(channel_ids)}}
+        # Keep per-packet log output out of the timings.
+        logging.disable(logging.WARNING)
+        results = {}
+        try:
+            for name in selected:
+                results[name] = cases[name]()
+        finally:
+            logging.disable(logging.NOTSET)
+            gateway.channel_map = saved_channel_map
+
+        report = {
+            'created': datetime.now(dt_timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'packets': options['packets'],
+            'traffic_mix': packet_fixtures.TRAFFIC_MIX,
+            'results': results,
+        }
+
+        self.stdout.write(f"Packets: {options['packets']} (mix: {', '.join(packet_fixtures.TRAFFIC_MIX)}), "
+                          f"{rounds} rounds per case.")
+        for name, result in results.items():
+            line = f"{name:36} {result['best_us_per_op']:10.2f} us/op"
+            previous = baseline.get(name)
+            if previous and result['best_us_per_op']:
+                line += f"   {previous['best_us_per_op'] / result['best_us_per_op']:5.2f}x vs. baseline"
+            self.stdout.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
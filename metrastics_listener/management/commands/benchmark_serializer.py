@@ -0,0 +1,90 @@
+# metrastics_listener/management/commands/benchmark_serializer.py
+import base64
+import json
+import logging
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metrastics_listener import packet_fixtures
+from metrastics_listener.serialization import ensure_serializable
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_ensure_serializable(obj: Any) -> Any:
+    """The reflection-based serializer the listener used before the field-plan serializer (baseline)."""
+    if isinstance(obj, dict):
+        return {k: legacy_ensure_serializable(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple, set)):
+        return [legacy_ensure_serializable(item) for item in obj]
+    elif isinstance(obj, bytes):
+        try:
+            return obj.decode('utf-8')
+        except UnicodeDecodeError:
+            return f"base64:{base64.b64encode(obj).decode('utf-8')}"
+    elif hasattr(obj, 'DESCRIPTOR') and hasattr(obj.DESCRIPTOR, 'fields') and not isinstance(obj, type):
+        serializable_dict = {}
+        for field_descriptor in obj.DESCRIPTOR.fields:
+            field_name = field_descriptor.name
+            try:
+                value = getattr(obj, field_name)
+                if isinstance(value, bytes) and field_name in ['macaddr', 'id', 'channel_id']:
+                    serializable_dict[field_name] = value.hex()
+                elif isinstance(value, bytes) and field_name == 'psk':
+                    serializable_dict[field_name] = f"bytes_len:{len(value)}"
+                else:
+                    serializable_dict[field_name] = legacy_ensure_serializable(value)
+            except Exception as e:
+                logger.debug(f"Could not serialize Protobuf field '{field_name}': {e}")
+        return serializable_dict
+    try:
+        json.dumps(obj)
+        return obj
+    except (TypeError, OverflowError):
+        logger.warning(
+            f"Object of type {type(obj)} could not be serialized to dict/JSON, falling back to string representation.")
+        return str(obj)
+
+
+class Command(BaseCommand):
+    help = 'Compares the field-plan packet serializer against the legacy reflection serializer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--packets', type=int, default=500, help='Number of packets in the traffic mix.')
+        parser.add_argument('--rounds', type=int, default=5, help='Timed rounds per serializer (best round counts).')
+
+    def _best_round(self, serializer, packets, rounds):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for packet in packets:
+                serializer(packet)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        packets = packet_fixtures.packet_mix(count=options['packets'])
+
+        # The legacy serializer logs a warning for every repeated field; keep that out of the output and timing.
+        logging.disable(logging.WARNING)
+        try:
+            # Both serializers must produce byte-identical JSON for raw_json/decoded_json.
+            for packet in packets:
+                legacy_json = json.dumps(legacy_ensure_serializable(packet))
+                new_json = json.dumps(ensure_serializable(packet))
+                if legacy_json != new_json:
+                    raise CommandError(f"Serializer output differs for packet {packet.get('id')}:\n{legacy_json}\n{new_json}")
+
+            legacy_seconds = self._best_round(legacy_ensure_serializable, packets, options['rounds'])
+            new_seconds = self._best_round(ensure_serializable, packets, options['rounds'])
+        finally:
+            logging.disable(logging.NOTSET)
+
+        count = len(packets)
+        self.stdout.write(f"Packets: {count} (mix: {', '.join(packet_fixtures.TRAFFIC_MIX)}), output identical.")
+        self.stdout.write(f"legacy ensure_serializable: {legacy_seconds / count * 1e6:8.1f} us/packet")
+        self.stdout.write(f"field-plan serializer:      {new_seconds / count * 1e6:8.1f} us/packet")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {legacy_seconds / new_seconds:.1f}x"))
@@ -5,30 +5,71 @@ import logging
 import time
 import base64
 import sys
-import re
-from typing import Optional, Any, Tuple
+from typing import Optional, Any, List, Tuple
 from datetime import datetime, timezone as dt_timezone
-import threading
+import atexit
+import copy
+from collections import Counter
+from functools import partial
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django.db import transaction, close_old_connections, OperationalError
+from django.db import transaction, close_old_connections
+from django.db.models import F
 from django.utils import timezone as django_timezone
 
 import meshtastic
 import meshtastic.tcp_interface
 from pubsub import pub
-from flask import Flask, request as flask_request, jsonify
+from flask import Flask, Response, request as flask_request, jsonify
+from werkzeug.serving import make_server
 from flask_cors import CORS # Import CORS
-import requests
 import openai
 
 from metrastics_listener.models import Node, Packet, Message, Position, Telemetry, ListenerState, Traceroute
-from metrastics_commander.models import CommanderRule, CommanderSettings
+from metrastics import metrics
+from metrastics.database import retry_on_lock, run_maintenance
+from metrastics_commander.cooldowns import get_cooldown_store
+from metrastics_commander.dispatcher import CommanderDispatcher
+from metrastics_commander.llm_client import LLMTimeoutError, LLMUnavailableError, close_llm_client, get_llm_client
+from metrastics_commander.rule_engine import get_rule_engine
+from metrastics_listener import counters, events, message_search, node_names
+from metrastics_listener.capture import CaptureWriter
+from metrastics_listener.dedupe import PacketDeduplicator, identity_event_id, packet_identity
+from metrastics_listener.gateways import Gateway, GatewayRegistry, parse_gateways
+from metrastics_listener.ingest import IngestPipeline
+from metrastics_listener.node_cache import NodeStateCache
+from metrastics_listener.outbound import PRIORITY_BULK, PRIORITY_INTERACTIVE, OutboundScheduler
+from metrastics_listener.retention import get_retention_manager
+from metrastics_listener.rollups import get_metrics_rollup
+from metrastics_listener.serialization import ensure_serializable
+from metrastics_listener.shedding import SheddingQueue
+from metrastics_listener.supervisor import ListenerSupervisor
 
 logger = logging.getLogger(__name__)
 commander_logger = logging.getLogger('metrastics_commander')
 
+PACKETS_RECEIVED = metrics.counter('metrastics_listener_packets_received_total',
+                                   'Packets received from the mesh.', ['packet_type', 'portnum'])
+INGEST_STAGE_SECONDS = metrics.histogram('metrastics_listener_ingest_stage_seconds',
+                                         'Time spent per ingest stage (serialize and classify per packet, '
+                                         'db_write per batch, commander per message).', ['stage'])
+DB_TRANSACTION_SECONDS = metrics.histogram('metrastics_listener_db_transaction_seconds',
+                                           'Duration of the ingest batch transactions.')
+QUEUE_DEPTH = metrics.gauge('metrastics_listener_queue_depth', 'Items waiting in the listener queues.', ['queue'])
+CONNECTION_EVENTS = metrics.counter('metrastics_listener_connection_events_total',
+                                    'Meshtastic connection events.', ['gateway', 'event'])
+CONNECT_ATTEMPTS = metrics.counter('metrastics_listener_connect_attempts_total',
+                                   'Attempts to (re)connect to a Meshtastic gateway.', ['gateway'])
+PACKETS_DEDUPLICATED = metrics.counter('metrastics_listener_packets_deduplicated_total',
+                                       'Received packets that were not stored again.', ['reason'])
+_PACKETS_ALREADY_STORED = PACKETS_DEDUPLICATED.labels(reason='already_stored')
+_PACKET_COPIES = PACKETS_DEDUPLICATED.labels(reason='copy')
+_SERIALIZE_SECONDS = INGEST_STAGE_SECONDS.labels(stage='serialize')
+_CLASSIFY_SECONDS = INGEST_STAGE_SECONDS.labels(stage='classify')
+_DB_WRITE_SECONDS = INGEST_STAGE_SECONDS.labels(stage='db_write')
+_COMMANDER_SECONDS = INGEST_STAGE_SECONDS.labels(stage='commander')
+
 flask_app = Flask(__name__)
 # Apply CORS to the Flask app.
 # For development, you can allow all origins with origins="*"
@@ -38,44 +79,6 @@ CORS(flask_app)
 # CORS(flask_app, resources={r"/send_meshtastic_message": {"origins": "http://127.0.0.1:8000"}})
 
 
-meshtastic_interface_instance_for_flask = None
-
-
-def ensure_serializable(obj: Any) -> Any:
-    if isinstance(obj, dict):
-        return {k: ensure_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, (list, tuple, set)):
-        return [ensure_serializable(item) for item in obj]
-    elif isinstance(obj, bytes):
-        try:
-            return obj.decode('utf-8')
-        except UnicodeDecodeError:
-            return f"base64:{base64.b64encode(obj).decode('utf-8')}"
-    elif hasattr(obj, 'DESCRIPTOR') and hasattr(obj.DESCRIPTOR, 'fields') and not isinstance(obj, type):
-        serializable_dict = {}
-        for field_descriptor in obj.DESCRIPTOR.fields:
-            field_name = field_descriptor.name
-            try:
-                value = getattr(obj, field_name)
-                if isinstance(value, bytes) and field_name in ['macaddr', 'id', 'channel_id']:
-                    serializable_dict[field_name] = value.hex()
-                elif isinstance(value, bytes) and field_name == 'psk':
-                    serializable_dict[field_name] = f"bytes_len:{len(value)}"
-                elif hasattr(value, 'DESCRIPTOR') and hasattr(value.DESCRIPTOR, 'fields'):
-                    serializable_dict[field_name] = ensure_serializable(value)
-                else:
-                    serializable_dict[field_name] = ensure_serializable(value)
-            except Exception as e:
-                logger.debug(f"Could not serialize Protobuf field '{field_name}': {e}")
-        return serializable_dict
-    try:
-        json.dumps(obj)
-        return obj
-    except (TypeError, OverflowError):
-        logger.warning(
-            f"Object of type {type(obj)} could not be serialized to dict/JSON, falling back to string representation.")
-        return str(obj)
-
 
 def classify_packet_type(packet_dict: dict) -> Tuple[str, Any]:
     decoded = packet_dict.get('decoded')
@@ -149,16 +152,34 @@ def get_node_num_from_id_str(node_id_str: str) -> Optional[int]:
     return None
 
 
-_local_node_channel_map_cache = {}
-_local_node_info_cache = {}
+_gateways: Optional[GatewayRegistry] = None
+
 
+def get_gateways() -> GatewayRegistry:
+    global _gateways
+    if _gateways is None:
+        _gateways = GatewayRegistry(parse_gateways(
+            getattr(settings, 'MESHTASTIC_GATEWAYS', ''),
+            settings.MESHTASTIC_DEVICE_HOST,
+            settings.MESHTASTIC_DEVICE_PORT,
+        ))
+    return _gateways
 
-def map_internal_channel_to_user_index(internal_channel_id):
-    global _local_node_channel_map_cache
-    user_index = _local_node_channel_map_cache.get(internal_channel_id)
+
+def resolve_gateway(interface) -> Gateway:
+    """The gateway an event was received by; the primary gateway if the interface is not known (e.g. None)."""
+    gateways = get_gateways()
+    return gateways.for_interface(interface) or gateways.primary
+
+
+def map_internal_channel_to_user_index(internal_channel_id, gateway: Optional[Gateway] = None):
+    if gateway is None:
+        gateway = get_gateways().primary
+    user_index = gateway.map_channel(internal_channel_id)
     if user_index is None:
         logger.warning(
-            f"No user index for internal channel ID '{internal_channel_id}' in channel_map found. Defaulting to 0.")
+            f"No user index for internal channel ID '{internal_channel_id}' in channel_map of gateway "
+            f"{gateway.name} found. Defaulting to 0.")
         return 0
     return user_index
 
@@ -185,16 +206,19 @@ def handle_send_meshtastic_message():
         # The important part is that Flask-CORS adds the headers.
         return jsonify({"status": "success", "message": "CORS preflight successful"}), 200
 
-    global meshtastic_interface_instance_for_flask
-    if not meshtastic_interface_instance_for_flask:
-        logger.error("Flask: Meshtastic interface not available.")
-        return jsonify({"status": "error", "message": "Meshtastic interface not ready"}), 503
-
     try:
         data = flask_request.get_json()
         if not data:
             return jsonify({"status": "error", "message": "Invalid JSON payload"}), 400
 
+        gateway_name = data.get('gateway')
+        gateway = get_gateways().get(gateway_name) if gateway_name else get_gateways().primary
+        if gateway is None:
+            return jsonify({"status": "error", "message": f"Unknown gateway '{gateway_name}'"}), 400
+        if not gateway.interface:
+            logger.error(f"Flask: Meshtastic interface of gateway {gateway.name} not available.")
+            return jsonify({"status": "error", "message": "Meshtastic interface not ready"}), 503
+
         text_to_send = data.get('text')
         destination_id = data.get('destinationId')
         want_ack = data.get('wantAck', True)
@@ -206,52 +230,109 @@ def handle_send_meshtastic_message():
         commander_logger.info(
             f"Flask: Received send request for {destination_id}: '{text_to_send}' (Ack: {want_ack}, Ch: {channel_index})")
 
-        send_args = {
-            "text": text_to_send,
-            "destinationId": destination_id,
-            "wantAck": want_ack
-        }
         if channel_index is not None:
             try:
-                send_args["channelIndex"] = int(channel_index)
+                channel_index = int(channel_index)
             except ValueError:
                 commander_logger.warning(f"Flask: Invalid channelIndex '{channel_index}' received, ignoring.")
+                channel_index = None
 
-        meshtastic_interface_instance_for_flask.sendText(**send_args)
-        commander_logger.info(f"Flask: Message for {destination_id} passed to Meshtastic interface.")
-        return jsonify({"status": "success", "message": "Message sent to Meshtastic interface"}), 200
+        priority = PRIORITY_BULK if data.get('priority') == 'bulk' else PRIORITY_INTERACTIVE
+        if not queue_outbound_text(text_to_send, destination_id, channel_index, want_ack=want_ack, priority=priority,
+                                   gateway_name=gateway.name):
+            return jsonify({"status": "error", "message": "Outbound queue full or not running"}), 503
+        commander_logger.info(f"Flask: Message for {destination_id} queued for sending.")
+        return jsonify({"status": "success", "message": "Message queued for sending"}), 200
 
-    except meshtastic.MeshtasticException as me:
-        commander_logger.error(f"Flask: MeshtasticException during sendText: {me}")
-        return jsonify({"status": "error", "message": f"Meshtastic error: {str(me)}"}), 500
     except Exception as e:
         commander_logger.exception("Flask: Unexpected error in /send_meshtastic_message")
         return jsonify({"status": "error", "message": f"Internal server error: {str(e)}"}), 500
 
 
+@flask_app.route('/outbound_stats', methods=['GET'])
+def handle_outbound_stats():
+    gateways = get_gateways()
+    if gateways.primary.outbound is None:
+        return jsonify({"status": "error", "message": "Outbound scheduler not running"}), 503
+    # Every gateway radio has its own airtime budget and scheduler; 'stats' is the primary gateway's.
+    return jsonify({"status": "success", "stats": gateways.primary.outbound.stats(),
+                    "gateways": {gateway.name: gateway.outbound.stats()
+                                 for gateway in gateways if gateway.outbound is not None}}), 200
+
+
+@flask_app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+
+@flask_app.route('/listener_stats', methods=['GET'])
+def handle_listener_stats():
+    if _supervisor is None:
+        return jsonify({"status": "error", "message": "Listener supervisor not running"}), 503
+    stats = _supervisor.stats()
+    stats['retention'] = get_retention_manager().stats()
+    stats['rollup'] = get_metrics_rollup().stats()
+    stats['events'] = events.get_event_broker().stats()
+    return jsonify({"status": "success", "stats": stats}), 200
+
+
+@flask_app.route('/events', methods=['GET'])
+def handle_events():
+    """
+    Server-Sent Events stream of packets, node changes, status changes and counter deltas.
+    Clients resume with the Last-Event-ID header (sent by EventSource on reconnect) or ?last_event_id=.
+    """
+    broker = events.get_event_broker()
+    if broker.subscribers >= getattr(settings, 'LISTENER_EVENTS_MAX_SUBSCRIBERS', 100):
+        return jsonify({"status": "error", "message": "Too many event subscribers"}), 503
+    last_event_id = flask_request.headers.get('Last-Event-ID') or flask_request.args.get('last_event_id')
+    return Response(broker.subscribe(last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@flask_app.route('/commander_stats', methods=['GET'])
+def handle_commander_stats():
+    if _commander_dispatcher is None:
+        return jsonify({"status": "error", "message": "Commander dispatcher not running"}), 503
+    stats = _commander_dispatcher.stats()
+    stats['llm'] = get_llm_client().stats()
+    return jsonify({"status": "success", "stats": stats}), 200
+
+
+def queue_outbound_text(text: str, destination_id: str, channel_index: Optional[int] = None, want_ack: bool = True,
+                        priority: int = PRIORITY_INTERACTIVE, gateway_name: Optional[str] = None) -> bool:
+    """Queues a text for sending through a gateway (default: the primary gateway)."""
+    gateway = get_gateways().get(gateway_name) if gateway_name else get_gateways().primary
+    if gateway is None:
+        commander_logger.error(f"Unknown gateway '{gateway_name}', message to {destination_id} not sent.")
+        return False
+    scheduler = gateway.outbound
+    if scheduler is None or not scheduler.is_running:
+        commander_logger.error(f"Outbound scheduler of gateway {gateway.name} not running, "
+                               f"message to {destination_id} not sent.")
+        return False
+    return scheduler.enqueue(text, destination_id, channel_index, want_ack=want_ack, priority=priority)
+
+
 def call_chatgpt_api(user_query: str) -> Optional[str]:
     api_key = settings.OPENAI_API_KEY
-    system_prompt = settings.CHATGPT_SYSTEM_PROMPT
 
     if not api_key or api_key == "your_openai_api_key_here":
         commander_logger.error("OpenAI API key is not configured or is placeholder in settings.py.")
         return "OpenAI API key not configured."
-    if not api_key.startswith("sk-"):
+    if not api_key.startswith("sk-") and not getattr(settings, 'OPENAI_BASE_URL', None):
         commander_logger.warning(f"OpenAI API key in settings.py does not look like a valid key: {api_key[:10]}...")
 
     try:
-        client = openai.OpenAI(api_key=api_key)
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_query}
-            ],
-            max_tokens=150
-        )
-        response_text = completion.choices[0].message.content
+        response_text = get_llm_client().ask(user_query)
         commander_logger.info(f"ChatGPT API response: {response_text}")
-        return response_text.strip()
+        return response_text
+    except LLMTimeoutError as e:
+        commander_logger.error(f"ChatGPT request timed out: {e}")
+        return "Error: ChatGPT did not answer in time."
+    except LLMUnavailableError as e:
+        commander_logger.warning(f"ChatGPT request rejected: {e}")
+        return "Error: ChatGPT is unavailable, please try again later."
     except openai.APIConnectionError as e:
         commander_logger.error(f"OpenAI API Connection Error: {e}")
         return "Error: Could not connect to OpenAI."
@@ -266,19 +347,76 @@ def call_chatgpt_api(user_query: str) -> Optional[str]:
         return "Error: An unexpected error occurred with ChatGPT."
 
 
-def process_commander_rules(incoming_message_obj: Message, from_node_obj: Node, flask_send_url: str,
-                            original_channel_index: Optional[int]):
-    global _local_node_info_cache
+def render_response_template(template: str, incoming_message_obj: Message, from_node_obj: Node,
+                             original_channel_index: Optional[int], now_utc: Optional[datetime] = None,
+                             local_node_info: Optional[dict] = None) -> str:
+    """
+    Replaces the <PLACEHOLDER>s of a commander response template. LOCAL_NODE_* describe the gateway
+    that received the message (default: the primary gateway).
+    """
+    if now_utc is None:
+        now_utc = datetime.now(dt_timezone.utc)
+    if local_node_info is None:
+        local_node_info = get_gateways().primary.local_node_info
+    now_iso = now_utc.isoformat()
+    response_text = template
+    replacements = {
+        "<SENDER_ID>": str(from_node_obj.node_id or "N/A"),
+        "<SENDER_NUM>": str(from_node_obj.node_num or "N/A"),
+        "<SENDER_LONG_NAME>": str(from_node_obj.long_name or "N/A"),
+        "<SENDER_SHORT_NAME>": str(from_node_obj.short_name or "N/A"),
+        "<SENDER_HW_MODEL>": str(from_node_obj.hw_model or "N/A"),
+        "<SENDER_ROLE>": str(from_node_obj.role or "N/A"),
+        "<SENDER_IS_LOCAL>": "Ja" if from_node_obj.is_local else "Nein",
+        "<SENDER_LAST_HEARD>": format_timestamp_for_template(from_node_obj.last_heard),
+        "<SENDER_SNR>": str(from_node_obj.snr or "N/A"),
+        "<SENDER_RSSI>": str(from_node_obj.rssi or "N/A"),
+        "<SENDER_LATITUDE>": str(from_node_obj.latitude or "N/A"),
+        "<SENDER_LONGITUDE>": str(from_node_obj.longitude or "N/A"),
+        "<SENDER_ALTITUDE>": str(from_node_obj.altitude or "N/A"),
+        "<SENDER_POSITION_TIME>": format_timestamp_for_template(from_node_obj.position_time),
+        "<SENDER_BATTERY_LEVEL>": str(
+            from_node_obj.battery_level if from_node_obj.battery_level not in [None, 255] else "N/A") + (
+            "%" if from_node_obj.battery_level not in [None, 255] else ""),
+        "<SENDER_VOLTAGE>": f"{from_node_obj.voltage:.2f}V" if from_node_obj.voltage is not None else "N/A",
+        "<SENDER_UPTIME_SECONDS>": str(from_node_obj.uptime_seconds or "N/A"),
+        "<RECEIVED_MESSAGE_TEXT>": str(incoming_message_obj.text or ""),
+        "<RECEIVED_MESSAGE_CHANNEL_INDEX>": str(
+            original_channel_index if original_channel_index is not None else "N/A"),
+        "<RECEIVED_MESSAGE_TIMESTAMP>": str(
+            int(incoming_message_obj.timestamp)) if incoming_message_obj.timestamp else "N/A",
+        "<LOCAL_NODE_ID>": str(local_node_info.get('id', "N/A")),
+        "<LOCAL_NODE_NUM>": str(local_node_info.get('num', "N/A")),
+        "<LOCAL_NODE_NAME>": str(local_node_info.get('name', "N/A")),
+        "<CURRENT_TIME_ISO>": now_iso,
+        "<CURRENT_TIME_UTC_HHMMSS>": now_utc.strftime('%H:%M:%S'),
+    }
+    if from_node_obj.latitude is not None and from_node_obj.longitude is not None:
+        replacements["<LOCATION>"] = f"Lat: {from_node_obj.latitude:.4f}, Lon: {from_node_obj.longitude:.4f}"
+        if from_node_obj.altitude is not None:
+            replacements["<LOCATION>"] += f", Alt: {from_node_obj.altitude}m"
+    else:
+        replacements["<LOCATION>"] = "Position unbekannt"
+
+    for placeholder, value in replacements.items():
+        response_text = response_text.replace(placeholder, value)
+    return response_text
+
+
+def process_commander_rules(incoming_message_obj: Message, from_node_obj: Node, original_channel_index: Optional[int],
+                            gateway_name: Optional[str] = None):
+    """Answers a received message. Replies go out through the gateway that received it."""
     if not incoming_message_obj or not from_node_obj:
         return
+    gateway = get_gateways().get(gateway_name) or get_gateways().primary
 
     message_text = incoming_message_obj.text
     sender_node_id = from_node_obj.node_id
     now_utc = datetime.now(dt_timezone.utc)
-    now_iso = now_utc.isoformat()
 
     chatgpt_trigger = settings.CHATGPT_TRIGGER_COMMAND
-    chatbot_mode_enabled = CommanderSettings.get_solo().chatbot_mode_enabled
+    rule_snapshot = get_rule_engine().snapshot()
+    chatbot_mode_enabled = rule_snapshot.chatbot_mode_enabled
     trigger_matched = message_text.lower().startswith(chatgpt_trigger.lower())
     if chatbot_mode_enabled or trigger_matched:
         if chatbot_mode_enabled and trigger_matched:
@@ -292,452 +430,754 @@ def process_commander_rules(incoming_message_obj: Message, from_node_obj: Node,
                 f"ChatGPT command '{chatgpt_trigger}' triggered by {sender_node_id} with query: '{user_query}'" if trigger_matched else f"Chatbot mode enabled: forwarding message from {sender_node_id}")
             chatgpt_response = call_chatgpt_api(user_query)
             if chatgpt_response:
-                max_len = 220
-                if len(chatgpt_response) > max_len:
-                    chatgpt_response = chatgpt_response[:max_len - 3] + "..."
-                    commander_logger.warning(f"ChatGPT response for {sender_node_id} was truncated.")
-
-                send_payload = {
-                    "text": chatgpt_response,
-                    "destinationId": sender_node_id,
-                    "wantAck": True,
-                    "channelIndex": original_channel_index
-                }
-                try:
-                    response = requests.post(flask_send_url, json=send_payload, timeout=15)
-                    response.raise_for_status()
-                    commander_logger.info(
-                        f"Commander: ChatGPT response for {sender_node_id} requested via HTTP. Response: {response.json()}")
-                except requests.exceptions.RequestException as http_e:
-                    commander_logger.error(
-                        f"Commander: HTTP Error sending ChatGPT reply for {sender_node_id}: {http_e}")
-                except Exception as e:
-                    commander_logger.exception(
-                        f"Commander: Error processing ChatGPT send request for {sender_node_id}: {e}")
+                # Long answers are split into numbered parts by the outbound scheduler.
+                if queue_outbound_text(chatgpt_response, sender_node_id, original_channel_index,
+                                       gateway_name=gateway.name):
+                    commander_logger.info(f"Commander: ChatGPT response for {sender_node_id} queued for sending.")
             else:
                 commander_logger.warning(
                     f"Commander: No response from ChatGPT for query: '{user_query}' from {sender_node_id}")
         else:
             commander_logger.info(
                 f"ChatGPT command '{chatgpt_trigger}' triggered by {sender_node_id} but no query provided.")
-            send_payload = {
-                "text": f"Please provide a query after {chatgpt_trigger}.",
-                "destinationId": sender_node_id,
-                "wantAck": True,
-                "channelIndex": original_channel_index
-            }
-            try:
-                requests.post(flask_send_url, json=send_payload, timeout=10)
-            except Exception:
-                pass
+            queue_outbound_text(f"Please provide a query after {chatgpt_trigger}.", sender_node_id,
+                                original_channel_index, gateway_name=gateway.name)
         return
 
     try:
-        with transaction.atomic():
-            rules_list = list(CommanderRule.objects.filter(enabled=True))
+        # No transaction around the loop: replies must not hold the database write lock.
+        # Matching rules come in rule order; the first one that is not in cooldown answers.
+        cooldown_store = get_cooldown_store()
+        sender_node_num = from_node_obj.node_num if from_node_obj.node_num is not None else get_node_num_from_id_str(
+            sender_node_id)
+        for rule in rule_snapshot.iter_matches(message_text):
+            if rule.cooldown_seconds > 0 and cooldown_store.is_active(rule.id, sender_node_num):
+                commander_logger.debug(f"Rule '{rule.name}' for {sender_node_id} is in cooldown. Skipping.")
+                continue
 
-            for rule in rules_list:
-                if rule.cooldown_seconds > 0:
-                    last_triggered_iso = rule.last_triggered_for_nodes.get(sender_node_id)
-                    if last_triggered_iso:
-                        try:
-                            last_triggered_dt = datetime.fromisoformat(last_triggered_iso)
-                            if (now_utc - last_triggered_dt).total_seconds() < rule.cooldown_seconds:
-                                commander_logger.debug(
-                                    f"Rule '{rule.name}' for {sender_node_id} is in cooldown. Skipping.")
-                                continue
-                        except ValueError:
-                            commander_logger.warning(
-                                f"Invalid ISO timestamp for rule '{rule.name}', node '{sender_node_id}'.")
-
-                match = False
-                trigger = rule.trigger_phrase
-                if rule.match_type == 'exact':
-                    match = (message_text == trigger)
-                elif rule.match_type == 'contains':
-                    match = (trigger.lower() in message_text.lower())
-                elif rule.match_type == 'startswith':
-                    match = message_text.lower().startswith(trigger.lower())
-                elif rule.match_type == 'regex':
-                    try:
-                        if re.search(trigger, message_text, re.IGNORECASE):
-                            match = True
-                    except re.error as e:
-                        commander_logger.error(f"Regex error in rule '{rule.name}': {e}. Skipping.")
-                        continue
-
-                if not match:
-                    continue
+            commander_logger.info(f"Rule '{rule.name}' triggered by '{message_text[:50]}...' from {sender_node_id}")
 
-                commander_logger.info(f"Rule '{rule.name}' triggered by '{message_text[:50]}...' from {sender_node_id}")
-
-                response_text = rule.response_template
-                replacements = {
-                    "<SENDER_ID>": str(from_node_obj.node_id or "N/A"),
-                    "<SENDER_NUM>": str(from_node_obj.node_num or "N/A"),
-                    "<SENDER_LONG_NAME>": str(from_node_obj.long_name or "N/A"),
-                    "<SENDER_SHORT_NAME>": str(from_node_obj.short_name or "N/A"),
-                    "<SENDER_HW_MODEL>": str(from_node_obj.hw_model or "N/A"),
-                    "<SENDER_ROLE>": str(from_node_obj.role or "N/A"),
-                    "<SENDER_IS_LOCAL>": "Ja" if from_node_obj.is_local else "Nein",
-                    "<SENDER_LAST_HEARD>": format_timestamp_for_template(from_node_obj.last_heard),
-                    "<SENDER_SNR>": str(from_node_obj.snr or "N/A"),
-                    "<SENDER_RSSI>": str(from_node_obj.rssi or "N/A"),
-                    "<SENDER_LATITUDE>": str(from_node_obj.latitude or "N/A"),
-                    "<SENDER_LONGITUDE>": str(from_node_obj.longitude or "N/A"),
-                    "<SENDER_ALTITUDE>": str(from_node_obj.altitude or "N/A"),
-                    "<SENDER_POSITION_TIME>": format_timestamp_for_template(from_node_obj.position_time),
-                    "<SENDER_BATTERY_LEVEL>": str(
-                        from_node_obj.battery_level if from_node_obj.battery_level not in [None, 255] else "N/A") + (
-                                                  "%" if from_node_obj.battery_level not in [None, 255] else ""),
-                    "<SENDER_VOLTAGE>": f"{from_node_obj.voltage:.2f}V" if from_node_obj.voltage is not None else "N/A",
-                    "<SENDER_UPTIME_SECONDS>": str(from_node_obj.uptime_seconds or "N/A"),
-                    "<RECEIVED_MESSAGE_TEXT>": str(incoming_message_obj.text or ""),
-                    "<RECEIVED_MESSAGE_CHANNEL_INDEX>": str(
-                        original_channel_index if original_channel_index is not None else "N/A"),
-                    "<RECEIVED_MESSAGE_TIMESTAMP>": str(
-                        int(incoming_message_obj.timestamp)) if incoming_message_obj.timestamp else "N/A",
-                    "<LOCAL_NODE_ID>": str(_local_node_info_cache.get('id', "N/A")),
-                    "<LOCAL_NODE_NUM>": str(_local_node_info_cache.get('num', "N/A")),
-                    "<LOCAL_NODE_NAME>": str(_local_node_info_cache.get('name', "N/A")),
-                    "<CURRENT_TIME_ISO>": now_iso,
-                    "<CURRENT_TIME_UTC_HHMMSS>": now_utc.strftime('%H:%M:%S'),
-                }
-                if from_node_obj.latitude is not None and from_node_obj.longitude is not None:
-                    replacements[
-                        "<LOCATION>"] = f"Lat: {from_node_obj.latitude:.4f}, Lon: {from_node_obj.longitude:.4f}"
-                    if from_node_obj.altitude is not None:
-                        replacements["<LOCATION>"] += f", Alt: {from_node_obj.altitude}m"
-                else:
-                    replacements["<LOCATION>"] = "Position unbekannt"
-
-                for placeholder, value in replacements.items():
-                    response_text = response_text.replace(placeholder, value)
-
-                max_len = 220
-                if len(response_text) > max_len:
-                    response_text = response_text[:max_len - 3] + "..."
-                    commander_logger.warning(f"Response for rule '{rule.name}' was truncated.")
-
-                send_payload = {
-                    "text": response_text,
-                    "destinationId": sender_node_id,
-                    "wantAck": True,
-                    "channelIndex": original_channel_index
-                }
-                try:
-                    commander_logger.info(f"Commander: Sending POST to {flask_send_url} with payload: {send_payload}")
-                    response_http = requests.post(flask_send_url, json=send_payload,
-                                                  timeout=10)
-                    response_http.raise_for_status()
+            response_text = render_response_template(rule.response_template, incoming_message_obj, from_node_obj,
+                                                     original_channel_index, now_utc, gateway.local_node_info)
 
+            if queue_outbound_text(response_text, sender_node_id, original_channel_index, gateway_name=gateway.name):
+                commander_logger.info(f"Commander: Reply for rule '{rule.name}' to {sender_node_id} queued for sending.")
+                if rule.cooldown_seconds > 0:
+                    cooldown_store.trigger(rule.id, sender_node_num, rule.cooldown_seconds)
                     commander_logger.info(
-                        f"Commander: Reply for rule '{rule.name}' to {sender_node_id} requested via HTTP. Response: {response_http.json()}")
-
-                    if response_http.json().get("status") == "success":
-                        if rule.cooldown_seconds > 0:
-                            if not isinstance(rule.last_triggered_for_nodes, dict):
-                                rule.last_triggered_for_nodes = {}
-                            rule.last_triggered_for_nodes[sender_node_id] = now_iso
-                            rule.save(update_fields=['last_triggered_for_nodes', 'updated_at'])
-                            commander_logger.info(
-                                f"Commander: Cooldown updated for rule '{rule.name}' for node {sender_node_id}.")
-                    else:
-                        commander_logger.warning(
-                            f"Commander: Send request via HTTP for rule '{rule.name}' reported failure: {response_http.json().get('message')}")
-
-                except requests.exceptions.RequestException as http_e:
-                    commander_logger.error(f"Commander: HTTP Error sending reply for rule '{rule.name}': {http_e}")
-                except Exception as e:
-                    commander_logger.exception(
-                        f"Commander: Error processing send request or saving rule '{rule.name}': {e}")
-                break
+                        f"Commander: Cooldown updated for rule '{rule.name}' for node {sender_node_id}.")
+            else:
+                commander_logger.warning(f"Commander: Reply for rule '{rule.name}' to {sender_node_id} could not be queued.")
+            break
     except Exception as e:
         commander_logger.exception(f"Database or other critical error in process_commander_rules: {e}")
 
 
-def on_receive_django(packet, interface):
-    logger.debug(f"on_receive_django: Packet received: {packet}")
-    try:
-        close_old_connections()
-        packet_data_dict = ensure_serializable(packet)
+def build_packet_record(packet, gateway: Optional[Gateway] = None) -> dict:
+    """
+    Serializes and classifies a raw packet from the Meshtastic library, received by `gateway`
+    (default: the primary gateway). Runs on the reader thread and does not touch the database.
+    """
+    if gateway is None:
+        gateway = get_gateways().primary
+    started_at = time.perf_counter()
+    packet_data_dict = ensure_serializable(packet)
+    _SERIALIZE_SECONDS.observe(time.perf_counter() - started_at)
 
-        current_time_epoch = time.time()
-        packet_data_dict['timestamp'] = packet_data_dict.get('rxTime', current_time_epoch)
+    current_time_epoch = time.time()
+    packet_data_dict['timestamp'] = packet_data_dict.get('rxTime', current_time_epoch)
 
-        packet_id_val = packet_data_dict.get('id', packet_data_dict.get('decoded', {}).get('id', 'no_id'))
-        if isinstance(packet_id_val, bytes):
-            packet_id_val = packet_id_val.hex()
+    packet_id_val = packet_data_dict.get('id', packet_data_dict.get('decoded', {}).get('id', 'no_id'))
+    if isinstance(packet_id_val, bytes):
+        packet_id_val = packet_id_val.hex()
 
-        if 'event_id' not in packet_data_dict or not packet_data_dict['event_id']:
+    from_num = packet_data_dict.get('from')
+    to_num = packet_data_dict.get('to')
+
+    identity = packet_identity(gateway.key, from_num, packet_data_dict.get('id'), packet_data_dict.get('rxTime'))
+    if 'event_id' not in packet_data_dict or not packet_data_dict['event_id']:
+        if identity is not None:
+            packet_data_dict['event_id'] = identity_event_id(identity)
+        else:
             packet_data_dict['event_id'] = f"pkt_{int(current_time_epoch * 1e6)}_{packet_id_val}"
 
-        from_num = packet_data_dict.get('from')
-        to_num = packet_data_dict.get('to')
-
-        from_id_str = get_node_id_str(from_num) if from_num is not None else None
-        to_id_str = None
-        if to_num is not None:
-            to_id_str = "^all" if to_num == 0xFFFFFFFF else get_node_id_str(to_num)
-
-        packet_data_dict['fromId'] = from_id_str
-        packet_data_dict['toId'] = to_id_str
-
-        original_internal_channel_id = packet_data_dict.get('channel')
-        if isinstance(original_internal_channel_id, bytes):
-            original_internal_channel_id = original_internal_channel_id.hex()
-
-        mapped_channel_index = map_internal_channel_to_user_index(
-            original_internal_channel_id) if original_internal_channel_id is not None else 0
-
-        app_packet_type, payload_specific_data = classify_packet_type(packet_data_dict)
-        flask_send_url = f"http://localhost:{Command.FLASK_PORT}/send_meshtastic_message"
-
-        db_packet_data = {
-            'event_id': packet_data_dict['event_id'],
-            'timestamp': packet_data_dict['timestamp'],
-            'rx_time': packet_data_dict.get('rxTime'),
-            'from_node_id_str': from_id_str,
-            'to_node_id_str': to_id_str,
-            'channel': mapped_channel_index,
-            'portnum': getattr(packet_data_dict.get('decoded', {}).get('portnum'), 'name',
-                               str(packet_data_dict.get('decoded', {}).get('portnum'))),
-            'packet_type': app_packet_type,
-            'rx_snr': packet_data_dict.get('rxSnr'),
-            'rx_rssi': packet_data_dict.get('rxRssi'),
-            'hop_limit': packet_data_dict.get('hopLimit'),
-            'want_ack': packet_data_dict.get('wantAck', False),
-            'decoded_json': packet_data_dict.get('decoded'),
-            'raw_json': packet_data_dict,
-        }
+    from_id_str = get_node_id_str(from_num) if from_num is not None else None
+    to_id_str = None
+    if to_num is not None:
+        to_id_str = "^all" if to_num == 0xFFFFFFFF else get_node_id_str(to_num)
+
+    packet_data_dict['fromId'] = from_id_str
+    packet_data_dict['toId'] = to_id_str
+
+    original_internal_channel_id = packet_data_dict.get('channel')
+    if isinstance(original_internal_channel_id, bytes):
+        original_internal_channel_id = original_internal_channel_id.hex()
+
+    mapped_channel_index = map_internal_channel_to_user_index(
+        original_internal_channel_id, gateway) if original_internal_channel_id is not None else 0
+
+    started_at = time.perf_counter()
+    app_packet_type, payload_specific_data = classify_packet_type(packet_data_dict)
+    _CLASSIFY_SECONDS.observe(time.perf_counter() - started_at)
+
+    db_packet_data = {
+        'event_id': packet_data_dict['event_id'],
+        'timestamp': packet_data_dict['timestamp'],
+        'rx_time': packet_data_dict.get('rxTime'),
+        'gateway_key': identity[0] if identity else None,
+        'mesh_from': identity[1] if identity else None,
+        'mesh_id': identity[2] if identity else None,
+        'from_node_id_str': from_id_str,
+        'to_node_id_str': to_id_str,
+        'channel': mapped_channel_index,
+        'portnum': getattr(packet_data_dict.get('decoded', {}).get('portnum'), 'name',
+                           str(packet_data_dict.get('decoded', {}).get('portnum'))),
+        'packet_type': app_packet_type,
+        'rx_snr': packet_data_dict.get('rxSnr'),
+        'rx_rssi': packet_data_dict.get('rxRssi'),
+        'hop_limit': packet_data_dict.get('hopLimit'),
+        'want_ack': packet_data_dict.get('wantAck', False),
+        'decoded_json': packet_data_dict.get('decoded'),
+        'raw_json': packet_data_dict,
+    }
+    PACKETS_RECEIVED.labels(app_packet_type, db_packet_data['portnum']).inc()
+
+    return {
+        'kind': 'packet',
+        'packet': db_packet_data,
+        'mesh_packet_id': packet_data_dict.get('id'),
+        'from_num': from_num,
+        'from_id_str': from_id_str,
+        'to_id_str': to_id_str,
+        'packet_type': app_packet_type,
+        'payload': payload_specific_data,
+        'internal_channel_id': original_internal_channel_id,
+        'channel_index': mapped_channel_index,
+        'gateway': gateway.name,
+    }
+
+
+# Node fields changed by the per-type handlers below; written back by the node cache.
+POSITION_NODE_FIELDS = ['latitude', 'longitude', 'altitude', 'position_time', 'position_info']
+TELEMETRY_NODE_FIELDS = ['battery_level', 'voltage', 'uptime_seconds', 'telemetry_time', 'channel_utilization',
+                         'air_util_tx', 'device_metrics_info', 'environment_metrics_info']
+USER_INFO_NODE_FIELDS = ['long_name', 'short_name', 'macaddr', 'hw_model', 'role', 'user_info']
+
+
+def _build_message(record: dict, packet_obj: Packet, from_node_obj: Node, to_node_obj: Optional[Node]) -> Message:
+    return Message(
+        packet=packet_obj,
+        from_node=from_node_obj,
+        from_node_id_str=record['from_id_str'],
+        to_node=to_node_obj,
+        to_node_id_str=record['to_id_str'],
+        channel=record['internal_channel_id'], # Store the raw internal channel ID hex string
+        text=str(record['payload']),
+        timestamp=packet_obj.timestamp,
+        rx_snr=packet_obj.rx_snr,
+        rx_rssi=packet_obj.rx_rssi
+    )
+
+
+def _apply_position(pos_data: dict, packet_obj: Packet, from_node_obj: Node) -> Optional[Position]:
+    lat = pos_data.get('latitudeI', 0) / 1e7 if pos_data.get('latitudeI') is not None else pos_data.get(
+        'latitude')
+    lon = pos_data.get('longitudeI', 0) / 1e7 if pos_data.get('longitudeI') is not None else pos_data.get(
+        'longitude')
+    altitude = pos_data.get('altitude')
+    precision_bits = pos_data.get('precisionBits', pos_data.get('gpsPrecision'))
+    ground_speed = pos_data.get('groundSpeed')
+    ground_track = pos_data.get('groundTrack')
+    sats_in_view = pos_data.get('satsInView')
+    position_packet_time = pos_data.get('time', packet_obj.timestamp)
+
+    if lat is None or lon is None:
+        return None
+
+    from_node_obj.latitude = lat
+    from_node_obj.longitude = lon
+    from_node_obj.altitude = altitude
+    from_node_obj.position_time = position_packet_time
+    from_node_obj.position_info = pos_data
+
+    return Position(
+        node=from_node_obj,
+        timestamp=position_packet_time,
+        latitude=lat,
+        longitude=lon,
+        altitude=altitude,
+        precision_bits=precision_bits,
+        ground_speed=ground_speed,
+        ground_track=ground_track,
+        sats_in_view=sats_in_view,
+        pdop=pos_data.get('pdop'),
+        hdop=pos_data.get('hdop'),
+        vdop=pos_data.get('vdop'),
+    )
+
+
+def _apply_telemetry(metrics_data: dict, packet_obj: Packet, from_node_obj: Node) -> Telemetry:
+    dev_metrics = metrics_data.get('deviceMetrics', {})
+    env_metrics = metrics_data.get('environmentMetrics', {})
+    power_metrics = metrics_data.get('powerMetrics', {})
+
+    telemetry_packet_time = dev_metrics.get('time', power_metrics.get('time', packet_obj.timestamp))
+
+    telemetry_obj = Telemetry(
+        node=from_node_obj,
+        timestamp=telemetry_packet_time,
+        battery_level=dev_metrics.get('batteryLevel', power_metrics.get('batteryLevel')),
+        voltage=dev_metrics.get('voltage', power_metrics.get('voltage')),
+        channel_utilization=dev_metrics.get('channelUtilization'),
+        air_util_tx=dev_metrics.get('airUtilTx'),
+        uptime_seconds=dev_metrics.get('uptimeSeconds'),
+        temperature=env_metrics.get('temperature'),
+        relative_humidity=env_metrics.get('relativeHumidity'),
+        barometric_pressure=env_metrics.get('barometricPressure'),
+        gas_resistance=env_metrics.get('gasResistance'),
+        iaq=env_metrics.get('iaq')
+    )
+
+    current_battery = dev_metrics.get('batteryLevel', power_metrics.get('batteryLevel'))
+    current_voltage = dev_metrics.get('voltage', power_metrics.get('voltage'))
+    current_uptime = dev_metrics.get('uptimeSeconds')
+
+    if current_battery is not None: from_node_obj.battery_level = current_battery
+    if current_voltage is not None: from_node_obj.voltage = current_voltage
+    if current_uptime is not None: from_node_obj.uptime_seconds = current_uptime
+    if dev_metrics.get('channelUtilization') is not None:
+        from_node_obj.channel_utilization = dev_metrics.get('channelUtilization')
+    if dev_metrics.get('airUtilTx') is not None:
+        from_node_obj.air_util_tx = dev_metrics.get('airUtilTx')
+
+    from_node_obj.telemetry_time = telemetry_packet_time
+    from_node_obj.device_metrics_info = dev_metrics
+    from_node_obj.environment_metrics_info = env_metrics
+    if power_metrics:
+        if not from_node_obj.device_metrics_info: from_node_obj.device_metrics_info = {}
+        from_node_obj.device_metrics_info['powerMetrics'] = power_metrics
+    return telemetry_obj
+
+
+def _apply_user_info(user_data: dict, from_node_obj: Node) -> List[str]:
+    """
+    Applies a NODEINFO payload to the node. Returns the fields to write back: the names only if
+    they changed, since a name write-back invalidates the dashboards' name caches and re-indexes
+    the node's messages, and nodes repeat their NODEINFO every few hours.
+    """
+    names_before = [getattr(from_node_obj, field) for field in node_names.NAME_FIELDS]
+    from_node_obj.long_name = user_data.get('longName')
+    from_node_obj.short_name = user_data.get('shortName')
+    mac_addr_raw = user_data.get('macaddr')
+    if isinstance(mac_addr_raw, bytes):
+        from_node_obj.macaddr = mac_addr_raw.hex(':')
+    elif isinstance(mac_addr_raw, str):
+        from_node_obj.macaddr = mac_addr_raw
+
+    hw_model_val = user_data.get('hwModel')
+    if isinstance(hw_model_val, str) and hw_model_val != "UNSET":
+        from_node_obj.hw_model = hw_model_val
+    elif hasattr(hw_model_val, 'name') and hw_model_val.name != "UNSET":
+        from_node_obj.hw_model = hw_model_val.name
+
+    role_val = user_data.get('role')
+    from_node_obj.role = getattr(role_val, 'name', str(role_val)) if role_val is not None else None
+    from_node_obj.user_info = user_data
+    if names_before != [getattr(from_node_obj, field) for field in node_names.NAME_FIELDS]:
+        return USER_INFO_NODE_FIELDS
+    return [field for field in USER_INFO_NODE_FIELDS if field not in node_names.NAME_FIELDS]
+
+
+def _build_traceroute(record: dict, packet_obj: Packet, from_node_obj: Node, to_node_obj: Node) -> Optional[Traceroute]:
+    payload_specific_data = record['payload']
+    from_id_str = record['from_id_str']
+    to_id_str = record['to_id_str']
+
+    if not isinstance(payload_specific_data, dict):
+        logger.debug(
+            f"Routing packet payload_specific_data is not a dictionary. From: {from_id_str}, To: {to_id_str}. Data: {payload_specific_data}")
+        return None
+
+    error_source_dict = payload_specific_data
+    route_list_source_dict = payload_specific_data
+
+    if 'routeDiscovery' in payload_specific_data and isinstance(payload_specific_data['routeDiscovery'],
+                                                                dict):
+        error_source_dict = payload_specific_data['routeDiscovery']
+        route_list_source_dict = payload_specific_data['routeDiscovery']
+    elif 'raw' in payload_specific_data and isinstance(payload_specific_data['raw'], dict):
+        raw_data = payload_specific_data['raw']
+        if 'route_reply' in raw_data and isinstance(raw_data['route_reply'], dict):
+            route_list_source_dict = raw_data['route_reply']
+        elif 'route_request' in raw_data and isinstance(raw_data['route_request'], dict):
+            route_list_source_dict = raw_data['route_request']
+
+    route_path = None
+    if 'route' in route_list_source_dict:
+        route_path_value = route_list_source_dict['route']
+        if isinstance(route_path_value, str):
+            try:
+                parsed_route = json.loads(route_path_value)
+                if isinstance(parsed_route, list):
+                    route_path = parsed_route
+                else:
+                    logger.warning(
+                        f"Parsed route from string is not a list: '{parsed_route}' for packet {packet_obj.event_id}")
+            except json.JSONDecodeError:
+                logger.warning(
+                    f"Could not parse route string as JSON: '{route_path_value}' for packet {packet_obj.event_id}")
+        elif isinstance(route_path_value, list):
+            route_path = route_path_value
+        else:
+            logger.warning(
+                f"Unexpected type for 'route' value: {type(route_path_value)} for packet {packet_obj.event_id}")
+
+    actual_error_reason_str = None
+    if 'errorReason' in error_source_dict:
+        error_val = error_source_dict['errorReason']
+        actual_error_reason_str = getattr(error_val, 'name', str(error_val)).upper()
+    elif 'error_reason' in error_source_dict:
+        error_val = error_source_dict['error_reason']
+        if isinstance(error_val, int) and error_val == 0:
+            actual_error_reason_str = "NONE"
+        else:
+            actual_error_reason_str = getattr(error_val, 'name', str(error_val)).upper()
+
+    is_significant_error = actual_error_reason_str is not None and \
+                           actual_error_reason_str not in ["NONE", "NO_ERROR"]
+
+    if route_path is not None and isinstance(route_path, list) and not is_significant_error:
+        logger.info(
+            f"Traceroute processed. Requester: {to_id_str}, Responder: {from_id_str}. Path: {route_path}. Reported error status: {actual_error_reason_str or 'Not present'}")
+        return Traceroute(
+            packet=packet_obj,
+            packet_event_id=packet_obj.event_id,
+            requester_node=to_node_obj,
+            requester_node_id_str=to_id_str,
+            responder_node=from_node_obj,
+            responder_node_id_str=from_id_str,
+            route_json=route_path,
+            timestamp=packet_obj.timestamp
+        )
+    elif is_significant_error:
+        logger.info(
+            f"Significant routing error reported. Requester: {to_id_str}, Responder: {from_id_str}. Error: {actual_error_reason_str}. Full routing data: {payload_specific_data}")
+    else:
+        logger.debug(
+            f"Routing packet from {from_id_str} to {to_id_str} did not yield a usable route list and no significant error. payload_specific_data: {payload_specific_data}")
+    return None
 
-        from_node_obj = None
-        to_node_obj = None
 
-        with transaction.atomic():
+def _packet_identity_of(db_packet_data: dict) -> Optional[tuple]:
+    if db_packet_data.get('mesh_id') is None:
+        return None
+    return (db_packet_data['gateway_key'], db_packet_data['mesh_from'], db_packet_data['mesh_id'],
+            db_packet_data['rx_time'])
+
+
+def _stored_packet_identities(records: list) -> set:
+    """Identities of the batch's packets that are already stored (replays, re-deliveries, imports)."""
+    mesh_ids = {record['packet']['mesh_id'] for record in records
+                if record['kind'] == 'packet' and record['packet'].get('mesh_id') is not None}
+    if not mesh_ids:
+        return set()
+    return set(Packet.objects.filter(mesh_id__in=mesh_ids).values_list('gateway_key', 'mesh_from', 'mesh_id',
+                                                                        'rx_time'))
+
+
+def _ensure_packet_pks(packet_objs: list):
+    """Conflict-ignoring bulk inserts do not return primary keys; look them up by event_id."""
+    missing = [p for p in packet_objs if p.pk is None]
+    if not missing:
+        return
+    pk_by_event_id = dict(
+        Packet.objects.filter(event_id__in=[p.event_id for p in missing]).values_list('event_id', 'pk'))
+    for packet_obj in missing:
+        packet_obj.pk = pk_by_event_id.get(packet_obj.event_id)
+
+
+def persist_packet_batch(records: list) -> None:
+    """
+    Writes a batch of packet and node records in a single transaction. Node changes go through
+    the node cache and are written back by its next flush; if the transaction rolls back, so do
+    they. Received messages are handed to the commander once the transaction has committed.
+    """
+    if not records:
+        return
+
+    node_cache = get_node_cache()
+    with DB_TRANSACTION_SECONDS.time(), node_cache.savepoint(), transaction.atomic():
+        packet_records = []
+        packet_objs = []
+        node_pairs = []
+        duplicate_updates = {}
+        counter_deltas = Counter()
+        stored_identities = _stored_packet_identities(records)
+        for record in records:
+            if record['kind'] == 'duplicate':
+                # Later copies carry the higher counter and, if present, the best signal so far.
+                duplicate_updates.setdefault(record['event_id'], {}).update(record['values'])
+                continue
+            if record['kind'] == 'node':
+                node_obj, created = node_cache.update(record['node_id'], record['values'])
+                counter_deltas[counters.NODES] += created
+                logger.info(f"Node {node_obj.node_id} ({node_obj.long_name or node_obj.short_name or 'N/A'}) "
+                            f"{'created' if created else 'updated'}.")
+                continue
+
+            db_packet_data = record['packet']
+            identity = _packet_identity_of(db_packet_data)
+            if identity is not None:
+                if identity in stored_identities:
+                    # Already ingested: no second row, no payload rows, no commander reply, no node changes.
+                    _PACKETS_ALREADY_STORED.inc()
+                    logger.debug(f"Packet {db_packet_data['event_id']} is already stored, skipping it.")
+                    continue
+                stored_identities.add(identity)
+
+            from_id_str = record['from_id_str']
+            to_id_str = record['to_id_str']
+            from_node_obj = None
+            to_node_obj = None
+
             if from_id_str:
-                from_node_obj, _ = Node.objects.update_or_create(
-                    node_id=from_id_str,
-                    defaults={
-                        'node_num': from_num,
-                        'last_heard': db_packet_data['timestamp'],
-                        'snr': db_packet_data.get('rx_snr'),
-                        'rssi': db_packet_data.get('rx_rssi'),
-                    }
-                )
-                db_packet_data['from_node'] = from_node_obj
+                from_node_obj, created = node_cache.update(from_id_str, {
+                    'node_num': record['from_num'],
+                    'last_heard': db_packet_data['timestamp'],
+                    'snr': db_packet_data.get('rx_snr'),
+                    'rssi': db_packet_data.get('rx_rssi'),
+                })
+                counter_deltas[counters.NODES] += created
 
             if to_id_str and to_id_str != "^all":
-                to_node_obj, _ = Node.objects.get_or_create(
-                    node_id=to_id_str,
+                to_node_obj, created = node_cache.get_or_create(
+                    to_id_str,
                     defaults={'node_num': get_node_num_from_id_str(to_id_str)}
                 )
-                db_packet_data['to_node'] = to_node_obj
-
-            packet_obj = Packet.objects.create(**db_packet_data)
+                counter_deltas[counters.NODES] += created
+
+            packet_records.append(record)
+            packet_objs.append(Packet(from_node=from_node_obj, to_node=to_node_obj, **db_packet_data))
+            node_pairs.append((from_node_obj, to_node_obj))
+
+        if packet_objs:
+            # The unique identity constraint makes concurrent importers and writers safe as well.
+            Packet.objects.bulk_create(packet_objs, ignore_conflicts=True)
+            _ensure_packet_pks(packet_objs)
+            counters.count_packets(counter_deltas, ((p.packet_type, p.portnum, p.channel) for p in packet_objs))
+        # Built now, before the payloads below change the nodes, and published once the batch committed.
+        packet_events = [events.packet_event(packet_obj, from_node_obj, to_node_obj)
+                         for packet_obj, (from_node_obj, to_node_obj) in zip(packet_objs, node_pairs)]
+
+        messages, positions, telemetry, traceroutes = [], [], [], []
+        for record, packet_obj, (from_node_obj, to_node_obj) in zip(packet_records, packet_objs, node_pairs):
+            app_packet_type = record['packet_type']
+            payload_specific_data = record['payload']
             logger.info(
-                f"Packet {packet_obj.event_id} ({app_packet_type}) from {from_id_str or 'N/A'} to {to_id_str or 'N/A'} saved.")
-
-            message_obj_for_commander = None
-
-            if app_packet_type == "Message" and payload_specific_data and from_node_obj:
-                message_obj_for_commander = Message.objects.create(
-                    packet=packet_obj,
-                    from_node=from_node_obj,
-                    from_node_id_str=from_id_str,
-                    to_node=to_node_obj,
-                    to_node_id_str=to_id_str,
-                    channel=original_internal_channel_id, # Store the raw internal channel ID hex string
-                    text=str(payload_specific_data),
-                    timestamp=packet_obj.timestamp,
-                    rx_snr=packet_obj.rx_snr,
-                    rx_rssi=packet_obj.rx_rssi
-                )
-                if message_obj_for_commander:
-                    process_commander_rules(message_obj_for_commander, from_node_obj, flask_send_url,
-                                            mapped_channel_index) # Pass the mapped user-facing channel index
-
-
-            elif app_packet_type == "Position" and payload_specific_data and from_node_obj:
-                pos_data = payload_specific_data
-                lat = pos_data.get('latitudeI', 0) / 1e7 if pos_data.get('latitudeI') is not None else pos_data.get(
-                    'latitude')
-                lon = pos_data.get('longitudeI', 0) / 1e7 if pos_data.get('longitudeI') is not None else pos_data.get(
-                    'longitude')
-                altitude = pos_data.get('altitude')
-                precision_bits = pos_data.get('precisionBits', pos_data.get('gpsPrecision'))
-                ground_speed = pos_data.get('groundSpeed')
-                ground_track = pos_data.get('groundTrack')
-                sats_in_view = pos_data.get('satsInView')
-                position_packet_time = pos_data.get('time', packet_obj.timestamp)
-
-                if lat is not None and lon is not None:
-                    Position.objects.create(
-                        node=from_node_obj,
-                        timestamp=position_packet_time,
-                        latitude=lat,
-                        longitude=lon,
-                        altitude=altitude,
-                        precision_bits=precision_bits,
-                        ground_speed=ground_speed,
-                        ground_track=ground_track,
-                        sats_in_view=sats_in_view,
-                        pdop=pos_data.get('pdop'),
-                        hdop=pos_data.get('hdop'),
-                        vdop=pos_data.get('vdop'),
-                    )
-                    from_node_obj.latitude = lat
-                    from_node_obj.longitude = lon
-                    from_node_obj.altitude = altitude
-                    from_node_obj.position_time = position_packet_time
-                    from_node_obj.position_info = pos_data
-                    from_node_obj.save(
-                        update_fields=['latitude', 'longitude', 'altitude', 'position_time', 'position_info',
-                                       'updated_at'])
-
-            elif app_packet_type == "Telemetry" and payload_specific_data and from_node_obj:
-                metrics_data = payload_specific_data
-                dev_metrics = metrics_data.get('deviceMetrics', {})
-                env_metrics = metrics_data.get('environmentMetrics', {})
-                power_metrics = metrics_data.get('powerMetrics', {})
-
-                telemetry_packet_time = dev_metrics.get('time', power_metrics.get('time', packet_obj.timestamp))
-
-                Telemetry.objects.create(
-                    node=from_node_obj,
-                    timestamp=telemetry_packet_time,
-                    battery_level=dev_metrics.get('batteryLevel', power_metrics.get('batteryLevel')),
-                    voltage=dev_metrics.get('voltage', power_metrics.get('voltage')),
-                    channel_utilization=dev_metrics.get('channelUtilization'),
-                    air_util_tx=dev_metrics.get('airUtilTx'),
-                    uptime_seconds=dev_metrics.get('uptimeSeconds'),
-                    temperature=env_metrics.get('temperature'),
-                    relative_humidity=env_metrics.get('relativeHumidity'),
-                    barometric_pressure=env_metrics.get('barometricPressure'),
-                    gas_resistance=env_metrics.get('gasResistance'),
-                    iaq=env_metrics.get('iaq')
-                )
+                f"Packet {packet_obj.event_id} ({app_packet_type}) from {record['from_id_str'] or 'N/A'} to {record['to_id_str'] or 'N/A'} saved.")
 
-                current_battery = dev_metrics.get('batteryLevel', power_metrics.get('batteryLevel'))
-                current_voltage = dev_metrics.get('voltage', power_metrics.get('voltage'))
-                current_uptime = dev_metrics.get('uptimeSeconds')
-
-                if current_battery is not None: from_node_obj.battery_level = current_battery
-                if current_voltage is not None: from_node_obj.voltage = current_voltage
-                if current_uptime is not None: from_node_obj.uptime_seconds = current_uptime
-                if dev_metrics.get('channelUtilization') is not None:
-                    from_node_obj.channel_utilization = dev_metrics.get('channelUtilization')
-                if dev_metrics.get('airUtilTx') is not None:
-                    from_node_obj.air_util_tx = dev_metrics.get('airUtilTx')
-
-                from_node_obj.telemetry_time = telemetry_packet_time
-                from_node_obj.device_metrics_info = dev_metrics
-                from_node_obj.environment_metrics_info = env_metrics
-                if power_metrics:
-                    if not from_node_obj.device_metrics_info: from_node_obj.device_metrics_info = {}
-                    from_node_obj.device_metrics_info['powerMetrics'] = power_metrics
-
-                from_node_obj.save(update_fields=['battery_level', 'voltage', 'uptime_seconds', 'telemetry_time',
-                                                  'channel_utilization', 'air_util_tx',
-                                                  'device_metrics_info', 'environment_metrics_info', 'updated_at'])
-
-
-            elif app_packet_type == "User Info" and payload_specific_data and from_node_obj:
-                user_data = payload_specific_data
-                from_node_obj.long_name = user_data.get('longName')
-                from_node_obj.short_name = user_data.get('shortName')
-                mac_addr_raw = user_data.get('macaddr')
-                if isinstance(mac_addr_raw, bytes):
-                    from_node_obj.macaddr = mac_addr_raw.hex(':')
-                elif isinstance(mac_addr_raw, str):
-                    from_node_obj.macaddr = mac_addr_raw
-
-                hw_model_val = user_data.get('hwModel')
-                if isinstance(hw_model_val, str) and hw_model_val != "UNSET":
-                    from_node_obj.hw_model = hw_model_val
-                elif hasattr(hw_model_val, 'name') and hw_model_val.name != "UNSET":
-                    from_node_obj.hw_model = hw_model_val.name
-
-                role_val = user_data.get('role')
-                from_node_obj.role = getattr(role_val, 'name', str(role_val)) if role_val is not None else None
-                from_node_obj.user_info = user_data
-                from_node_obj.save(
-                    update_fields=['long_name', 'short_name', 'macaddr', 'hw_model', 'role', 'user_info', 'updated_at'])
-
-            elif app_packet_type == "Routing" and payload_specific_data and to_node_obj and from_node_obj:
-                if not isinstance(payload_specific_data, dict):
-                    logger.debug(
-                        f"Routing packet payload_specific_data is not a dictionary. From: {from_id_str}, To: {to_id_str}. Data: {payload_specific_data}")
-                else:
-                    error_source_dict = payload_specific_data
-                    route_list_source_dict = payload_specific_data
-
-                    if 'routeDiscovery' in payload_specific_data and isinstance(payload_specific_data['routeDiscovery'],
-                                                                                dict):
-                        error_source_dict = payload_specific_data['routeDiscovery']
-                        route_list_source_dict = payload_specific_data['routeDiscovery']
-                    elif 'raw' in payload_specific_data and isinstance(payload_specific_data['raw'], dict):
-                        raw_data = payload_specific_data['raw']
-                        if 'route_reply' in raw_data and isinstance(raw_data['route_reply'], dict):
-                            route_list_source_dict = raw_data['route_reply']
-                        elif 'route_request' in raw_data and isinstance(raw_data['route_request'], dict):
-                            route_list_source_dict = raw_data['route_request']
-
-                    route_path = None
-                    if 'route' in route_list_source_dict:
-                        route_path_value = route_list_source_dict['route']
-                        if isinstance(route_path_value, str):
-                            try:
-                                parsed_route = json.loads(route_path_value)
-                                if isinstance(parsed_route, list):
-                                    route_path = parsed_route
-                                else:
-                                    logger.warning(
-                                        f"Parsed route from string is not a list: '{parsed_route}' for packet {packet_obj.event_id}")
-                            except json.JSONDecodeError:
-                                logger.warning(
-                                    f"Could not parse route string as JSON: '{route_path_value}' for packet {packet_obj.event_id}")
-                        elif isinstance(route_path_value, list):
-                            route_path = route_path_value
-                        else:
-                            logger.warning(
-                                f"Unexpected type for 'route' value: {type(route_path_value)} for packet {packet_obj.event_id}")
-
-                    actual_error_reason_str = None
-                    if 'errorReason' in error_source_dict:
-                        error_val = error_source_dict['errorReason']
-                        actual_error_reason_str = getattr(error_val, 'name', str(error_val)).upper()
-                    elif 'error_reason' in error_source_dict:
-                        error_val = error_source_dict['error_reason']
-                        if isinstance(error_val, int) and error_val == 0:
-                            actual_error_reason_str = "NONE"
-                        else:
-                            actual_error_reason_str = getattr(error_val, 'name', str(error_val)).upper()
-
-                    is_significant_error = actual_error_reason_str is not None and \
-                                           actual_error_reason_str not in ["NONE", "NO_ERROR"]
-
-                    if route_path is not None and isinstance(route_path, list) and not is_significant_error:
-                        logger.info(
-                            f"Traceroute processed. Requester: {to_id_str}, Responder: {from_id_str}. Path: {route_path}. Reported error status: {actual_error_reason_str or 'Not present'}")
-                        Traceroute.objects.create(
-                            packet=packet_obj,
-                            packet_event_id=packet_obj.event_id,
-                            requester_node=to_node_obj,
-                            requester_node_id_str=to_id_str,
-                            responder_node=from_node_obj,
-                            responder_node_id_str=from_id_str,
-                            route_json=route_path,
-                            timestamp=packet_obj.timestamp
-                        )
-                    elif is_significant_error:
-                        logger.info(
-                            f"Significant routing error reported. Requester: {to_id_str}, Responder: {from_id_str}. Error: {actual_error_reason_str}. Full routing data: {payload_specific_data}")
-                    else:
-                        logger.debug(
-                            f"Routing packet from {from_id_str} to {to_id_str} did not yield a usable route list and no significant error. payload_specific_data: {payload_specific_data}")
+            if not payload_specific_data or not from_node_obj:
+                continue
+
+            if app_packet_type == "Message":
+                message_obj = _build_message(record, packet_obj, from_node_obj, to_node_obj)
+                messages.append(message_obj)
+                # Dropped together with the batch if the transaction rolls back.
+                transaction.on_commit(
+                    partial(dispatch_commander_job, message_obj, from_node_obj, record['channel_index'],
+                            record.get('gateway')))
+            elif app_packet_type == "Position":
+                position_obj = _apply_position(payload_specific_data, packet_obj, from_node_obj)
+                if position_obj:
+                    positions.append(position_obj)
+                    node_cache.mark_dirty(from_node_obj, POSITION_NODE_FIELDS)
+            elif app_packet_type == "Telemetry":
+                telemetry.append(_apply_telemetry(payload_specific_data, packet_obj, from_node_obj))
+                node_cache.mark_dirty(from_node_obj, TELEMETRY_NODE_FIELDS)
+            elif app_packet_type == "User Info":
+                node_cache.mark_dirty(from_node_obj, _apply_user_info(payload_specific_data, from_node_obj))
+            elif app_packet_type == "Routing" and to_node_obj:
+                traceroute_obj = _build_traceroute(record, packet_obj, from_node_obj, to_node_obj)
+                if traceroute_obj:
+                    traceroutes.append(traceroute_obj)
+
+        if messages:
+            Message.objects.bulk_create(messages)
+            message_search.index_messages(message_obj.pk for message_obj in messages)
+        if positions:
+            Position.objects.bulk_create(positions)
+        if telemetry:
+            Telemetry.objects.bulk_create(telemetry)
+        if traceroutes:
+            Traceroute.objects.bulk_create(traceroutes)
+            counter_deltas[counters.TRACEROUTES] += len(traceroutes)
+        for changed, sequence in ((packet_objs or duplicate_updates, counters.PACKETS_CHANGED),
+                                  (messages, counters.MESSAGES_CHANGED),
+                                  (traceroutes, counters.TRACEROUTES_CHANGED),
+                                  (counter_deltas[counters.NODES], counters.NODES_CHANGED)):
+            if changed:
+                counter_deltas[sequence] += 1
+        counters.apply_counter_deltas(counter_deltas)
+        transaction.on_commit(partial(events.publish_batch, packet_events,
+                                      {key: delta for key, delta in counter_deltas.items() if counters.is_recounted(key)}))
+
+        # Applied last, so copies that arrive in the same batch as the original still find its row.
+        for event_id, values in duplicate_updates.items():
+            Packet.objects.filter(event_id=event_id).update(**values)
+            logger.debug(f"Packet {event_id} heard {values['copies_heard']} times.")
+
+
+def _describe_record(record: dict) -> str:
+    if record['kind'] == 'node':
+        return f"node {record['node_id']}"
+    if record['kind'] == 'duplicate':
+        return f"duplicate of packet {record['event_id']}"
+    return f"packet {record['packet'].get('event_id')}"
+
+
+def flush_ingest_batch(records: list):
+    """
+    Flush callback of the ingest pipeline. Falls back to writing records one by one if the
+    batch transaction fails, so a single bad packet does not take the whole batch with it.
+    """
+    started_at = time.perf_counter()
+    try:
+        retry_on_lock(persist_packet_batch, records)
+    except Exception as e:
+        if len(records) == 1:
+            logger.exception(f"Error persisting {_describe_record(records[0])}: {e}")
+            return
+        logger.exception(f"Error persisting batch of {len(records)} packets, retrying one by one: {e}")
+        for record in records:
+            try:
+                retry_on_lock(persist_packet_batch, [record])
+            except Exception as record_e:
+                logger.exception(f"Error persisting {_describe_record(record)}: {record_e}")
+
+    flush_node_cache_if_due()
+    _DB_WRITE_SECONDS.observe(time.perf_counter() - started_at)
+
+
+def dispatch_commander_job(message_obj: Message, from_node_obj: Node, channel_index: Optional[int],
+                           gateway_name: Optional[str] = None):
+    """
+    Hands a committed message to the commander workers. The sender node is passed as a snapshot,
+    as the cached instance keeps being updated by the ingest writer.
+    """
+    from_node_snapshot = copy.copy(from_node_obj)
+    if _commander_dispatcher is not None and _commander_dispatcher.is_running:
+        _commander_dispatcher.submit(from_node_snapshot.node_id, message_obj, from_node_snapshot, channel_index,
+                                     gateway_name)
+    else:
+        run_commander_job(message_obj, from_node_snapshot, channel_index, gateway_name) # Pass the mapped user-facing channel index
+
+
+def run_commander_job(message_obj: Message, from_node_obj: Node, channel_index: Optional[int],
+                      gateway_name: Optional[str] = None):
+    with _COMMANDER_SECONDS.time():
+        process_commander_rules(message_obj, from_node_obj, channel_index, gateway_name)
+
+
+_ingest_pipeline: Optional[IngestPipeline] = None
+_ingest_queue: Optional[SheddingQueue] = None
+_node_cache: Optional[NodeStateCache] = None
+_deduplicator: Optional[PacketDeduplicator] = None
+_commander_dispatcher: Optional[CommanderDispatcher] = None
+_capture_writer: Optional[CaptureWriter] = None
+_supervisor: Optional[ListenerSupervisor] = None
+
+QUEUE_DEPTH.labels(queue='ingest').set_function(
+    lambda: _ingest_pipeline.stats()['queue_depth'] if _ingest_pipeline is not None else 0)
+QUEUE_DEPTH.labels(queue='commander').set_function(
+    lambda: _commander_dispatcher.queue_depth() if _commander_dispatcher is not None else 0)
+QUEUE_DEPTH.labels(queue='outbound').set_function(
+    lambda: sum(gateway.outbound.queue_depth() for gateway in get_gateways() if gateway.outbound is not None))
+
+
+def get_node_cache() -> NodeStateCache:
+    global _node_cache
+    if _node_cache is None:
+        _node_cache = NodeStateCache(
+            max_size=getattr(settings, 'LISTENER_NODE_CACHE_SIZE', 10000),
+            flush_interval=getattr(settings, 'LISTENER_NODE_FLUSH_INTERVAL', 5.0),
+        )
+    return _node_cache
 
 
+def get_deduplicator() -> PacketDeduplicator:
+    global _deduplicator
+    if _deduplicator is None:
+        _deduplicator = PacketDeduplicator(
+            window_seconds=getattr(settings, 'LISTENER_DEDUPE_WINDOW_SECONDS', 600),
+            max_entries=getattr(settings, 'LISTENER_DEDUPE_MAX_ENTRIES', 50000),
+        )
+    return _deduplicator
+
+
+def flush_node_cache_if_due():
+    node_cache = get_node_cache()
+    if node_cache.flush_is_due():
+        # A failed flush keeps the changes dirty, so it can be retried as a whole.
+        retry_on_lock(node_cache.flush, operation='node_cache_flush')
+
+
+def dedupe_packet_record(record: dict) -> dict:
+    """
+    Turns a rebroadcast copy of an already received packet into a 'duplicate' record, which only
+    updates copies_heard (and the signal values, if the copy was received better) of the stored packet.
+    """
+    db_packet_data = record['packet']
+    update = get_deduplicator().observe(
+        record['from_num'], record['mesh_packet_id'], db_packet_data['event_id'],
+        rx_snr=db_packet_data.get('rx_snr'), rx_rssi=db_packet_data.get('rx_rssi'),
+        hop_limit=db_packet_data.get('hop_limit'))
+    if update is None:
+        return record
+    event_id = update.pop('event_id')
+    _PACKET_COPIES.inc()
+    logger.debug(f"Packet {record['mesh_packet_id']} from {record['from_id_str']} is copy #{update['copies_heard']} of {event_id}.")
+    return {'kind': 'duplicate', 'event_id': event_id, 'values': update}
+
+
+def record_ingest_shedding():
+    """Adds the records shed and coalesced since the last call to the counters in ListenerState."""
+    if _ingest_queue is None:
+        return
+    shed, coalesced = _ingest_queue.take_counts()
+    if not shed and not coalesced:
+        return
+    updates = {'ingest_shed_count': F('ingest_shed_count') + shed,
+               'ingest_coalesced_count': F('ingest_coalesced_count') + coalesced}
+    if shed:
+        updates['ingest_last_shed_at'] = django_timezone.now()
+        logger.warning(f"Ingest overloaded: {shed} records shed, {coalesced} coalesced since the last report.")
+    with transaction.atomic():
+        ListenerState.objects.filter(singleton_id=1).update(**updates)
+        counters.bump_sequences(counters.LISTENER_STATE_CHANGED)
+
+
+def _ingest_writer_tick():
+    flush_node_cache_if_due()
+    record_ingest_shedding()
+
+
+def start_ingest_pipeline() -> IngestPipeline:
+    global _ingest_pipeline, _ingest_queue
+    if _ingest_pipeline is None or not _ingest_pipeline.is_running:
+        get_node_cache().load()
+        _ingest_queue = SheddingQueue(
+            maxsize=getattr(settings, 'LISTENER_INGEST_QUEUE_SIZE', 5000),
+            high_water=getattr(settings, 'LISTENER_INGEST_HIGH_WATER', 0.5),
+            sample_rate=getattr(settings, 'LISTENER_INGEST_SAMPLE_RATE', 10),
+        )
+        _ingest_pipeline = IngestPipeline(
+            flush_callback=flush_ingest_batch,
+            tick_callback=_ingest_writer_tick,
+            batch_size=getattr(settings, 'LISTENER_INGEST_BATCH_SIZE', 100),
+            flush_interval=getattr(settings, 'LISTENER_INGEST_FLUSH_INTERVAL', 1.0),
+            record_queue=_ingest_queue,
+        )
+        _ingest_pipeline.start()
+    return _ingest_pipeline
+
+
+def stop_ingest_pipeline():
+    global _ingest_pipeline
+    if _ingest_pipeline is not None:
+        _ingest_pipeline.stop()
+        _ingest_pipeline = None
+        try:
+            close_old_connections()
+            get_node_cache().flush()
+            record_ingest_shedding()
+        except Exception as e:
+            logger.exception(f"Error flushing node cache on shutdown: {e}")
+
+
+def start_outbound_scheduler():
+    """Starts one outbound scheduler per gateway, as every radio has its own airtime budget."""
+    for gateway in get_gateways():
+        if gateway.outbound is not None and gateway.outbound.is_running:
+            continue
+        gateway.outbound = OutboundScheduler(
+            send_callback=gateway.send_text,
+            duty_cycle_percent=getattr(settings, 'OUTBOUND_DUTY_CYCLE_PERCENT', 10.0),
+            duty_cycle_window=getattr(settings, 'OUTBOUND_DUTY_CYCLE_WINDOW', 600.0),
+            bitrate_bps=getattr(settings, 'OUTBOUND_BITRATE_BPS', 1070.0),
+            min_interval=getattr(settings, 'OUTBOUND_MIN_INTERVAL', 1.0),
+            max_part_bytes=getattr(settings, 'OUTBOUND_MAX_PART_BYTES', 200),
+            max_parts=getattr(settings, 'OUTBOUND_MAX_PARTS', 5),
+            max_retries=getattr(settings, 'OUTBOUND_MAX_RETRIES', 3),
+            retry_backoff=getattr(settings, 'OUTBOUND_RETRY_BACKOFF', 2.0),
+            max_queue_size=getattr(settings, 'OUTBOUND_QUEUE_SIZE', 200),
+            name=f'outbound-{gateway.name}',
+        )
+        gateway.outbound.start()
+
+
+def stop_outbound_scheduler():
+    for gateway in get_gateways():
+        if gateway.outbound is not None:
+            gateway.outbound.stop()
+            logger.info(f"Outbound stats of gateway {gateway.name} on shutdown: {gateway.outbound.stats()}")
+            gateway.outbound = None
+
+
+def start_commander_dispatcher() -> CommanderDispatcher:
+    global _commander_dispatcher
+    if _commander_dispatcher is None or not _commander_dispatcher.is_running:
+        cooldown_store = get_cooldown_store()
+        cooldown_store.load()
+        cooldown_store.start_writer()
+        _commander_dispatcher = CommanderDispatcher(
+            handler=run_commander_job,
+            workers=getattr(settings, 'COMMANDER_WORKERS', 2),
+            max_queue_size=getattr(settings, 'COMMANDER_QUEUE_SIZE', 200),
+        )
+        _commander_dispatcher.start()
+    return _commander_dispatcher
+
+
+def stop_commander_dispatcher():
+    global _commander_dispatcher
+    if _commander_dispatcher is not None:
+        _commander_dispatcher.stop()
+        logger.info(f"Commander stats on shutdown: {_commander_dispatcher.stats()}")
+        _commander_dispatcher = None
+        get_cooldown_store().stop_writer()
+        close_llm_client()
+
+
+def start_capture(path: str) -> CaptureWriter:
+    global _capture_writer
+    stop_capture()
+    _capture_writer = CaptureWriter(path)
+    _capture_writer.open()
+    return _capture_writer
+
+
+def stop_capture():
+    global _capture_writer
+    if _capture_writer is not None:
+        _capture_writer.close()
+        _capture_writer = None
+
+
+def submit_ingest_record(record: dict):
+    if _ingest_pipeline is not None and _ingest_pipeline.is_running:
+        _ingest_pipeline.submit(record)
+    else:
+        # No writer thread running (e.g. called directly), write synchronously.
+        flush_ingest_batch([record])
+        get_node_cache().flush()
+
+
+def on_receive_django(packet, interface):
+    logger.debug(f"on_receive_django: Packet received: {packet}")
+    try:
+        if _capture_writer is not None:
+            _capture_writer.write_packet(packet)
+        submit_ingest_record(dedupe_packet_record(build_packet_record(packet, resolve_gateway(interface))))
     except Exception as e:
         logger.exception(f"Error in on_receive_django: {e}")
 
@@ -751,7 +1191,8 @@ def on_node_updated_django(node, interface):
         return
 
     try:
-        close_old_connections()
+        if _capture_writer is not None:
+            _capture_writer.write_node_update(node)
         node_data_dict = ensure_serializable(node)
 
         if not isinstance(node_data_dict, dict):
@@ -826,13 +1267,7 @@ def on_node_updated_django(node, interface):
 
         update_values = {k: v for k, v in defaults_to_update.items() if v is not None}
 
-        with transaction.atomic():
-            node_obj, created = Node.objects.update_or_create(
-                node_id=node_id_str,
-                defaults=update_values
-            )
-        log_action = "created" if created else "updated"
-        logger.info(f"Node {node_obj.node_id} ({node_obj.long_name or node_obj.short_name or 'N/A'}) {log_action}.")
+        submit_ingest_record({'kind': 'node', 'node_id': node_id_str, 'values': update_values})
 
     except Exception as e:
         node_identifier = node_data_dict.get('num', 'UNKNOWN') if isinstance(node_data_dict, dict) else (
@@ -841,12 +1276,28 @@ def on_node_updated_django(node, interface):
 
 
 def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
-    global _local_node_channel_map_cache, _local_node_info_cache
     topic_str = getattr(topic, 'getNamePath', lambda: str(topic))()
-    logger.info(f"on_connection_django: Connection event: {topic_str}" + (f" Reason: {reason}" if reason else ""))
+    handle_connection_event(resolve_gateway(interface), interface, topic_str, reason)
+
+
+def update_gateway_state(gateway: Gateway, **values):
+    """Writes the status row of a gateway."""
+    values.update({'gateway_name': gateway.name, 'gateway_address': gateway.address,
+                   'updated_at': django_timezone.now()})
+    with transaction.atomic():
+        ListenerState.objects.update_or_create(singleton_id=gateway.state_id, defaults=values)
+        counters.bump_sequences(counters.LISTENER_STATE_CHANGED)
+        status_event = {'gateway': gateway.name, 'state_id': gateway.state_id}
+        status_event.update({field: values[field] for field in events.STATUS_EVENT_FIELDS if field in values})
+        transaction.on_commit(partial(events.publish, events.EVENT_STATUS, status_event))
+
+
+def handle_connection_event(gateway: Gateway, interface, topic_str: str, reason=None):
+    logger.info(f"Gateway {gateway.name}: Connection event: {topic_str}" + (f" Reason: {reason}" if reason else ""))
+    CONNECTION_EVENTS.labels(gateway.name, topic_str.rsplit('.', 1)[-1]).inc()
     close_old_connections()
 
-    status_update = {'updated_at': django_timezone.now()}
+    status_update = {}
     new_status = ListenerState.STATUS_CHOICES[5][0]
     current_error_msg_for_state = reason
 
@@ -854,7 +1305,7 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
         new_status = ListenerState.STATUS_CHOICES[2][0]
         status_update['last_error_message'] = None
         current_error_msg_for_state = None
-        logger.info("Meshtastic connection established.")
+        logger.info(f"Meshtastic connection of gateway {gateway.name} established.")
         try:
             if interface and hasattr(interface, 'myInfo') and interface.myInfo:
                 my_info_raw_obj = interface.myInfo
@@ -865,7 +1316,7 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
                     logger.error(error_detail)
                     status_update['last_error_message'] = error_detail
                     current_error_msg_for_state = error_detail
-                    _local_node_info_cache.clear()
+                    gateway.local_node_info = {}
                 else:
                     local_node_num_int = my_info_dict.get('myNodeNum')
                     local_node_id_str = get_node_id_str(local_node_num_int) if local_node_num_int is not None else None
@@ -887,9 +1338,9 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
                         'local_node_num': local_node_num_int,
                         'local_node_name': local_node_name_str,
                     })
-                    _local_node_info_cache = {'id': local_node_id_str, 'num': local_node_num_int,
-                                              'name': local_node_name_str}
-                    commander_logger.info(f"Local node cache updated: {_local_node_info_cache}")
+                    gateway.local_node_info = {'id': local_node_id_str, 'num': local_node_num_int,
+                                               'name': local_node_name_str}
+                    commander_logger.info(f"Local node of gateway {gateway.name} updated: {gateway.local_node_info}")
 
                     current_channel_map = {}
                     if hasattr(interface, 'localNode') and interface.localNode and hasattr(interface.localNode,
@@ -916,15 +1367,15 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
                         logger.warning(
                             "Could not get channel map: interface.localNode or interface.localNode.channels is missing or not as expected.")
 
-                    _local_node_channel_map_cache = current_channel_map
+                    gateway.channel_map = current_channel_map
                     status_update['local_node_channel_map_json'] = current_channel_map
                     logger.info(
-                        f"Local node info: ID {local_node_id_str}, Name: {local_node_name_str}. Channel Map: {current_channel_map}")
+                        f"Gateway {gateway.name} local node info: ID {local_node_id_str}, Name: {local_node_name_str}. Channel Map: {current_channel_map}")
 
                     on_node_updated_django(my_info_raw_obj, interface)
             else:
                 logger.warning("myInfo not available from interface on connection established.")
-                _local_node_info_cache.clear()
+                gateway.local_node_info = {}
                 status_update['last_error_message'] = "myInfo not available from interface."
                 current_error_msg_for_state = status_update['last_error_message']
 
@@ -933,19 +1384,21 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
             logger.exception(f"AttributeError while processing myInfo: {ae}")
             current_error_msg_for_state = status_update[
                 'last_error_message'] = f"Error processing local node info (AttributeError): {str(ae)}"
-            _local_node_info_cache.clear()
+            gateway.local_node_info = {}
         except Exception as e:
             logger.exception(f"General error processing myInfo on connection established: {e}")
             current_error_msg_for_state = status_update[
                 'last_error_message'] = f"Error processing local node info: {str(e)}"
-            _local_node_info_cache.clear()
+            gateway.local_node_info = {}
 
     elif "meshtastic.connection.lost" in topic_str:
         new_status = ListenerState.STATUS_CHOICES[3][0]
         current_error_msg_for_state = current_error_msg_for_state or "Connection lost"
-        logger.warning(f"Meshtastic connection lost. Reason: {current_error_msg_for_state}")
-        _local_node_channel_map_cache.clear()
-        _local_node_info_cache.clear()
+        logger.warning(f"Meshtastic connection of gateway {gateway.name} lost. Reason: {current_error_msg_for_state}")
+        gateway.reset_local_node()
+        # Reconnect right away. Late events of an interface that was already replaced are ignored.
+        if _supervisor is not None and interface is not None and interface is gateway.interface:
+            _supervisor.connection_lost(gateway)
         status_update.update({
             'local_node_channel_map_json': {},
             'local_node_id': None, 'local_node_num': None, 'local_node_name': None
@@ -954,9 +1407,9 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
     elif "meshtastic.connection.failed" in topic_str:
         new_status = ListenerState.STATUS_CHOICES[4][0]
         current_error_msg_for_state = current_error_msg_for_state or "Connection attempt failed (event)"
-        logger.error(f"Meshtastic connection attempt failed. Reason: {current_error_msg_for_state}")
-        _local_node_channel_map_cache.clear()
-        _local_node_info_cache.clear()
+        logger.error(f"Meshtastic connection attempt of gateway {gateway.name} failed. "
+                     f"Reason: {current_error_msg_for_state}")
+        gateway.reset_local_node()
         status_update.update({
             'local_node_channel_map_json': {},
             'local_node_id': None, 'local_node_num': None, 'local_node_name': None
@@ -966,47 +1419,147 @@ def on_connection_django(interface, topic=pub.AUTO_TOPIC, reason=None):
     if 'last_error_message' not in status_update and current_error_msg_for_state:
         status_update['last_error_message'] = current_error_msg_for_state
 
-    with transaction.atomic():
-        ListenerState.objects.update_or_create(singleton_id=1, defaults=status_update)
+    update_gateway_state(gateway, **status_update)
 
     final_error_message_for_log = status_update.get('last_error_message')
-    logger.info(f"Listener status in DB: {new_status}" + (
+    logger.info(f"Gateway {gateway.name} status in DB: {new_status}" + (
         f" (Error: {final_error_message_for_log})" if final_error_message_for_log else ""))
 
 
+def connect_gateway(gateway: Gateway):
+    """Opens the TCP interface of a gateway. Blocks until the device has sent its configuration."""
+    logger.info(f"Gateway {gateway.name}: Attempting to connect to Meshtastic: {gateway.address}")
+    CONNECT_ATTEMPTS.labels(gateway.name).inc()
+    close_old_connections()
+    update_gateway_state(gateway, status=ListenerState.STATUS_CHOICES[1][0], last_error_message=None)
+    gateway.interface = meshtastic.tcp_interface.TCPInterface(
+        hostname=gateway.host,
+        portNumber=gateway.port,
+        noProto=False,
+    )
+    logger.info(f"TCPInterface object created for {gateway.address}. Waiting for connection events.")
+
+
+def gateway_connect_failed(gateway: Gateway, error: BaseException):
+    gateway.interface = None
+    if isinstance(error, ConnectionRefusedError):
+        err_msg = f"Connection to {gateway.address} refused. Detail: {error}"
+        logger.error(err_msg)
+    elif isinstance(error, meshtastic.MeshtasticException):
+        err_msg = f"Meshtastic library error: {error}"
+        logger.error(err_msg)
+    else:
+        err_msg = f"Unexpected error during connection attempt: {error}"
+        logger.error(err_msg, exc_info=error)
+    handle_connection_event(gateway, None, "meshtastic.connection.failed", err_msg)
+
+
+def gateway_restarted(gateway: Gateway):
+    gateway.reset_local_node()
+    close_old_connections()
+    update_gateway_state(gateway, status=ListenerState.STATUS_CHOICES[0][0],
+                         last_error_message="Listener restart initiated by user.")
+
+
+def gateway_heartbeat():
+    """
+    Periodic job: reconnects gateways whose socket is gone without a connection-lost event and
+    refreshes updated_at of the connected gateways' status rows.
+    """
+    close_old_connections()
+    now = django_timezone.now()
+    alive = []
+    for gateway in get_gateways():
+        interface = gateway.interface
+        if interface is None:
+            continue
+        if getattr(interface, 'socket', None) is None:
+            logger.warning(f"Gateway {gateway.name}: Meshtastic interface socket is None. Connection might be lost.")
+            if _supervisor is not None:
+                _supervisor.connection_lost(gateway)
+            continue
+        alive.append(gateway.state_id)
+    if alive:
+        with transaction.atomic():
+            ListenerState.objects.filter(singleton_id__in=alive).update(updated_at=now)
+            counters.bump_sequences(counters.LISTENER_STATE_CHANGED)
+
+
+def check_restart_request():
+    """Periodic job: a restart requested in the dashboard (flag in the first status row) reconnects all gateways."""
+    close_old_connections()
+    if not ListenerState.objects.filter(singleton_id=1, restart_requested=True).exists():
+        return
+    logger.info("Restart request detected for the listener.")
+    with transaction.atomic():
+        ListenerState.objects.filter(singleton_id=1).update(restart_requested=False, updated_at=django_timezone.now())
+        counters.bump_sequences(counters.LISTENER_STATE_CHANGED)
+    if _supervisor is not None:
+        _supervisor.request_restart()
+
+
+def database_maintenance():
+    """Periodic job: ANALYZE / PRAGMA optimize and incremental vacuum of the SQLite database."""
+    close_old_connections()
+    retry_on_lock(run_maintenance, operation='maintenance')
+
+
+def apply_retention():
+    """Periodic job: deletes, thins and aggregates old rows in small chunks (see retention.py)."""
+    close_old_connections()
+    get_retention_manager().run(max_seconds=getattr(settings, 'RETENTION_MAX_SECONDS', 60.0))
+
+
+def rollup_metrics():
+    """Periodic job: writes the completed AverageMetricsHistory buckets the dashboard charts read."""
+    close_old_connections()
+    get_metrics_rollup().run()
+
+
+def flush_capture():
+    if _capture_writer is not None:
+        _capture_writer.flush()
+
+
 class Command(BaseCommand):
     help = 'Starts the Meshtastic Listener to collect data and provide a send API.'
-    _meshtastic_interface = None
     FLASK_PORT = 5555 # This is the hardcoded port for the Flask app
+    _flask_server = None
 
-    def run_flask_app(self):
-        global meshtastic_interface_instance_for_flask
-        meshtastic_interface_instance_for_flask = self._meshtastic_interface
+    def add_arguments(self, parser):
+        parser.add_argument('--capture', metavar='PATH',
+                            help='Record every received packet and node update to PATH (see replay_packets).')
 
+    def run_flask_app(self):
+        """Service of the supervisor; serves the send API until shutdown_flask_app() is called."""
         flask_log = logging.getLogger('werkzeug')
         flask_log.setLevel(logging.ERROR) # Keep Flask's own logging quiet
         # flask_app.logger.disabled = True # This might be too aggressive; werkzeug logger is better
 
-        logger.info(f"Starting Flask API server on host 0.0.0.0, port {self.FLASK_PORT} in a separate thread...")
-        try:
-            # Use the FLASK_PORT from settings if available, otherwise default
-            actual_flask_port = getattr(settings, 'LISTENER_FLASK_PORT', self.FLASK_PORT)
-            if isinstance(actual_flask_port, str): actual_flask_port = int(actual_flask_port)
+        logger.info(f"Starting Flask API server on host 0.0.0.0, port {self.FLASK_PORT}...")
+        # Use the FLASK_PORT from settings if available, otherwise default
+        actual_flask_port = getattr(settings, 'LISTENER_FLASK_PORT', self.FLASK_PORT)
+        if isinstance(actual_flask_port, str): actual_flask_port = int(actual_flask_port)
 
-            if actual_flask_port != self.FLASK_PORT: # Update class default if setting is different for consistency
-                logger.info(f"Overriding hardcoded FLASK_PORT ({self.FLASK_PORT}) with LISTENER_FLASK_PORT from settings: {actual_flask_port}")
-                Command.FLASK_PORT = actual_flask_port # Update for flask_send_url in on_receive_django
+        if actual_flask_port != self.FLASK_PORT: # Update class default if setting is different for consistency
+            logger.info(f"Overriding hardcoded FLASK_PORT ({self.FLASK_PORT}) with LISTENER_FLASK_PORT from settings: {actual_flask_port}")
+            Command.FLASK_PORT = actual_flask_port
 
-            flask_app.run(host='0.0.0.0', port=actual_flask_port, threaded=True, use_reloader=False, debug=False)
-        except Exception as e:
-            logger.exception(f"Flask API server failed to start or crashed: {e}")
+        self._flask_server = make_server('0.0.0.0', actual_flask_port, flask_app, threaded=True)
+        self._flask_server.serve_forever()
+
+    def shutdown_flask_app(self):
+        events.get_event_broker().close()  # Open event streams would keep their server threads alive
+        if self._flask_server is not None:
+            self._flask_server.shutdown()
+            self._flask_server = None
 
     def handle(self, *args, **options):
+        global _supervisor
         self.stdout.write(self.style.SUCCESS("Starting Meshtastic Listener with Send API..."))
         logger.info("Meshtastic Listener Management Command started.")
 
         # Update Command.FLASK_PORT from Django settings if available
-        # This makes the flask_send_url in on_receive_django use the configured port
         try:
             configured_flask_port = getattr(settings, 'LISTENER_FLASK_PORT', str(Command.FLASK_PORT))
             Command.FLASK_PORT = int(configured_flask_port)
@@ -1015,20 +1568,33 @@ class Command(BaseCommand):
             logger.error(f"Invalid LISTENER_FLASK_PORT value in settings: {settings.LISTENER_FLASK_PORT}. Using default {Command.FLASK_PORT}.")
             Command.FLASK_PORT = 5555 # Fallback to original hardcoded default
 
-        flask_api_thread = None
-        flask_thread_started_successfully = False
+        gateways = get_gateways()
+        logger.info(f"Listening to {len(gateways)} gateway(s): "
+                    f"{', '.join(f'{gateway.name} ({gateway.address})' for gateway in gateways)}")
 
         close_old_connections()
         with transaction.atomic():
-            ListenerState.objects.update_or_create(
-                singleton_id=1,
-                defaults={'status': ListenerState.STATUS_CHOICES[0][0], 'updated_at': django_timezone.now()}
-            )
-
-        host = settings.MESHTASTIC_DEVICE_HOST
-        port = settings.MESHTASTIC_DEVICE_PORT
-        retry_delay = 5
-        max_retry_delay = 60
+            # Status rows of gateways that are no longer configured.
+            ListenerState.objects.filter(singleton_id__gt=len(gateways)).delete()
+            for gateway in gateways:
+                defaults = {'status': ListenerState.STATUS_CHOICES[0][0], 'gateway_name': gateway.name,
+                            'gateway_address': gateway.address, 'updated_at': django_timezone.now()}
+                if gateway.state_id == 1:
+                    defaults.update({'ingest_shed_count': 0, 'ingest_coalesced_count': 0})
+                ListenerState.objects.update_or_create(singleton_id=gateway.state_id, defaults=defaults)
+            counters.bump_sequences(counters.LISTENER_STATE_CHANGED)
+
+        start_outbound_scheduler()
+        start_commander_dispatcher()
+        start_ingest_pipeline()
+        # atexit runs in reverse order: the ingest writer is drained before the commander workers stop,
+        # and the commander workers before the outbound scheduler.
+        atexit.register(stop_outbound_scheduler)
+        atexit.register(stop_commander_dispatcher)
+        atexit.register(stop_ingest_pipeline)
+        if options.get('capture'):
+            start_capture(options['capture'])
+            atexit.register(stop_capture)
 
         pub.subscribe(on_receive_django, "meshtastic.receive")
         pub.subscribe(on_node_updated_django, "meshtastic.node.updated")
@@ -1036,153 +1602,48 @@ class Command(BaseCommand):
         pub.subscribe(on_connection_django, "meshtastic.connection.lost")
         pub.subscribe(on_connection_django, "meshtastic.connection.failed")
 
-        while True:
+        _supervisor = ListenerSupervisor(
+            gateways,
+            connect=connect_gateway,
+            on_connect_failed=gateway_connect_failed,
+            on_restart=gateway_restarted,
+            backoff_base=getattr(settings, 'LISTENER_RECONNECT_BACKOFF_BASE', 1.0),
+            backoff_max=getattr(settings, 'LISTENER_RECONNECT_BACKOFF_MAX', 60.0),
+        )
+        _supervisor.add_periodic_job('heartbeat', getattr(settings, 'LISTENER_HEARTBEAT_INTERVAL', 10.0),
+                                     gateway_heartbeat)
+        _supervisor.add_periodic_job('restart-check', getattr(settings, 'LISTENER_RESTART_POLL_INTERVAL', 1.0),
+                                     check_restart_request)
+        maintenance_interval = getattr(settings, 'DATABASE_MAINTENANCE_INTERVAL', 3600.0)
+        if maintenance_interval > 0:
+            _supervisor.add_periodic_job('db-maintenance', maintenance_interval, database_maintenance)
+        rollup_interval = getattr(settings, 'ROLLUP_INTERVAL', 60.0)
+        if rollup_interval > 0:
+            _supervisor.add_periodic_job('metrics-rollup', rollup_interval, rollup_metrics)
+        retention_interval = getattr(settings, 'RETENTION_INTERVAL', 3600.0)
+        if retention_interval > 0:
+            _supervisor.add_periodic_job('retention', retention_interval, apply_retention)
+        if options.get('capture'):
+            _supervisor.add_periodic_job('capture-flush', 1.0, flush_capture)
+        _supervisor.add_service('Flask API server', self.run_flask_app, self.shutdown_flask_app)
+
+        final_status, final_message = ListenerState.STATUS_CHOICES[3][0], "Listener shut down by user."
+        try:
+            _supervisor.run()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(" Meshtastic Listener stopping..."))
+        except Exception as e:
+            logger.exception(f"Listener supervisor crashed: {e}")
+            final_status, final_message = ListenerState.STATUS_CHOICES[4][0], f"Listener supervisor crashed: {e}"
+        finally:
+            _supervisor = None
+            for gateway in gateways:
+                gateway.close_interface()
+            stop_ingest_pipeline()
+            stop_commander_dispatcher()
+            stop_outbound_scheduler()
+            stop_capture()
             close_old_connections()
-
-            try:
-                current_listener_state = ListenerState.objects.get(singleton_id=1)
-                if current_listener_state.restart_requested:
-                    logger.info("Restart request detected for the listener.")
-                    if self._meshtastic_interface:
-                        try:
-                            logger.info("Closing existing Meshtastic interface for restart...")
-                            self._meshtastic_interface.close()
-                        except Exception as e_close:
-                            logger.error(f"Error closing Meshtastic interface during restart: {e_close}")
-                    self._meshtastic_interface = None
-                    meshtastic_interface_instance_for_flask = None
-                    flask_thread_started_successfully = False
-
-                    with transaction.atomic():
-                        ListenerState.objects.filter(singleton_id=1).update(
-                            status=ListenerState.STATUS_CHOICES[0][0],
-                            restart_requested=False,
-                            last_error_message="Listener restart initiated by user.",
-                            updated_at=django_timezone.now()
-                        )
-                    logger.info("Listener restart initiated. Will attempt to reconnect.")
-                    retry_delay = 1
-            except ListenerState.DoesNotExist:
-                logger.warning("ListenerState not found in database. Cannot check for restart request.")
-            except OperationalError as oe_db:
-                logger.error(f"Database error when checking for restart request: {oe_db}. Retrying DB operation later.")
-                time.sleep(retry_delay)
-                continue
-            except Exception as e_restart_check:
-                logger.exception(f"Unexpected error checking for listener restart: {e_restart_check}")
-
-            if self._meshtastic_interface is None:
-                logger.info(f"Attempting to connect to Meshtastic: {host}:{port}")
-                with transaction.atomic():
-                    ListenerState.objects.update_or_create(
-                        singleton_id=1,
-                        defaults={'status': ListenerState.STATUS_CHOICES[1][0], 'last_error_message': None,
-                                  'updated_at': django_timezone.now()}
-                    )
-                try:
-                    self._meshtastic_interface = meshtastic.tcp_interface.TCPInterface(
-                        hostname=host,
-                        portNumber=port,
-                        noProto=False,
-                    )
-                    meshtastic_interface_instance_for_flask = self._meshtastic_interface
-
-                    logger.info(f"TCPInterface object created for {host}:{port}. Waiting for connection events.")
-
-                    if not flask_api_thread or not flask_api_thread.is_alive():
-                        logger.info("Meshtastic interface object (re)created. (Re)starting Flask API thread.")
-                        flask_api_thread = threading.Thread(target=self.run_flask_app, daemon=True)
-                        flask_api_thread.start()
-                        time.sleep(2)
-                        if flask_api_thread.is_alive():
-                            logger.info("Flask API thread seems to be running.")
-                            flask_thread_started_successfully = True
-                        else:
-                            logger.error("Flask API thread did not start correctly!")
-                            flask_thread_started_successfully = False
-                    retry_delay = 5
-
-                except ConnectionRefusedError as e:
-                    err_msg = f"Connection to {host}:{port} refused. Detail: {e}"
-                    logger.error(err_msg)
-                    pub.sendMessage("meshtastic.connection.failed", interface=None, reason=err_msg)
-                    self._meshtastic_interface = None
-                except meshtastic.MeshtasticException as e:
-                    err_msg = f"Meshtastic library error: {e}"
-                    logger.error(err_msg)
-                    pub.sendMessage("meshtastic.connection.failed", interface=None, reason=err_msg)
-                    self._meshtastic_interface = None
-                except Exception as e:
-                    err_msg = f"Unexpected error during connection attempt: {e}"
-                    logger.exception(err_msg)
-                    pub.sendMessage("meshtastic.connection.failed", interface=None, reason=err_msg)
-                    self._meshtastic_interface = None
-
-                if self._meshtastic_interface is None:
-                    logger.info(f"Connection attempt failed. Waiting {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    retry_delay = min(retry_delay * 2, max_retry_delay)
-                    flask_thread_started_successfully = False
-                    continue
-
-            if self._meshtastic_interface:
-                try:
-                    if flask_thread_started_successfully and (not flask_api_thread or not flask_api_thread.is_alive()):
-                        logger.warning(
-                            "Flask API thread is no longer alive! Closing Meshtastic interface to trigger reconnect and Flask restart.")
-                        if self._meshtastic_interface:
-                            try:
-                                self._meshtastic_interface.close()
-                            except:
-                                pass
-                        self._meshtastic_interface = None
-                        flask_thread_started_successfully = False
-                        continue
-
-                    if not (hasattr(self._meshtastic_interface,
-                                    'socket') and self._meshtastic_interface.socket is not None):
-                        logger.warning(
-                            "Meshtastic interface socket is None (periodic check). Connection might be lost.")
-                        if self._meshtastic_interface:
-                            try:
-                                self._meshtastic_interface.close()
-                            except Exception as close_err:
-                                logger.error(f"Error during defensive close of interface: {close_err}")
-                        self._meshtastic_interface = None
-                        flask_thread_started_successfully = False
-                        continue
-
-                    time.sleep(5)
-
-                except KeyboardInterrupt:
-                    self.stdout.write(self.style.WARNING(" Meshtastic Listener stopping..."))
-                    if self._meshtastic_interface:
-                        self._meshtastic_interface.close()
-                    close_old_connections()
-                    with transaction.atomic():
-                        ListenerState.objects.update_or_create(singleton_id=1, defaults={
-                            'status': ListenerState.STATUS_CHOICES[3][0],
-                            'last_error_message': "Listener shut down by user.",
-                            'restart_requested': False,
-                            'updated_at': django_timezone.now()
-                        })
-                    break
-                except Exception as e:
-                    logger.exception(f"Unexpected error in main listener operational loop: {e}")
-                    if self._meshtastic_interface:
-                        try:
-                            self._meshtastic_interface.close()
-                        except:
-                            pass
-                    self._meshtastic_interface = None
-                    flask_thread_started_successfully = False
-                    with transaction.atomic():
-                        ListenerState.objects.update_or_create(singleton_id=1, defaults={
-                            'status': ListenerState.STATUS_CHOICES[4][0],
-                            'last_error_message': f"Main loop error: {str(e)}",
-                            'restart_requested': False,
-                            'updated_at': django_timezone.now()
-                        })
-                    time.sleep(retry_delay)
-            else:
-                time.sleep(retry_delay)
\ No newline at end of file
+            for gateway in gateways:
+                update_gateway_state(gateway, status=final_status, last_error_message=final_message,
+                                     restart_requested=False)
@@ -0,0 +1,25 @@
+# metrastics_listener/management/commands/optimize_database.py
+from django.core.management.base import BaseCommand
+
+from metrastics.database import retry_on_lock, run_maintenance
+
+
+class Command(BaseCommand):
+    help = ('Runs the SQLite maintenance job of the listener once: ANALYZE / PRAGMA optimize and an incremental '
+            'vacuum. --vacuum rewrites the database with incremental auto-vacuum enabled (stop the listener first).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Full VACUUM that switches the database to auto_vacuum=INCREMENTAL.')
+        parser.add_argument('--pages', type=int, help='Free pages to release (default: SQLITE_INCREMENTAL_VACUUM_PAGES).')
+
+    def handle(self, *args, **options):
+        result = retry_on_lock(run_maintenance, vacuum_pages=options['pages'], full_vacuum=options['vacuum'],
+                               operation='maintenance')
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(f"Nothing to do on a {result['vendor']} database."))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Statistics: {result['analyzed']}, vacuumed: {result.get('vacuumed', 'no')}, "
+            f"free pages left: {result['free_pages']}, journal mode: {result['journal_mode']} "
+            f"({result['seconds']}s)."))
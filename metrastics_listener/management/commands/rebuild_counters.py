@@ -0,0 +1,20 @@
+# metrastics_listener/management/commands/rebuild_counters.py
+from django.core.management.base import BaseCommand
+
+from metrastics_listener.counters import is_recounted, read_counters, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = ('Recounts the dashboard counters (packets per type, portnum and channel, nodes, traceroutes) from the '
+            'tables and reports how far the incrementally maintained values had drifted.')
+
+    def handle(self, *args, **options):
+        before = {key: value for key, value in read_counters().items() if is_recounted(key)}
+        after = rebuild_counters()
+        drifted = {key: after.get(key, 0) - before.get(key, 0) for key in set(before) | set(after)
+                   if after.get(key, 0) != before.get(key, 0)}
+        for key in sorted(drifted):
+            self.stdout.write(f"{key:50} {before.get(key, 0):>12} -> {after.get(key, 0):>12}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(after)} counters rebuilt, {len(drifted)} had drifted." if drifted else
+            f"{len(after)} counters rebuilt, all were correct."))
@@ -0,0 +1,24 @@
+# metrastics_listener/management/commands/rebuild_message_search.py
+from django.core.management.base import BaseCommand
+
+from metrastics_listener import message_search
+
+
+class Command(BaseCommand):
+    help = ('Indexes all messages for the full-text message search, in small chunks. Run it once after upgrading to '
+            'fill the index with existing messages; safe to run while the listener is running.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Messages indexed per transaction.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Empty the index first, dropping entries of messages deleted in the meantime.')
+
+    def handle(self, *args, **options):
+        if not message_search.available():
+            self.stdout.write(self.style.WARNING(
+                "This database has no message search index (SQLite with FTS5 or PostgreSQL required)."))
+            return
+        indexed = message_search.rebuild(
+            chunk_size=max(1, options['chunk_size']), clear=options['clear'],
+            progress=lambda count: self.stdout.write(f"{count} messages indexed..."))
+        self.stdout.write(self.style.SUCCESS(f"Message search index rebuilt: {indexed} messages."))
@@ -0,0 +1,143 @@
+# metrastics_listener/management/commands/replay_packets.py
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from metrastics_commander.dispatcher import CommanderDispatcher
+from metrastics_listener.capture import KIND_PACKET, read_capture
+from metrastics_listener.management.commands import listen_device
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayInterface:
+    """Stands in for the Meshtastic interface; sent texts are only counted."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.myInfo = None
+        self.localNode = None
+        self.sent_texts = 0
+
+    def sendText(self, text, destinationId=None, wantAck=False, channelIndex=0, **kwargs):
+        self.sent_texts += 1
+
+
+class QueryCounter:
+    """Counts the SQL queries of every database connection, including those of the ingest writer thread."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection.ensure_connection()
+        connection.execute_wrappers.append(self)
+        connection_created.connect(self._on_connection_created, weak=False)
+
+    def uninstall(self):
+        connection_created.disconnect(self._on_connection_created)
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Feeds a capture recorded with "listen_device --capture" through the listener callbacks and reports '
+            'ingest throughput. Writes to the configured database, so point DATABASE_URL at a scratch copy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture', help='Capture file written by listen_device --capture.')
+        parser.add_argument('--speed', type=float, default=0,
+                            help='Replay speed: 1 is real time, 10 is ten times faster, 0 (default) is as fast as possible.')
+        parser.add_argument('--pipeline', action='store_true',
+                            help='Run the write-behind ingest pipeline like the listener does, instead of writing '
+                                 'every event synchronously. Per-event times then only cover the enqueue.')
+        parser.add_argument('--commander', action='store_true',
+                            help='Run commander rules (and ChatGPT) for replayed messages. Replies are not sent.')
+
+    def handle(self, *args, **options):
+        speed = options['speed']
+        if speed < 0:
+            raise CommandError("--speed must not be negative.")
+
+        interface = ReplayInterface()
+        # Replayed packets are attributed to (and replies sent through) the primary gateway.
+        gateway = listen_device.get_gateways().primary
+        gateway.interface = interface
+        if options['commander']:
+            listen_device.start_outbound_scheduler()
+            listen_device.start_commander_dispatcher()
+        else:
+            listen_device._commander_dispatcher = CommanderDispatcher(handler=lambda *job: None, workers=1,
+                                                                      max_queue_size=1000000, name='replay-commander')
+            listen_device._commander_dispatcher.start()
+        if options['pipeline']:
+            listen_device.start_ingest_pipeline()
+        else:
+            listen_device.get_node_cache().load()
+
+        query_counter = QueryCounter()
+        query_counter.install()
+        durations = []
+        packet_count = 0
+        node_update_count = 0
+        started_at = time.perf_counter()
+        try:
+            for kind, offset, event in read_capture(options['capture']):
+                if speed > 0:
+                    delay = started_at + offset / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                event_started_at = time.perf_counter()
+                if kind == KIND_PACKET:
+                    listen_device.on_receive_django(event, interface)
+                    packet_count += 1
+                else:
+                    listen_device.on_node_updated_django(event, interface)
+                    node_update_count += 1
+                durations.append(time.perf_counter() - event_started_at)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read capture: {e}")
+        finally:
+            # Throughput includes draining the writer queue and the final node flush.
+            listen_device.stop_ingest_pipeline()
+            listen_device.get_node_cache().flush()
+            total_seconds = time.perf_counter() - started_at
+            listen_device.stop_commander_dispatcher()
+            listen_device.stop_outbound_scheduler()
+            gateway.interface = None
+            query_counter.uninstall()
+
+        event_count = packet_count + node_update_count
+        if not event_count:
+            self.stdout.write(self.style.WARNING("Capture contains no events."))
+            return
+        durations.sort()
+        self.stdout.write(f"Events: {event_count} ({packet_count} packets, {node_update_count} node updates) "
+                          f"in {total_seconds:.2f}s" + (f" at {speed:g}x speed" if speed > 0 else ""))
+        self.stdout.write(f"Throughput: {event_count / total_seconds:.1f} events/s")
+        self.stdout.write(f"Per event: p50 {percentile(durations, 0.5) * 1000:.2f} ms, "
+                          f"p99 {percentile(durations, 0.99) * 1000:.2f} ms, max {durations[-1] * 1000:.2f} ms")
+        self.stdout.write(f"DB queries: {query_counter.count} ({query_counter.count / event_count:.2f} per event)")
+        if interface.sent_texts:
+            self.stdout.write(f"Commander replies (not sent): {interface.sent_texts}")
+        self.stdout.write(self.style.SUCCESS("Replay finished."))
@@ -0,0 +1,188 @@
+# metrastics_listener/message_search.py
+"""
+Full-text search over messages.
+
+Every message has one row in the search index: its text plus the long/short names and ids of
+its sender and recipient. On SQLite the index is an FTS5 table (rowid = message id); on
+PostgreSQL it is a table of tsvectors (text weighted above names) with a GIN index. Both are
+created by migration 0010; on other databases `available()` is False and the messages API
+falls back to substring matching.
+
+The ingest writer indexes new messages in its batch transaction, and node renames re-index the
+messages of the renamed nodes (see node_names.names_changed). `rebuild()` (the
+rebuild_message_search command) indexes existing rows in key-ordered chunks.
+
+A query matches messages that contain every word of it as a word prefix ("hel wor" finds
+"Hello world"). Results come newest first or by relevance (BM25 on SQLite, ts_rank on PostgreSQL).
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+
+from django.db import connections, transaction
+
+from metrastics import metrics
+from metrastics_listener.models import Message, Node
+
+TABLE = 'metrastics_message_search'
+VENDORS = ('sqlite', 'postgresql')
+ORDER_RECENT = 'recent'
+ORDER_RELEVANCE = 'relevance'
+MAX_TERMS = 8
+
+SEARCH_SECONDS = metrics.histogram('metrastics_message_search_seconds',
+                                   'Duration of full-text message searches, by order.', ['order'])
+
+_TERM = re.compile(r'\w+')
+_backends: Dict[str, Optional[str]] = {}
+
+
+def available(using: str = 'default') -> bool:
+    """Whether the database has the search index (checked once per process)."""
+    if using not in _backends:
+        connection = connections[using]
+        exists = connection.vendor in VENDORS and TABLE in connection.introspection.table_names()
+        _backends[using] = connection.vendor if exists else None
+    return _backends[using] is not None
+
+
+def search_terms(query: str) -> List[str]:
+    """The words of a search box query; punctuation (e.g. the ! of node ids) only separates them."""
+    return _TERM.findall((query or '').lower())[:MAX_TERMS]
+
+
+def _names_sql() -> str:
+    return " || ' ' || ".join(
+        f"coalesce({column}, '')" for column in
+        ('f.long_name', 'f.short_name', 'm.from_node_id_str', 't.long_name', 't.short_name', 'm.to_node_id_str'))
+
+
+def _source_sql(columns: str, where: str) -> str:
+    return (f"SELECT {columns} FROM {Message._meta.db_table} m "
+            f"LEFT JOIN {Node._meta.db_table} f ON f.node_id = m.from_node_id_str "
+            f"LEFT JOIN {Node._meta.db_table} t ON t.node_id = m.to_node_id_str "
+            f"WHERE {where}")
+
+
+def _index_where(where: str, params: list, using: str = 'default') -> int:
+    """(Re-)indexes the messages matching `where` (on the message table `m`). Returns their number."""
+    if not available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        if connections[using].vendor == 'sqlite':
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({_source_sql('m.packet_id', where)})", params)
+            cursor.execute(f"INSERT INTO {TABLE} (rowid, text, names) "
+                           f"{_source_sql(f'm.packet_id, m.text, {_names_sql()}', where)}", params)
+        else:
+            document = (f"setweight(to_tsvector('simple', m.text), 'A') || "
+                        f"setweight(to_tsvector('simple', {_names_sql()}), 'B')")
+            cursor.execute(f"INSERT INTO {TABLE} (message_id, document) "
+                           f"{_source_sql(f'm.packet_id, {document}', where)} "
+                           f"ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document", params)
+        return cursor.rowcount
+
+
+def _placeholders(values: list) -> str:
+    return ', '.join(['%s'] * len(values))
+
+
+def index_messages(message_ids: Iterable[int], using: str = 'default') -> int:
+    """Indexes the given messages. Call it in the transaction that writes them."""
+    message_ids = list(message_ids)
+    if not message_ids:
+        return 0
+    return _index_where(f"m.packet_id IN ({_placeholders(message_ids)})", message_ids, using)
+
+
+def reindex_nodes(node_ids: Iterable[str], using: str = 'default') -> int:
+    """Re-indexes the messages from and to the given nodes, e.g. after they were renamed."""
+    node_ids = list(node_ids)
+    if not node_ids:
+        return 0
+    placeholders = _placeholders(node_ids)
+    return _index_where(f"m.from_node_id_str IN ({placeholders}) OR m.to_node_id_str IN ({placeholders})",
+                        node_ids + node_ids, using)
+
+
+def rebuild(chunk_size: int = 5000, clear: bool = False, using: str = 'default', progress=None) -> int:
+    """
+    Indexes all messages in key-ordered chunks, each in its own transaction, so ingest keeps
+    running. `clear` first empties the index (dropping rows of deleted messages). Returns the
+    number of indexed messages; `progress(indexed)` is called after every chunk.
+    """
+    if not available(using):
+        return 0
+    if clear:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE}")
+    indexed = 0
+    last_pk = 0
+    while True:
+        pks = list(Message.objects.using(using).filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return indexed
+        with transaction.atomic(using=using):
+            indexed += _index_where("m.packet_id >= %s AND m.packet_id <= %s", [pks[0], pks[-1]], using)
+        last_pk = pks[-1]
+        if progress is not None:
+            progress(indexed)
+
+
+class MessageSearch:
+    """
+    The messages matching a search query, in a form Django's Paginator can page through:
+    count() runs one count query, slicing one search query for that page.
+    """
+
+    def __init__(self, query: str, order: str = ORDER_RECENT, using: str = 'default'):
+        self.terms = search_terms(query)
+        self.order = ORDER_RELEVANCE if order == ORDER_RELEVANCE else ORDER_RECENT
+        self.using = using
+        self._count: Optional[int] = None
+
+    def _match(self):
+        """FROM/WHERE clause and parameters of the matching messages."""
+        join = f"JOIN {Message._meta.db_table} m ON m.packet_id = "
+        if connections[self.using].vendor == 'sqlite':
+            expression = ' '.join(f'"{term}"*' for term in self.terms)
+            return f"FROM {TABLE} {join}{TABLE}.rowid WHERE {TABLE} MATCH %s", [expression]
+        expression = ' & '.join(f"{term}:*" for term in self.terms)
+        return f"FROM {TABLE} s {join}s.message_id WHERE s.document @@ to_tsquery('simple', %s)", [expression]
+
+    def count(self) -> int:
+        if self._count is None:
+            if not self.terms:
+                self._count = 0
+            else:
+                clause, params = self._match()
+                with connections[self.using].cursor() as cursor:
+                    cursor.execute(f"SELECT count(*) {clause}", params)
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __getitem__(self, page: slice) -> List[Message]:
+        if not isinstance(page, slice) or page.step is not None:
+            raise TypeError("MessageSearch only supports slicing.")
+        start = page.start or 0
+        limit = (page.stop - start) if page.stop is not None else self.count() - start
+        if not self.terms or limit <= 0:
+            return []
+
+        clause, params = self._match()
+        vendor = connections[self.using].vendor
+        if self.order == ORDER_RECENT:
+            ordering = "m.timestamp DESC"
+        elif vendor == 'sqlite':
+            ordering = f"bm25({TABLE}, 2.0, 1.0), m.timestamp DESC"  # Text matches weigh twice as much as names
+        else:
+            ordering = "ts_rank(s.document, to_tsquery('simple', %s)) DESC, m.timestamp DESC"
+            params = params + params
+        with SEARCH_SECONDS.labels(self.order).time(), connections[self.using].cursor() as cursor:
+            cursor.execute(f"SELECT m.packet_id {clause} ORDER BY {ordering} LIMIT %s OFFSET %s",
+                           params + [limit, start])
+            message_ids = [row[0] for row in cursor.fetchall()]
+        messages = Message.objects.using(self.using).in_bulk(message_ids)
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packet',
+            name='copies_heard',
+            field=models.PositiveIntegerField(default=1, help_text='Wie oft dieses Paket (inkl. Rebroadcasts) empfangen wurde'),
+        ),
+    ]
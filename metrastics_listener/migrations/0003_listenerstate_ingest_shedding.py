@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0002_packet_copies_heard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listenerstate',
+            name='ingest_shed_count',
+            field=models.PositiveBigIntegerField(default=0, help_text='Records dropped under ingest overload since the listener started.'),
+        ),
+        migrations.AddField(
+            model_name='listenerstate',
+            name='ingest_coalesced_count',
+            field=models.PositiveBigIntegerField(default=0, help_text='Records merged into a newer sample of the same node since the listener started.'),
+        ),
+        migrations.AddField(
+            model_name='listenerstate',
+            name='ingest_last_shed_at',
+            field=models.DateTimeField(blank=True, null=True, help_text='When records were last dropped under ingest overload.'),
+        ),
+    ]
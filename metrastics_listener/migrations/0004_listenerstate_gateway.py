@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0003_listenerstate_ingest_shedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listenerstate',
+            name='gateway_name',
+            field=models.CharField(blank=True, help_text='Name of the gateway this row describes.', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='listenerstate',
+            name='gateway_address',
+            field=models.CharField(blank=True, help_text="host:port of the gateway's TCP interface.", max_length=255, null=True),
+        ),
+    ]
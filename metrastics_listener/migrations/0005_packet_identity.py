@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0004_listenerstate_gateway'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packet',
+            name='gateway_key',
+            field=models.IntegerField(blank=True, help_text='Schlüssel des empfangenden Gateways (CRC32 des Namens)', null=True),
+        ),
+        migrations.AddField(
+            model_name='packet',
+            name='mesh_from',
+            field=models.BigIntegerField(blank=True, help_text='Knotennummer des Absenders', null=True),
+        ),
+        migrations.AddField(
+            model_name='packet',
+            name='mesh_id',
+            field=models.BigIntegerField(blank=True, help_text='Mesh-Paket-ID', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='packet',
+            constraint=models.UniqueConstraint(fields=('mesh_id', 'mesh_from', 'rx_time', 'gateway_key'), name='unique_packet_identity'),
+        ),
+    ]
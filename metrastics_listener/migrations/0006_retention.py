@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0005_packet_identity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionState',
+            fields=[
+                ('policy', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('processed_until', models.FloatField(blank=True, help_text='Unix time up to which the policy has thinned or aggregated rows.', null=True)),
+                ('rows_deleted', models.PositiveBigIntegerField(default=0)),
+                ('rows_aggregated', models.PositiveBigIntegerField(default=0, help_text='Rows written as aggregates of deleted rows.')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Retention State',
+                'verbose_name_plural': 'Retention States',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['timestamp'], name='metrastics__timesta_3dd3a7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='telemetry',
+            index=models.Index(fields=['timestamp'], name='metrastics__timesta_3d62dd_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0006_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='averagemetricshistory',
+            name='packet_count',
+            field=models.PositiveIntegerField(default=0, help_text='Pakete im Bucket'),
+        ),
+        migrations.AddField(
+            model_name='averagemetricshistory',
+            name='snr_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='averagemetricshistory',
+            name='rssi_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='averagemetricshistory',
+            name='battery_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='averagemetricshistory',
+            name='chan_util_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='averagemetricshistory',
+            name='air_util_tx_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_rows(apps, schema_editor):
+    """Initial counters; afterwards the listener keeps them up to date (see counters.rebuild_counters)."""
+    Packet = apps.get_model('metrastics_listener', 'Packet')
+    Node = apps.get_model('metrastics_listener', 'Node')
+    Traceroute = apps.get_model('metrastics_listener', 'Traceroute')
+    StatCounter = apps.get_model('metrastics_listener', 'StatCounter')
+
+    counters = {
+        'packets': Packet.objects.count(),
+        'nodes': Node.objects.count(),
+        'traceroutes': Traceroute.objects.count(),
+    }
+    for field, prefix in (('packet_type', 'packets.type.'), ('portnum', 'packets.portnum.'),
+                          ('channel', 'packets.channel.')):
+        for row in Packet.objects.order_by().values(field).annotate(count=Count('pk')):
+            counters[f"{prefix}{row[field] if row[field] is not None else 'none'}"] = row['count']
+    StatCounter.objects.bulk_create([StatCounter(key=key, value=value) for key, value in counters.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0007_averagemetricshistory_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('key', models.CharField(help_text='e.g. packets, packets.type.Message, packets.portnum.TEXT_MESSAGE_APP, nodes', max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Stat Counter',
+                'verbose_name_plural': 'Stat Counters',
+                'ordering': ['key'],
+            },
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
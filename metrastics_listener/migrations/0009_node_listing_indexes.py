@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0008_statcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['last_heard', 'node_id'], name='metrastics__last_he_b3b56d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['long_name', 'node_id'], name='metrastics__long_na_00ead7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['hw_model', 'node_id'], name='metrastics__hw_mode_639303_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['role', 'node_id'], name='metrastics__role_4ad444_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:30
+
+import logging
+
+from django.db import OperationalError, migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def create_search_index(apps, schema_editor):
+    """The full-text index of messages (see message_search); filled by the rebuild_message_search command."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute(
+                    "CREATE VIRTUAL TABLE metrastics_message_search USING fts5("
+                    "text, names, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+        except OperationalError as e:
+            # SQLite built without FTS5: the messages API keeps searching with substring matches.
+            logger.warning(f"Message search index not created: {e}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE metrastics_message_search ("
+            "message_id bigint PRIMARY KEY, document tsvector NOT NULL)")
+        schema_editor.execute(
+            "CREATE INDEX metrastics_message_search_document ON metrastics_message_search USING gin (document)")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS metrastics_message_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrastics_listener', '0009_node_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -60,6 +60,13 @@ class Node(models.Model):
 
     class Meta:
         ordering = ['node_num', 'node_id']
+        # Sort keys of the v2 node listing; node_id makes each key unique for keyset pagination.
+        indexes = [
+            models.Index(fields=['last_heard', 'node_id']),
+            models.Index(fields=['long_name', 'node_id']),
+            models.Index(fields=['hw_model', 'node_id']),
+            models.Index(fields=['role', 'node_id']),
+        ]
         verbose_name = "Node"
         verbose_name_plural = "Nodes"
 
@@ -68,6 +75,10 @@ class Packet(models.Model):
     event_id = models.CharField(max_length=50, unique=True, help_text="Eindeutiger Bezeichner für das Paketereignis")
     timestamp = models.FloatField(help_text="Unix-Zeitstempel des Paketempfangs/-verarbeitung")
     rx_time = models.BigIntegerField(null=True, blank=True, help_text="RX-Zeit des Geräts, falls verfügbar (Unix)")
+    # Identität des Empfangs: (gateway_key, mesh_from, mesh_id, rx_time), siehe dedupe.packet_identity
+    gateway_key = models.IntegerField(null=True, blank=True, help_text="Schlüssel des empfangenden Gateways (CRC32 des Namens)")
+    mesh_from = models.BigIntegerField(null=True, blank=True, help_text="Knotennummer des Absenders")
+    mesh_id = models.BigIntegerField(null=True, blank=True, help_text="Mesh-Paket-ID")
 
     from_node = models.ForeignKey(Node, related_name='sent_packets', on_delete=models.SET_NULL, null=True, blank=True,
                                   to_field='node_id')
@@ -89,6 +100,8 @@ class Packet(models.Model):
     rx_rssi = models.IntegerField(null=True, blank=True)
     hop_limit = models.PositiveSmallIntegerField(null=True, blank=True)
     want_ack = models.BooleanField(default=False)
+    copies_heard = models.PositiveIntegerField(default=1,
+                                               help_text="Wie oft dieses Paket (inkl. Rebroadcasts) empfangen wurde")
 
     decoded_json = models.JSONField(null=True, blank=True, help_text="Dekodierte Nutzlast als JSON")
     raw_json = models.JSONField(null=True, blank=True, help_text="Rohe Paketstruktur als JSON")
@@ -104,6 +117,11 @@ class Packet(models.Model):
             models.Index(fields=['timestamp']),
             models.Index(fields=['packet_type']),
         ]
+        constraints = [
+            # mesh_id first: random 32-bit ids make it the most selective column for identity lookups.
+            models.UniqueConstraint(fields=['mesh_id', 'mesh_from', 'rx_time', 'gateway_key'],
+                                    name='unique_packet_identity'),
+        ]
         verbose_name = "Packet"
         verbose_name_plural = "Packets"
 
@@ -161,7 +179,7 @@ class Position(models.Model):
 
     class Meta:
         ordering = ['node', '-timestamp']
-        indexes = [models.Index(fields=['node', '-timestamp'])]
+        indexes = [models.Index(fields=['node', '-timestamp']), models.Index(fields=['timestamp'])]
         verbose_name = "Position"
         verbose_name_plural = "Positions"
 
@@ -189,7 +207,7 @@ class Telemetry(models.Model):
 
     class Meta:
         ordering = ['node', '-timestamp']
-        indexes = [models.Index(fields=['node', '-timestamp'])]
+        indexes = [models.Index(fields=['node', '-timestamp']), models.Index(fields=['timestamp'])]
         verbose_name = "Telemetry"
         verbose_name_plural = "Telemetry Data"
 
@@ -203,6 +221,13 @@ class AverageMetricsHistory(models.Model):
     average_air_util_tx = models.FloatField(null=True, blank=True)
     active_node_count = models.PositiveIntegerField()
     total_node_count = models.PositiveIntegerField()
+    # Stichproben je Durchschnitt, damit sich Buckets zu beliebigen Zeitfenstern gewichtet zusammenfassen lassen
+    packet_count = models.PositiveIntegerField(default=0, help_text="Pakete im Bucket")
+    snr_count = models.PositiveIntegerField(default=0)
+    rssi_count = models.PositiveIntegerField(default=0)
+    battery_count = models.PositiveIntegerField(default=0)
+    chan_util_count = models.PositiveIntegerField(default=0)
+    air_util_tx_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -293,7 +318,10 @@ class ListenerState(models.Model):
         ('ERROR', 'Error'),
         ('UNKNOWN', 'Unknown'), # Default fallback
     ]
+    # One row per gateway, in MESHTASTIC_GATEWAYS order; row 1 also holds the restart flag and the ingest counters.
     singleton_id = models.PositiveIntegerField(primary_key=True, default=1, editable=False)
+    gateway_name = models.CharField(max_length=64, null=True, blank=True, help_text="Name of the gateway this row describes.")
+    gateway_address = models.CharField(max_length=255, null=True, blank=True, help_text="host:port of the gateway's TCP interface.")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='UNKNOWN')
     last_error_message = models.TextField(null=True, blank=True)
     local_node_id = models.CharField(max_length=24, null=True, blank=True)
@@ -301,11 +329,47 @@ class ListenerState(models.Model):
     local_node_name = models.CharField(max_length=100, null=True, blank=True)
     local_node_channel_map_json = models.JSONField(null=True, blank=True, help_text="JSON representation of the channel map")
     restart_requested = models.BooleanField(default=False, help_text="Set to true to request a listener restart.") # Neuer Eintrag
+    ingest_shed_count = models.PositiveBigIntegerField(default=0, help_text="Records dropped under ingest overload since the listener started.")
+    ingest_coalesced_count = models.PositiveBigIntegerField(default=0, help_text="Records merged into a newer sample of the same node since the listener started.")
+    ingest_last_shed_at = models.DateTimeField(null=True, blank=True, help_text="When records were last dropped under ingest overload.")
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"Listener Status: {self.get_status_display()}"
+        return f"Listener Status ({self.gateway_name or self.singleton_id}): {self.get_status_display()}"
 
     class Meta:
         verbose_name = "Listener State"
-        verbose_name_plural = "Listener States"
\ No newline at end of file
+        verbose_name_plural = "Listener States"
+
+
+class RetentionState(models.Model):
+    """Progress of one retention policy (see metrastics_listener/retention.py)."""
+    policy = models.CharField(max_length=32, primary_key=True)
+    processed_until = models.FloatField(null=True, blank=True,
+                                        help_text="Unix time up to which the policy has thinned or aggregated rows.")
+    rows_deleted = models.PositiveBigIntegerField(default=0)
+    rows_aggregated = models.PositiveBigIntegerField(default=0, help_text="Rows written as aggregates of deleted rows.")
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Retention {self.policy}: {self.rows_deleted} rows deleted"
+
+    class Meta:
+        verbose_name = "Retention State"
+        verbose_name_plural = "Retention States"
+
+
+class StatCounter(models.Model):
+    """Row counts kept up to date by the ingest path and the retention policies (see metrastics_listener/counters.py)."""
+    key = models.CharField(max_length=100, primary_key=True,
+                           help_text="e.g. packets, packets.type.Message, packets.portnum.TEXT_MESSAGE_APP, nodes")
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.value}"
+
+    class Meta:
+        ordering = ['key']
+        verbose_name = "Stat Counter"
+        verbose_name_plural = "Stat Counters"
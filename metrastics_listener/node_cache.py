@@ -0,0 +1,218 @@
+# metrastics_listener/node_cache.py
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from django.db import transaction
+from django.utils import timezone as django_timezone
+
+from metrastics_listener import counters, events, node_names
+from metrastics_listener.models import Node
+
+logger = logging.getLogger(__name__)
+
+
+class NodeStateCache:
+    """
+    Warm, bounded in-memory copy of `Node` rows keyed by `node_id`.
+
+    The ingest path changes node attributes in memory and marks the touched fields dirty.
+    `flush()` writes the changed fields of all dirty nodes with one `bulk_update` per
+    distinct field set, so a node heard many times within a flush window costs one UPDATE.
+    Nodes are only created in the database right away, as packets reference them by foreign key.
+    Transactions that change nodes run inside `savepoint()`, which undoes their cache changes if
+    they roll back.
+    """
+
+    def __init__(self, max_size: int = 10000, flush_interval: float = 5.0):
+        self.max_size = max(1, int(max_size))
+        self.flush_interval = float(flush_interval)
+        self._nodes: "OrderedDict[str, Node]" = OrderedDict()
+        self._dirty: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+        self._last_flush = time.monotonic()
+        # While a savepoint is open: the nodes touched since, as they were before (None if not cached),
+        # and the dirty marks before it.
+        self._saved_nodes: Optional[Dict[str, Optional[Node]]] = None
+        self._saved_dirty: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.flushed_rows = 0
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def load(self) -> int:
+        """Warms the cache with the most recently heard nodes."""
+        with self._lock:
+            self._nodes.clear()
+            self._dirty.clear()
+            recent_nodes = list(Node.objects.order_by('-last_heard')[:self.max_size])
+            for node in reversed(recent_nodes): # Most recently heard nodes end up at the MRU end
+                self._nodes[node.node_id] = node
+        logger.info(f"Node cache loaded with {len(self._nodes)} nodes.")
+        return len(self._nodes)
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self._dirty.clear()
+
+    def get(self, node_id: str) -> Optional[Node]:
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is not None:
+                self._nodes.move_to_end(node_id)
+                self.hits += 1
+                if self._saved_nodes is not None and node_id not in self._saved_nodes:
+                    self._saved_nodes[node_id] = copy.copy(node)
+                return node
+            self.misses += 1
+            node = Node.objects.filter(node_id=node_id).first()
+            if node is not None:
+                self._insert(node)
+            return node
+
+    def get_or_create(self, node_id: str, defaults: Optional[dict] = None) -> Tuple[Node, bool]:
+        with self._lock:
+            node = self.get(node_id)
+            if node is not None:
+                return node, False
+            node, created = Node.objects.get_or_create(node_id=node_id, defaults=defaults or {})
+            self._insert(node)
+            return node, created
+
+    def update(self, node_id: str, values: dict, create_defaults: Optional[dict] = None) -> Tuple[Node, bool]:
+        """Applies `values` to the cached node (creating it if needed) and marks changed fields dirty."""
+        with self._lock:
+            node, created = self.get_or_create(node_id, defaults=create_defaults if create_defaults is not None else values)
+            if not created:
+                changed = [field for field, value in values.items() if getattr(node, field) != value]
+                for field in changed:
+                    setattr(node, field, values[field])
+                self.mark_dirty(node, changed)
+            return node, created
+
+    def mark_dirty(self, node: Node, fields: Iterable[str]):
+        fields = [field for field in fields if field != 'updated_at']
+        if not fields:
+            return
+        with self._lock:
+            self._dirty.setdefault(node.node_id, set()).update(fields)
+
+    @contextmanager
+    def savepoint(self):
+        """
+        Wraps a transaction that creates or changes nodes through the cache. If it raises, the nodes
+        it touched are put back as they were (nodes it created are evicted, as their rows are gone)
+        together with the dirty marks, so a retry of its records finds the cache as the database is.
+        """
+        with self._lock:
+            nested = self._saved_nodes is not None
+            if not nested:
+                self._saved_nodes = {}
+                self._saved_dirty = {node_id: set(fields) for node_id, fields in self._dirty.items()}
+        if nested:  # The outermost savepoint restores
+            yield
+            return
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                for node_id, node in self._saved_nodes.items():
+                    if node is None:
+                        self._nodes.pop(node_id, None)
+                    else:
+                        self._nodes[node_id] = node
+                self._dirty = self._saved_dirty
+            raise
+        finally:
+            with self._lock:
+                self._saved_nodes = None
+                self._saved_dirty = {}
+
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def flush_is_due(self) -> bool:
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush_if_due(self) -> int:
+        if not self.flush_is_due():
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """Writes all dirty fields to the database. Returns the number of updated nodes."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, {}
+            groups: Dict[frozenset, list] = {}
+            changes = []
+            now = django_timezone.now()
+            for node_id, fields in dirty.items():
+                node = self._nodes.get(node_id)
+                if node is None:
+                    continue
+                node.updated_at = now
+                groups.setdefault(frozenset(fields), []).append(node)
+                changes.append(events.node_change(node, fields))
+
+            try:
+                with transaction.atomic():
+                    for fields, nodes in groups.items():
+                        Node.objects.bulk_update(nodes, sorted(fields) + ['updated_at'], batch_size=500)
+                    node_names.names_changed(node.node_id for fields, nodes in groups.items()
+                                             if fields.intersection(node_names.NAME_FIELDS) for node in nodes)
+                    if groups:
+                        counters.bump_sequences(counters.NODES_CHANGED)
+                    if changes:
+                        transaction.on_commit(partial(events.publish, events.EVENT_NODES, {'nodes': changes}))
+            except Exception:
+                # Keep the changes around so the next flush retries them.
+                for node_id, fields in dirty.items():
+                    self._dirty.setdefault(node_id, set()).update(fields)
+                raise
+
+            updated = sum(len(nodes) for nodes in groups.values())
+            self.flushed_rows += updated
+            logger.debug(f"Node cache flushed {updated} nodes in {len(groups)} bulk updates.")
+            return updated
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._nodes),
+            'max_size': self.max_size,
+            'dirty': len(self._dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'flushed_rows': self.flushed_rows,
+        }
+
+    def _insert(self, node: Node):
+        if self._saved_nodes is not None:
+            self._saved_nodes.setdefault(node.node_id, None)
+        self._nodes[node.node_id] = node
+        self._nodes.move_to_end(node.node_id)
+        if len(self._nodes) <= self.max_size:
+            return
+        for node_id in list(self._nodes.keys()):
+            if len(self._nodes) <= self.max_size:
+                break
+            if node_id == node.node_id:
+                continue
+            if node_id in self._dirty:
+                continue
+            del self._nodes[node_id]
+        if len(self._nodes) > self.max_size:
+            # Everything left is dirty; write it out so the oldest entries can be evicted.
+            self.flush()
+            while len(self._nodes) > self.max_size:
+                self._nodes.popitem(last=False)
@@ -0,0 +1,159 @@
+# metrastics_listener/node_names.py
+"""
+Process-wide cache of node names for the dashboard APIs.
+
+The packet, message and traceroute lists show the long/short name of every node they mention.
+`NodeNameResolver.resolve()` answers a whole page of node ids from memory and loads the ids it
+does not know yet with one query, instead of one Node lookup (or join) per row.
+
+The names are written by the listener, which may run in another process than the dashboard.
+Whenever the node cache flushes a changed name it bumps the `nodes.name_changes` counter in the
+same transaction, and a new node bumps `nodes`; a resolver compares both counters with what it
+saw before (at most once per `check_interval` seconds, one primary-key query) and drops its
+entries when they moved. In the listener process itself the changed nodes are also dropped
+right after the commit. `ttl` bounds the age of entries changed behind the listener's back.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from metrastics import metrics
+from metrastics_listener import counters, message_search
+from metrastics_listener.models import Node, StatCounter
+
+logger = logging.getLogger(__name__)
+
+NAME_FIELDS = ('long_name', 'short_name')
+VERSION_KEYS = (counters.NODES, counters.NODE_NAME_CHANGES)
+
+RESOLVER_LOOKUPS = metrics.counter('metrastics_node_name_lookups_total',
+                                   'Node ids resolved to names, by cache result.', ['result'])
+_LOOKUP_HITS = RESOLVER_LOOKUPS.labels('hit')
+_LOOKUP_MISSES = RESOLVER_LOOKUPS.labels('miss')
+
+
+class NodeNameResolver:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, check_interval: float = 1.0):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.check_interval = float(check_interval)
+        # node_id -> (loaded at, {'long_name', 'short_name', 'node_id'} or None for unknown ids)
+        self._names: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, ...]] = None
+        self._checked_at = float('-inf')
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.invalidations = 0
+
+    def resolve(self, node_ids: Iterable[Optional[str]]) -> Dict[str, Optional[dict]]:
+        """
+        Name info of every given node id: a dict with long_name, short_name and node_id, or None
+        if there is no such node. Empty ids and '^all' are left out.
+        """
+        node_ids = {node_id for node_id in node_ids if node_id and node_id != '^all'}
+        if not node_ids:
+            return {}
+        self._check_version()
+        now = time.monotonic()
+        resolved: Dict[str, Optional[dict]] = {}
+        with self._lock:
+            for node_id in node_ids:
+                entry = self._names.get(node_id)
+                if entry is not None and now - entry[0] < self.ttl:
+                    self._names.move_to_end(node_id)
+                    resolved[node_id] = entry[1]
+        missing = node_ids - resolved.keys()
+        self.hits += len(resolved)
+        self.misses += len(missing)
+        _LOOKUP_HITS.inc(len(resolved))
+        _LOOKUP_MISSES.inc(len(missing))
+        if not missing:
+            return resolved
+
+        loaded = {node_id: None for node_id in missing}
+        for row in Node.objects.filter(node_id__in=missing).values('long_name', 'short_name', 'node_id'):
+            loaded[row['node_id']] = row
+        self.queries += 1
+        with self._lock:
+            for node_id, info in loaded.items():
+                self._names[node_id] = (now, info)
+                self._names.move_to_end(node_id)
+            while len(self._names) > self.max_size:
+                self._names.popitem(last=False)
+        resolved.update(loaded)
+        return resolved
+
+    def invalidate(self, node_ids: Optional[Iterable[str]] = None):
+        """Drops the given nodes, or every entry if `node_ids` is None."""
+        with self._lock:
+            if node_ids is None:
+                self._names.clear()
+            else:
+                for node_id in node_ids:
+                    self._names.pop(node_id, None)
+            self.invalidations += 1
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        stored = dict(StatCounter.objects.filter(key__in=VERSION_KEYS).values_list('key', 'value'))
+        version = tuple(stored.get(key, 0) for key in VERSION_KEYS)
+        if self._version is not None and version != self._version:
+            logger.debug(f"Node names changed ({self._version} -> {version}), dropping cached names.")
+            self.invalidate()
+        self._version = version
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._names),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'queries': self.queries,
+            'invalidations': self.invalidations,
+        }
+
+
+def display_name(info: Optional[dict], fallback: Optional[str]) -> Optional[str]:
+    """The name lists show for a node: its long name if the node is known, else the id string."""
+    return info['long_name'] if info else fallback
+
+
+def names_changed(node_ids: Iterable[str]):
+    """
+    Records that the names of `node_ids` changed. Call it inside the transaction that writes the
+    names: other processes see the bumped counter after the commit, this process forgets the
+    nodes right away once the transaction committed. The nodes' messages are re-indexed for search.
+    """
+    node_ids = list(node_ids)
+    if not node_ids:
+        return
+    counters.apply_counter_deltas({counters.NODE_NAME_CHANGES: 1})
+    message_search.reindex_nodes(node_ids)
+    transaction.on_commit(lambda: get_node_name_resolver().invalidate(node_ids))
+
+
+_node_name_resolver: Optional[NodeNameResolver] = None
+_resolver_lock = threading.Lock()
+
+
+def get_node_name_resolver() -> NodeNameResolver:
+    global _node_name_resolver
+    if _node_name_resolver is None:
+        with _resolver_lock:
+            if _node_name_resolver is None:
+                _node_name_resolver = NodeNameResolver(
+                    max_size=getattr(settings, 'NODE_NAME_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'NODE_NAME_CACHE_TTL', 300),
+                    check_interval=getattr(settings, 'NODE_NAME_CHECK_INTERVAL', 1.0),
+                )
+    return _node_name_resolver
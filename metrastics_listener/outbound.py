@@ -0,0 +1,279 @@
+# metrastics_listener/outbound.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from metrastics import metrics
+
+logger = logging.getLogger(__name__)
+
+SEND_LATENCY_SECONDS = metrics.histogram('metrastics_outbound_send_latency_seconds',
+                                         'Time from queueing an outbound message until its last part was sent.',
+                                         ['priority'])
+SENT_PARTS = metrics.counter('metrastics_outbound_sent_parts_total', 'Outbound text parts handed to the radio.')
+SEND_FAILURES = metrics.counter('metrastics_outbound_send_failures_total',
+                                'Failed outbound sends, by whether the message was retried or given up.', ['result'])
+
+PRIORITY_INTERACTIVE = 0  # Commander replies and messages from the dashboard
+PRIORITY_BULK = 1         # Everything that can wait
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+# LoRa header, preamble and Meshtastic packet header, expressed in payload bytes.
+PACKET_OVERHEAD_BYTES = 32
+
+
+def split_text(text: str, max_part_bytes: int = 200, max_parts: int = 5) -> List[str]:
+    """
+    Splits a text into parts of at most `max_part_bytes` UTF-8 bytes, preferably at whitespace.
+    Multiple parts are numbered ("1/3 ..."). Text beyond `max_parts` parts is cut off with "...".
+    """
+    text = text.strip()
+    if len(text.encode('utf-8')) <= max_part_bytes:
+        return [text]
+
+    # Reserve room for the "n/m " prefix.
+    prefix_bytes = len(f"{max_parts}/{max_parts} ")
+    limit = max_part_bytes - prefix_bytes
+    parts = []
+    remaining = text
+    while remaining:
+        if len(parts) == max_parts - 1 and len(remaining.encode('utf-8')) > limit:
+            # Last allowed part: truncate instead of splitting further.
+            cut = _cut_at_bytes(remaining, limit - 3)
+            parts.append(remaining[:cut].rstrip() + "...")
+            break
+        if len(remaining.encode('utf-8')) <= limit:
+            parts.append(remaining)
+            break
+        cut = _cut_at_bytes(remaining, limit)
+        space = remaining.rfind(' ', 0, cut + 1)
+        if space > cut // 2:
+            cut = space
+        parts.append(remaining[:cut].rstrip())
+        remaining = remaining[cut:].lstrip()
+    return [f"{index}/{len(parts)} {part}" for index, part in enumerate(parts, start=1)]
+
+
+def _cut_at_bytes(text: str, max_bytes: int) -> int:
+    """Returns the number of characters of `text` that fit into `max_bytes` UTF-8 bytes."""
+    encoded = text.encode('utf-8')[:max_bytes]
+    return max(1, len(encoded.decode('utf-8', errors='ignore')))
+
+
+class OutboundMessage:
+    __slots__ = ('text_parts', 'destination_id', 'channel_index', 'want_ack', 'priority', 'enqueued_at', 'next_part',
+                 'attempts')
+
+    def __init__(self, text_parts: List[str], destination_id: str, channel_index: Optional[int], want_ack: bool,
+                 priority: int):
+        self.text_parts = text_parts
+        self.destination_id = destination_id
+        self.channel_index = channel_index
+        self.want_ack = want_ack
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.next_part = 0
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """
+    Sends text messages through the Meshtastic interface from a single sender thread.
+
+    Messages wait in one FIFO lane per priority; interactive messages always go before bulk
+    ones. Sends are paced by an airtime token bucket that refills at `duty_cycle_percent` of
+    real time (at most `duty_cycle_window` seconds worth of budget), plus a minimum gap between
+    packets. Long texts are split into numbered parts that are sent back to back. Failed sends
+    are retried with exponential backoff.
+    """
+
+    def __init__(self, send_callback: Callable[[str, str, Optional[int], bool], None],
+                 duty_cycle_percent: float = 10.0, duty_cycle_window: float = 600.0, bitrate_bps: float = 1070.0,
+                 min_interval: float = 1.0, max_part_bytes: int = 200, max_parts: int = 5, max_retries: int = 3,
+                 retry_backoff: float = 2.0, max_queue_size: int = 200, name: str = 'outbound-sender'):
+        self.send_callback = send_callback
+        self.duty_cycle = max(0.001, float(duty_cycle_percent) / 100.0)
+        self.budget_capacity = self.duty_cycle * float(duty_cycle_window)
+        self.bitrate_bps = float(bitrate_bps)
+        self.min_interval = float(min_interval)
+        self.max_part_bytes = int(max_part_bytes)
+        self.max_parts = max(1, int(max_parts))
+        self.max_retries = int(max_retries)
+        self.retry_backoff = float(retry_backoff)
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.name = name
+
+        self._lanes = {priority: deque() for priority in PRIORITY_NAMES}
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._budget = self.budget_capacity
+        self._budget_updated = time.monotonic()
+        self._last_send = 0.0
+
+        self.enqueued_count = 0
+        self.dropped_count = 0
+        self.sent_messages = 0
+        self.sent_parts = 0
+        self.failed_count = 0
+        self.retry_count = 0
+        self.airtime_seconds = 0.0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def estimate_airtime(self, text: str) -> float:
+        return (len(text.encode('utf-8')) + PACKET_OVERHEAD_BYTES) * 8 / self.bitrate_bps
+
+    def start(self):
+        if self.is_running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"Outbound scheduler started (duty cycle {self.duty_cycle * 100:.1f}%, "
+                    f"{self.bitrate_bps:.0f} bit/s, max {self.max_part_bytes} bytes per part).")
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        if not self._thread:
+            return
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        pending = self.queue_depth()
+        if pending:
+            logger.warning(f"Outbound scheduler stopped with {pending} unsent messages.")
+        self._thread = None
+
+    def enqueue(self, text: str, destination_id: str, channel_index: Optional[int] = None, want_ack: bool = True,
+                priority: int = PRIORITY_INTERACTIVE) -> bool:
+        """Queues a text message. Returns False if it was rejected because the queue is full."""
+        if priority not in self._lanes:
+            priority = PRIORITY_BULK
+        parts = split_text(text, self.max_part_bytes, self.max_parts)
+        message = OutboundMessage(parts, destination_id, channel_index, want_ack, priority)
+        with self._condition:
+            if self.queue_depth() >= self.max_queue_size:
+                self.dropped_count += 1
+                logger.warning(f"Outbound queue full ({self.max_queue_size} messages), dropping message to "
+                               f"{destination_id}. Dropped so far: {self.dropped_count}")
+                return False
+            self._lanes[priority].append(message)
+            self.enqueued_count += 1
+            self._condition.notify()
+        return True
+
+    def queue_depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values()) + len(self._delayed)
+
+    def stats(self) -> dict:
+        with self._condition:
+            self._refill(time.monotonic())
+            return {
+                'queue_depth': self.queue_depth(),
+                'lanes': {PRIORITY_NAMES[priority]: len(lane) for priority, lane in self._lanes.items()},
+                'waiting_for_retry': len(self._delayed),
+                'enqueued': self.enqueued_count,
+                'dropped': self.dropped_count,
+                'sent_messages': self.sent_messages,
+                'sent_parts': self.sent_parts,
+                'retries': self.retry_count,
+                'failed': self.failed_count,
+                'airtime_seconds': round(self.airtime_seconds, 2),
+                'airtime_budget_seconds': round(self._budget, 2),
+                'avg_latency_ms': round(self._latency_total / self.sent_messages * 1000, 1) if self.sent_messages else 0.0,
+                'max_latency_ms': round(self._latency_max * 1000, 1),
+            }
+
+    def _refill(self, now: float):
+        self._budget = min(self.budget_capacity, self._budget + (now - self._budget_updated) * self.duty_cycle)
+        self._budget_updated = now
+
+    def _next_message(self, now: float) -> Optional[OutboundMessage]:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, message = heapq.heappop(self._delayed)
+            # Retried messages go back to the front of their lane.
+            self._lanes[message.priority].appendleft(message)
+        for priority in sorted(self._lanes):
+            if self._lanes[priority]:
+                return self._lanes[priority][0]
+        return None
+
+    def _wait_time(self, message: Optional[OutboundMessage], now: float) -> Optional[float]:
+        """Seconds until `message` may be sent; None means wait until something is enqueued."""
+        if message is None:
+            return max(0.0, self._delayed[0][0] - now) if self._delayed else None
+        wait = max(0.0, self._last_send + self.min_interval - now)
+        airtime = min(self.estimate_airtime(message.text_parts[message.next_part]), self.budget_capacity)
+        if airtime > self._budget:
+            wait = max(wait, (airtime - self._budget) / self.duty_cycle)
+        return wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._running:
+                        return
+                    now = time.monotonic()
+                    self._refill(now)
+                    message = self._next_message(now)
+                    wait = self._wait_time(message, now)
+                    if wait == 0.0 and message is not None:
+                        self._lanes[message.priority].popleft()
+                        break
+                    self._condition.wait(wait)
+            self._send_part(message)
+
+    def _send_part(self, message: OutboundMessage):
+        text = message.text_parts[message.next_part]
+        airtime = self.estimate_airtime(text)
+        try:
+            self.send_callback(text, message.destination_id, message.channel_index, message.want_ack)
+        except Exception as e:
+            with self._condition:
+                self._last_send = time.monotonic()
+                message.attempts += 1
+                if message.attempts > self.max_retries:
+                    self.failed_count += 1
+                    SEND_FAILURES.labels('given_up').inc()
+                    logger.error(f"Giving up on message to {message.destination_id} after {message.attempts} "
+                                 f"attempts: {e}")
+                    return
+                self.retry_count += 1
+                SEND_FAILURES.labels('retried').inc()
+                delay = self.retry_backoff * (2 ** (message.attempts - 1))
+                logger.warning(f"Sending to {message.destination_id} failed ({e}), retrying in {delay:.1f}s.")
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), message))
+            return
+
+        with self._condition:
+            now = time.monotonic()
+            self._last_send = now
+            self._budget -= min(airtime, self.budget_capacity)
+            self.airtime_seconds += airtime
+            self.sent_parts += 1
+            SENT_PARTS.inc()
+            message.attempts = 0
+            message.next_part += 1
+            if message.next_part < len(message.text_parts):
+                # Keep the parts of a message together.
+                self._lanes[message.priority].appendleft(message)
+                return
+            self.sent_messages += 1
+            latency = now - message.enqueued_at
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+        SEND_LATENCY_SECONDS.labels(PRIORITY_NAMES[message.priority]).observe(latency)
+        logger.info(f"Outbound message to {message.destination_id} sent in {len(message.text_parts)} part(s), "
+                    f"{latency:.2f}s after it was queued.")
@@ -0,0 +1,168 @@
+# metrastics_listener/packet_fixtures.py
+"""
+Realistic Meshtastic packets for tests and benchmarks.
+
+The packets are built from real protobufs and shaped exactly like the dictionaries the
+meshtastic library publishes on "meshtastic.receive" (MessageToDict output, raw payload
+bytes in decoded.payload and the parsed protobufs under the "raw" keys).
+"""
+import itertools
+import random
+
+import google.protobuf.json_format
+from meshtastic import protocols
+from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+
+BROADCAST_NUM = 0xFFFFFFFF
+
+_packet_ids = itertools.count(0x10000000)
+
+
+def mesh_packet_to_dict(mesh_packet: mesh_pb2.MeshPacket) -> dict:
+    """Mirrors MeshInterface._handlePacketFromRadio of the meshtastic library."""
+    as_dict = google.protobuf.json_format.MessageToDict(mesh_packet)
+    as_dict["raw"] = mesh_packet
+    as_dict.setdefault("to", 0)
+    if "decoded" in as_dict:
+        decoded = as_dict["decoded"]
+        decoded["payload"] = mesh_packet.decoded.payload
+        decoded.setdefault("portnum", portnums_pb2.PortNum.Name(portnums_pb2.PortNum.UNKNOWN_APP))
+        handler = protocols.get(mesh_packet.decoded.portnum)
+        if handler is not None and handler.protobufFactory is not None:
+            pb = handler.protobufFactory()
+            pb.ParseFromString(mesh_packet.decoded.payload)
+            decoded[handler.name] = google.protobuf.json_format.MessageToDict(pb)
+            decoded[handler.name]["raw"] = pb
+    return as_dict
+
+
+def _mesh_packet(from_num: int, to_num: int = BROADCAST_NUM, packet_id: int = None, **kwargs) -> mesh_pb2.MeshPacket:
+    mesh_packet = mesh_pb2.MeshPacket(
+        to=to_num,
+        id=packet_id if packet_id is not None else next(_packet_ids),
+        rx_time=kwargs.pop('rx_time', 1700000000),
+        rx_snr=kwargs.pop('rx_snr', 6.25),
+        rx_rssi=kwargs.pop('rx_rssi', -87),
+        hop_limit=kwargs.pop('hop_limit', 3),
+        hop_start=3,
+        channel=kwargs.pop('channel', 0),
+        **kwargs
+    )
+    setattr(mesh_packet, 'from', from_num)
+    return mesh_packet
+
+
+def text_packet(from_num: int = 0x11223344, text: str = "Hallo aus dem Mesh!", to_num: int = BROADCAST_NUM, **kwargs) -> dict:
+    mesh_packet = _mesh_packet(from_num, to_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.TEXT_MESSAGE_APP
+    mesh_packet.decoded.payload = text.encode('utf-8')
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def position_packet(from_num: int = 0x11223344, **kwargs) -> dict:
+    position = mesh_pb2.Position(latitude_i=525200066, longitude_i=134049540, altitude=34, time=1699999990,
+                                 location_source=mesh_pb2.Position.LOC_INTERNAL, precision_bits=32,
+                                 ground_speed=1, ground_track=270, sats_in_view=9, PDOP=150)
+    mesh_packet = _mesh_packet(from_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.POSITION_APP
+    mesh_packet.decoded.payload = position.SerializeToString()
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def telemetry_packet(from_num: int = 0x11223344, **kwargs) -> dict:
+    telemetry = telemetry_pb2.Telemetry(
+        time=1699999995,
+        device_metrics=telemetry_pb2.DeviceMetrics(battery_level=87, voltage=4.012, channel_utilization=12.5,
+                                                   air_util_tx=1.75, uptime_seconds=86400))
+    mesh_packet = _mesh_packet(from_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    mesh_packet.decoded.payload = telemetry.SerializeToString()
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def environment_packet(from_num: int = 0x11223344, **kwargs) -> dict:
+    telemetry = telemetry_pb2.Telemetry(
+        time=1699999996,
+        environment_metrics=telemetry_pb2.EnvironmentMetrics(temperature=21.5, relative_humidity=48.0,
+                                                             barometric_pressure=1013.2, gas_resistance=120.0))
+    mesh_packet = _mesh_packet(from_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    mesh_packet.decoded.payload = telemetry.SerializeToString()
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def nodeinfo_packet(from_num: int = 0x11223344, long_name: str = "Berlin Mitte Router", short_name: str = "BMR",
+                    **kwargs) -> dict:
+    user = mesh_pb2.User(id=f"!{from_num:08x}", long_name=long_name, short_name=short_name,
+                         macaddr=bytes.fromhex('a1b2c3d4e5f6'), hw_model=mesh_pb2.HardwareModel.HELTEC_V3,
+                         role=2, public_key=bytes(range(32)))
+    mesh_packet = _mesh_packet(from_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.NODEINFO_APP
+    mesh_packet.decoded.payload = user.SerializeToString()
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def routing_packet(from_num: int = 0x11223344, to_num: int = 0x55667788, **kwargs) -> dict:
+    routing = mesh_pb2.Routing(error_reason=mesh_pb2.Routing.NONE)
+    mesh_packet = _mesh_packet(from_num, to_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.ROUTING_APP
+    mesh_packet.decoded.payload = routing.SerializeToString()
+    mesh_packet.decoded.request_id = 0x0badcafe
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def traceroute_packet(from_num: int = 0x11223344, to_num: int = 0x55667788, **kwargs) -> dict:
+    route = mesh_pb2.RouteDiscovery(route=[0x0a0a0a0a, 0x0b0b0b0b], snr_towards=[24, 12, -8],
+                                    route_back=[0x0b0b0b0b], snr_back=[16, 4])
+    mesh_packet = _mesh_packet(from_num, to_num, **kwargs)
+    mesh_packet.decoded.portnum = portnums_pb2.TRACEROUTE_APP
+    mesh_packet.decoded.payload = route.SerializeToString()
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def encrypted_packet(from_num: int = 0x11223344, **kwargs) -> dict:
+    mesh_packet = _mesh_packet(from_num, encrypted=bytes(random.Random(from_num).getrandbits(8) for _ in range(48)),
+                               **kwargs)
+    return mesh_packet_to_dict(mesh_packet)
+
+
+def node_update(node_num: int = 0x11223344) -> dict:
+    """A node entry as published on "meshtastic.node.updated"."""
+    user = mesh_pb2.User(id=f"!{node_num:08x}", long_name="Berlin Mitte Router", short_name="BMR",
+                         macaddr=bytes.fromhex('a1b2c3d4e5f6'), hw_model=mesh_pb2.HardwareModel.HELTEC_V3, role=2)
+    node_info = mesh_pb2.NodeInfo(num=node_num, user=user, snr=7.5, last_heard=1700000000,
+                                  device_metrics=telemetry_pb2.DeviceMetrics(battery_level=90, voltage=4.1))
+    as_dict = google.protobuf.json_format.MessageToDict(node_info)
+    as_dict['user']['raw'] = user
+    return as_dict
+
+
+PACKET_BUILDERS = {
+    'text': text_packet,
+    'position': position_packet,
+    'telemetry': telemetry_packet,
+    'environment': environment_packet,
+    'nodeinfo': nodeinfo_packet,
+    'routing': routing_packet,
+    'traceroute': traceroute_packet,
+    'encrypted': encrypted_packet,
+}
+
+# Rough share of each packet kind on a busy public mesh.
+TRAFFIC_MIX = {
+    'telemetry': 30, 'position': 25, 'nodeinfo': 12, 'routing': 10, 'encrypted': 10,
+    'text': 7, 'environment': 4, 'traceroute': 2,
+}
+
+
+def packet_mix(count: int = 200, node_count: int = 40, seed: int = 42) -> list:
+    """Returns `count` packets from `node_count` senders following TRAFFIC_MIX."""
+    rng = random.Random(seed)
+    kinds = rng.choices(list(TRAFFIC_MIX), weights=list(TRAFFIC_MIX.values()), k=count)
+    node_nums = [0x10000000 + rng.randrange(0xEFFFFFFF) for _ in range(node_count)]
+    packets = []
+    for i, kind in enumerate(kinds):
+        packets.append(PACKET_BUILDERS[kind](
+            from_num=rng.choice(node_nums), rx_time=1700000000 + i, rx_snr=round(rng.uniform(-15, 10), 2),
+            rx_rssi=rng.randrange(-125, -60)))
+    return packets
@@ -0,0 +1,309 @@
+# metrastics_listener/retention.py
+"""
+Retention of the high-volume tables.
+
+- packets: Packet rows older than RETENTION_PACKET_DAYS are deleted (with their traceroutes).
+  Message packets are kept for their Message row, but lose their raw and decoded JSON.
+- telemetry: Telemetry older than RETENTION_TELEMETRY_DAYS is reduced to one row per node and
+  RETENTION_TELEMETRY_BUCKET seconds (hourly means).
+- positions: Positions older than RETENTION_POSITION_DAYS are thinned to the newest position per
+  node and RETENTION_POSITION_BUCKET seconds.
+
+All work is done in short transactions of at most RETENTION_CHUNK_SIZE deleted rows, walking the
+tables in key order (packets by primary key, telemetry and positions by time window), with a
+pause between chunks so the ingest writer gets the write lock in between. The telemetry and
+position policies remember how far they got in RetentionState; a run that hits its time budget
+continues there next time.
+"""
+import logging
+import math
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone as django_timezone
+
+from metrastics import metrics
+from metrastics.database import retry_on_lock
+from metrastics_listener import counters
+from metrastics_listener.models import Packet, Position, RetentionState, Telemetry, Traceroute
+
+logger = logging.getLogger(__name__)
+
+POLICY_PACKETS = 'packets'
+POLICY_TELEMETRY = 'telemetry'
+POLICY_POSITIONS = 'positions'
+
+DAY = 86400.0
+# Time window read per step of the telemetry and position policies (rounded to whole buckets).
+WINDOW_SECONDS = 3600.0
+
+TELEMETRY_MEAN_FIELDS = ['battery_level', 'voltage', 'channel_utilization', 'air_util_tx', 'temperature',
+                         'relative_humidity', 'barometric_pressure', 'gas_resistance', 'iaq']
+TELEMETRY_INTEGER_FIELDS = {'battery_level'}
+TELEMETRY_LAST_FIELDS = ['uptime_seconds']  # A mean uptime is meaningless; the bucket keeps the latest one.
+
+ROWS_DELETED = metrics.counter('metrastics_retention_rows_deleted_total',
+                               'Rows deleted by the retention policies.', ['policy'])
+RUN_SECONDS = metrics.histogram('metrastics_retention_run_seconds', 'Duration of a retention run per policy.',
+                                ['policy'])
+
+
+def _bucket_start(timestamp: float, bucket: float) -> float:
+    return math.floor(timestamp / bucket) * bucket
+
+
+def _mean(values: list) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def telemetry_aggregate(rows: List[dict]) -> dict:
+    """Field values of the row that replaces `rows` (one node and bucket, oldest first)."""
+    values = {}
+    for field in TELEMETRY_MEAN_FIELDS:
+        mean = _mean([row[field] for row in rows])
+        values[field] = round(mean) if mean is not None and field in TELEMETRY_INTEGER_FIELDS else mean
+    for field in TELEMETRY_LAST_FIELDS:
+        values[field] = next((row[field] for row in reversed(rows) if row[field] is not None), None)
+    return values
+
+
+class RetentionManager:
+    def __init__(self, packet_days: float = 30, keep_packet_types: Sequence[str] = ('Message',),
+                 telemetry_days: float = 7, telemetry_bucket: float = 3600, position_days: float = 7,
+                 position_bucket: float = 600, chunk_size: int = 500, chunk_pause: float = 0.05):
+        """A policy whose days are 0 is disabled."""
+        self.packet_days = float(packet_days)
+        self.keep_packet_types = list(keep_packet_types)
+        self.telemetry_days = float(telemetry_days)
+        self.telemetry_bucket = max(1.0, float(telemetry_bucket))
+        self.position_days = float(position_days)
+        self.position_bucket = max(1.0, float(position_bucket))
+        self.chunk_size = max(1, int(chunk_size))
+        self.chunk_pause = max(0.0, float(chunk_pause))
+        self.runs = 0
+        self.last_run: Dict[str, dict] = {}
+
+    def run(self, now: Optional[float] = None, max_seconds: Optional[float] = None) -> Dict[str, dict]:
+        """
+        Applies all enabled policies. Returns per policy the rows deleted and aggregated and whether
+        the policy caught up ('done') before the `max_seconds` budget of the run was used up.
+        """
+        now = time.time() if now is None else now
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        policies = [
+            (POLICY_PACKETS, self.packet_days, self.purge_packets),
+            (POLICY_TELEMETRY, self.telemetry_days, self.downsample_telemetry),
+            (POLICY_POSITIONS, self.position_days, self.thin_positions),
+        ]
+        results = {}
+        for policy, days, function in policies:
+            if days <= 0:
+                continue
+            with RUN_SECONDS.labels(policy).time():
+                results[policy] = function(now - days * DAY, deadline)
+            if results[policy]['deleted'] or results[policy]['aggregated']:
+                logger.info(f"Retention {policy}: {results[policy]}")
+        self.runs += 1
+        self.last_run = results
+        return results
+
+    def stats(self) -> dict:
+        return {'runs': self.runs, 'last_run': self.last_run}
+
+    # Helpers
+
+    def _expired(self, deadline: Optional[float]) -> bool:
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _write_chunk(self, policy: str, function, *args):
+        """Runs one chunk transaction, retried if the database is locked, then yields the write lock."""
+        result = retry_on_lock(function, *args, operation=f'retention_{policy}')
+        if self.chunk_pause:
+            time.sleep(self.chunk_pause)
+        return result
+
+    def _record_progress(self, policy: str, deleted: int = 0, aggregated: int = 0,
+                         processed_until: Optional[float] = None):
+        """Updates the policy's RetentionState row; called inside the chunk transactions."""
+        if deleted:
+            ROWS_DELETED.labels(policy).inc(deleted)
+        RetentionState.objects.get_or_create(policy=policy)
+        updates = {'rows_deleted': F('rows_deleted') + deleted, 'rows_aggregated': F('rows_aggregated') + aggregated,
+                   'last_run_at': django_timezone.now()}
+        if processed_until is not None:
+            updates['processed_until'] = processed_until
+        RetentionState.objects.filter(policy=policy).update(**updates)
+
+    # Packets
+
+    def purge_packets(self, cutoff: float, deadline: Optional[float] = None) -> dict:
+        result = {'deleted': 0, 'aggregated': 0, 'stripped': 0, 'done': False}
+        old_packets = Packet.objects.filter(timestamp__lt=cutoff)
+        chunks = [
+            (old_packets.exclude(packet_type__in=self.keep_packet_types), self._delete_packets, 'deleted'),
+            (old_packets.filter(packet_type__in=self.keep_packet_types, raw_json__isnull=False),
+             self._strip_packets, 'stripped'),
+        ]
+        for queryset, function, counter in chunks:
+            last_pk = 0
+            while True:
+                if self._expired(deadline):
+                    return result
+                pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:self.chunk_size])
+                if not pks:
+                    break
+                last_pk = pks[-1]
+                result[counter] += self._write_chunk(POLICY_PACKETS, function, pks)
+        result['done'] = True
+        return result
+
+    def _delete_packets(self, pks: list) -> int:
+        with transaction.atomic():
+            packets = Packet.objects.filter(pk__in=pks)
+            counter_deltas = Counter()
+            counters.count_packets(counter_deltas, packets.values_list('packet_type', 'portnum', 'channel'), sign=-1)
+            # Cascades to the packets' traceroutes.
+            _, deleted_per_model = packets.delete()
+            deleted = deleted_per_model.get(Packet._meta.label, 0)
+            counter_deltas[counters.TRACEROUTES] -= deleted_per_model.get(Traceroute._meta.label, 0)
+            counter_deltas[counters.PACKETS_CHANGED] += 1
+            if counter_deltas[counters.TRACEROUTES]:
+                counter_deltas[counters.TRACEROUTES_CHANGED] += 1
+            counters.apply_counter_deltas(counter_deltas)
+            self._record_progress(POLICY_PACKETS, deleted=deleted)
+        return deleted
+
+    def _strip_packets(self, pks: list) -> int:
+        with transaction.atomic():
+            counters.bump_sequences(counters.PACKETS_CHANGED)
+            return Packet.objects.filter(pk__in=pks).update(raw_json=None, decoded_json=None)
+
+    # Telemetry and positions
+
+    def _walk_windows(self, policy: str, model, bucket: float, cutoff: float, deadline: Optional[float],
+                      compact_window) -> dict:
+        """
+        Walks complete buckets older than `cutoff` from where the policy stopped last time, one
+        time window at a time. `compact_window(start, end)` returns the (deleted, aggregated)
+        counts of one window.
+        """
+        result = {'deleted': 0, 'aggregated': 0, 'done': False}
+        state = RetentionState.objects.filter(policy=policy).first()
+        start = state.processed_until if state is not None else None
+        if start is None:
+            start = model.objects.filter(timestamp__lt=cutoff).aggregate(oldest=Min('timestamp'))['oldest']
+            if start is None:
+                result['done'] = True
+                return result
+        start = _bucket_start(start, bucket)
+        end_limit = _bucket_start(cutoff, bucket)
+        window = max(1, int(WINDOW_SECONDS // bucket)) * bucket
+
+        processed_until = None
+        while start < end_limit:
+            if self._expired(deadline):
+                break
+            end = min(start + window, end_limit)
+            deleted, aggregated = compact_window(start, end)
+            result['deleted'] += deleted
+            result['aggregated'] += aggregated
+            processed_until = start = end
+        else:
+            result['done'] = True
+        if processed_until is not None:
+            retry_on_lock(self._save_watermark, policy, processed_until, operation=f'retention_{policy}')
+        return result
+
+    def _save_watermark(self, policy: str, processed_until: float):
+        with transaction.atomic():
+            self._record_progress(policy, processed_until=processed_until)
+
+    def _buckets(self, model, fields: list, bucket: float, start: float, end: float) -> List[List[dict]]:
+        """Rows of the window grouped by node and bucket, oldest first; only groups with more than one row."""
+        rows = model.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by(
+            'node_id', 'timestamp', 'pk').values('pk', 'node_id', 'timestamp', *fields)
+        groups: Dict[tuple, List[dict]] = {}
+        for row in rows:
+            groups.setdefault((row['node_id'], _bucket_start(row['timestamp'], bucket)), []).append(row)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def _chunked(self, groups: List[List[dict]]):
+        """Packs whole groups into chunks of about chunk_size deleted rows."""
+        chunk, chunk_rows = [], 0
+        for group in groups:
+            if chunk and chunk_rows + len(group) - 1 > self.chunk_size:
+                yield chunk
+                chunk, chunk_rows = [], 0
+            chunk.append(group)
+            chunk_rows += len(group) - 1
+        if chunk:
+            yield chunk
+
+    def downsample_telemetry(self, cutoff: float, deadline: Optional[float] = None) -> dict:
+        return self._walk_windows(POLICY_TELEMETRY, Telemetry, self.telemetry_bucket, cutoff, deadline,
+                                  self._downsample_telemetry_window)
+
+    def _downsample_telemetry_window(self, start: float, end: float):
+        groups = self._buckets(Telemetry, TELEMETRY_MEAN_FIELDS + TELEMETRY_LAST_FIELDS, self.telemetry_bucket,
+                               start, end)
+        deleted = aggregated = 0
+        for chunk in self._chunked(groups):
+            chunk_deleted, chunk_aggregated = self._write_chunk(POLICY_TELEMETRY, self._replace_telemetry, chunk)
+            deleted += chunk_deleted
+            aggregated += chunk_aggregated
+        return deleted, aggregated
+
+    def _replace_telemetry(self, groups: List[List[dict]]):
+        """The oldest row of every group becomes the bucket's mean; the others are deleted."""
+        with transaction.atomic():
+            delete_pks = []
+            for rows in groups:
+                values = telemetry_aggregate(rows)
+                values['timestamp'] = _bucket_start(rows[0]['timestamp'], self.telemetry_bucket)
+                Telemetry.objects.filter(pk=rows[0]['pk']).update(**values)
+                delete_pks.extend(row['pk'] for row in rows[1:])
+            deleted, _ = Telemetry.objects.filter(pk__in=delete_pks).delete()
+            self._record_progress(POLICY_TELEMETRY, deleted=deleted, aggregated=len(groups))
+        return deleted, len(groups)
+
+    def thin_positions(self, cutoff: float, deadline: Optional[float] = None) -> dict:
+        return self._walk_windows(POLICY_POSITIONS, Position, self.position_bucket, cutoff, deadline,
+                                  self._thin_positions_window)
+
+    def _thin_positions_window(self, start: float, end: float):
+        groups = self._buckets(Position, [], self.position_bucket, start, end)
+        deleted = 0
+        for chunk in self._chunked(groups):
+            # The newest position of every node and bucket stays.
+            delete_pks = [row['pk'] for rows in chunk for row in rows[:-1]]
+            deleted += self._write_chunk(POLICY_POSITIONS, self._delete_positions, delete_pks)
+        return deleted, 0
+
+    def _delete_positions(self, pks: list) -> int:
+        with transaction.atomic():
+            deleted, _ = Position.objects.filter(pk__in=pks).delete()
+            self._record_progress(POLICY_POSITIONS, deleted=deleted)
+        return deleted
+
+
+_retention_manager: Optional[RetentionManager] = None
+
+
+def get_retention_manager() -> RetentionManager:
+    global _retention_manager
+    if _retention_manager is None:
+        _retention_manager = RetentionManager(
+            packet_days=getattr(settings, 'RETENTION_PACKET_DAYS', 30),
+            telemetry_days=getattr(settings, 'RETENTION_TELEMETRY_DAYS', 7),
+            telemetry_bucket=getattr(settings, 'RETENTION_TELEMETRY_BUCKET', 3600),
+            position_days=getattr(settings, 'RETENTION_POSITION_DAYS', 7),
+            position_bucket=getattr(settings, 'RETENTION_POSITION_BUCKET', 600),
+            chunk_size=getattr(settings, 'RETENTION_CHUNK_SIZE', 500),
+            chunk_pause=getattr(settings, 'RETENTION_CHUNK_PAUSE', 0.05),
+        )
+    return _retention_manager
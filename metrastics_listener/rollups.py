@@ -0,0 +1,179 @@
+# metrastics_listener/rollups.py
+"""
+Fixed-interval rollups of the network metrics into AverageMetricsHistory.
+
+Every ROLLUP_BUCKET_SECONDS bucket is computed once, from the packets and telemetry received in
+it, after it has been complete for ROLLUP_DELAY seconds (so late batches of the ingest writer are
+included). Next to the averages every row stores how many samples each average is made of; the
+dashboard combines any number of buckets into exact weighted averages, so its queries scale with
+the length of the window, not with the number of packets, and still work after the retention
+policies deleted the raw rows.
+"""
+import logging
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, Max, Min, Q, Sum
+
+from metrastics import metrics
+from metrastics.database import retry_on_lock
+from metrastics_listener.models import AverageMetricsHistory, Node, Packet, Telemetry
+
+logger = logging.getLogger(__name__)
+
+# (average field, sample count field) of AverageMetricsHistory
+AVERAGE_FIELDS = [
+    ('average_snr', 'snr_count'),
+    ('average_rssi', 'rssi_count'),
+    ('average_battery', 'battery_count'),
+    ('average_chan_util', 'chan_util_count'),
+    ('average_air_util_tx', 'air_util_tx_count'),
+]
+BATTERY_MAX = 100  # 101 means externally powered, 255 unknown
+
+ROLLUP_BUCKETS = metrics.counter('metrastics_rollup_buckets_total', 'Metric buckets written to AverageMetricsHistory.')
+
+
+def _bucket_start(timestamp: float, bucket: float) -> float:
+    return math.floor(timestamp / bucket) * bucket
+
+
+class MetricsRollup:
+    def __init__(self, bucket_seconds: float = 300, delay: float = 60, backfill_days: float = 30,
+                 max_buckets: int = 288):
+        """`max_buckets` limits the buckets computed per run, so a long backfill is spread over several runs."""
+        self.bucket_seconds = max(1.0, float(bucket_seconds))
+        self.delay = max(0.0, float(delay))
+        self.backfill_days = float(backfill_days)
+        self.max_buckets = max(1, int(max_buckets))
+        self.runs = 0
+        self.buckets_written = 0
+        self.last_bucket: Optional[float] = None
+
+    def run(self, now: Optional[float] = None) -> int:
+        """Computes and stores the buckets that completed since the last run. Returns their number."""
+        now = time.time() if now is None else now
+        bucket = self.bucket_seconds
+        last = AverageMetricsHistory.objects.aggregate(last=Max('timestamp'))['last']
+        if last is not None:
+            start = last + bucket
+        else:
+            oldest = Packet.objects.filter(timestamp__gte=now - self.backfill_days * 86400).aggregate(
+                oldest=Min('timestamp'))['oldest']
+            start = _bucket_start(oldest if oldest is not None else now - self.delay, bucket)
+        # Bucket starts before end_limit belong to buckets that ended at least `delay` seconds ago.
+        end_limit = _bucket_start(now - self.delay, bucket)
+
+        rows = []
+        while start < end_limit and len(rows) < self.max_buckets:
+            rows.append(self.compute_bucket(start))
+            start += bucket
+        if rows:
+            retry_on_lock(self._save, rows, operation='metrics_rollup')
+            ROLLUP_BUCKETS.inc(len(rows))
+            self.buckets_written += len(rows)
+            self.last_bucket = rows[-1].timestamp
+            logger.debug(f"Metrics rollup wrote {len(rows)} buckets up to {self.last_bucket}.")
+        self.runs += 1
+        return len(rows)
+
+    def compute_bucket(self, start: float) -> AverageMetricsHistory:
+        end = start + self.bucket_seconds
+        packets = Packet.objects.filter(timestamp__gte=start, timestamp__lt=end).aggregate(
+            packet_count=Count('pk'),
+            average_snr=Avg('rx_snr'), snr_count=Count('rx_snr'),
+            average_rssi=Avg('rx_rssi'), rssi_count=Count('rx_rssi'),
+            active_node_count=Count('from_node_id_str', distinct=True),
+        )
+        battery = Q(battery_level__lte=BATTERY_MAX)
+        telemetry = Telemetry.objects.filter(timestamp__gte=start, timestamp__lt=end).aggregate(
+            average_battery=Avg('battery_level', filter=battery), battery_count=Count('battery_level', filter=battery),
+            average_chan_util=Avg('channel_utilization'), chan_util_count=Count('channel_utilization'),
+            average_air_util_tx=Avg('air_util_tx'), air_util_tx_count=Count('air_util_tx'),
+        )
+        total_node_count = Node.objects.filter(created_at__lt=datetime.fromtimestamp(end, tz=dt_timezone.utc)).count()
+        return AverageMetricsHistory(timestamp=start, total_node_count=total_node_count, **packets, **telemetry)
+
+    def _save(self, rows: List[AverageMetricsHistory]):
+        with transaction.atomic():
+            # Another process may have rolled up the same buckets; the unique timestamp keeps the first.
+            AverageMetricsHistory.objects.bulk_create(rows, ignore_conflicts=True)
+
+    def stats(self) -> dict:
+        return {
+            'bucket_seconds': self.bucket_seconds,
+            'runs': self.runs,
+            'buckets_written': self.buckets_written,
+            'last_bucket': self.last_bucket,
+        }
+
+
+def window_signal_stats(start: float, end: float) -> dict:
+    """Weighted averages of the buckets starting in [start, end); one aggregate query over the rollups."""
+    aggregates = {'buckets': Count('pk'), 'packet_count': Sum('packet_count')}
+    for average_field, count_field in AVERAGE_FIELDS:
+        aggregates[f'{average_field}_sum'] = Sum(F(average_field) * F(count_field), output_field=FloatField())
+        aggregates[count_field] = Sum(count_field)
+    totals = AverageMetricsHistory.objects.filter(timestamp__gte=start, timestamp__lt=end).aggregate(**aggregates)
+
+    stats = {'buckets': totals['buckets'], 'packet_count': totals['packet_count'] or 0}
+    for average_field, count_field in AVERAGE_FIELDS:
+        count = totals[count_field] or 0
+        stats[average_field] = totals[f'{average_field}_sum'] / count if count else None
+        stats[count_field] = count
+    return stats
+
+
+def history_points(start: float, end: float, max_points: int = 300, bucket_seconds: float = 300) -> dict:
+    """
+    Rollup buckets of [start, end), merged into at most `max_points` points of equal width
+    (`step` seconds) for charts.
+    """
+    buckets_per_point = max(1, math.ceil((end - start) / bucket_seconds / max(1, max_points)))
+    step = buckets_per_point * bucket_seconds
+    fields = [field for pair in AVERAGE_FIELDS for field in pair]
+    rows = AverageMetricsHistory.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by('timestamp').values(
+        'timestamp', 'packet_count', 'active_node_count', 'total_node_count', *fields)
+
+    points = []
+    current = None
+    for row in rows:
+        point_start = _bucket_start(row['timestamp'], step)
+        if current is None or current['timestamp'] != point_start:
+            current = {'timestamp': point_start, 'packet_count': 0, 'active_node_count': 0, 'total_node_count': 0,
+                       '_sums': {average_field: 0.0 for average_field, _ in AVERAGE_FIELDS},
+                       '_counts': {average_field: 0 for average_field, _ in AVERAGE_FIELDS}}
+            points.append(current)
+        current['packet_count'] += row['packet_count']
+        # Nodes active in several buckets of a point cannot be told apart; the busiest bucket counts.
+        current['active_node_count'] = max(current['active_node_count'], row['active_node_count'])
+        current['total_node_count'] = row['total_node_count']
+        for average_field, count_field in AVERAGE_FIELDS:
+            if row[average_field] is not None and row[count_field]:
+                current['_sums'][average_field] += row[average_field] * row[count_field]
+                current['_counts'][average_field] += row[count_field]
+
+    for point in points:
+        sums, counts = point.pop('_sums'), point.pop('_counts')
+        for average_field, _ in AVERAGE_FIELDS:
+            point[average_field] = sums[average_field] / counts[average_field] if counts[average_field] else None
+    return {'step_seconds': step, 'points': points}
+
+
+_metrics_rollup: Optional[MetricsRollup] = None
+
+
+def get_metrics_rollup() -> MetricsRollup:
+    global _metrics_rollup
+    if _metrics_rollup is None:
+        _metrics_rollup = MetricsRollup(
+            bucket_seconds=getattr(settings, 'ROLLUP_BUCKET_SECONDS', 300),
+            delay=getattr(settings, 'ROLLUP_DELAY', 60),
+            backfill_days=getattr(settings, 'ROLLUP_BACKFILL_DAYS', 30),
+            max_buckets=getattr(settings, 'ROLLUP_MAX_BUCKETS', 288),
+        )
+    return _metrics_rollup
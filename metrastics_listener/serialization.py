@@ -0,0 +1,148 @@
+# metrastics_listener/serialization.py
+import base64
+import logging
+from typing import Any, Dict, Tuple
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+
+logger = logging.getLogger(__name__)
+
+# Byte fields that are stored as hex strings resp. only by their length (keys must not end up in the DB).
+HEX_BYTES_FIELDS = frozenset(['macaddr', 'id', 'channel_id'])
+LENGTH_ONLY_BYTES_FIELDS = frozenset(['psk'])
+
+# Field plan rules
+_SCALAR = 0       # int, float, bool, str and enum values are JSON-ready as they are
+_BYTES = 1        # decoded as UTF-8, base64 fallback
+_HEX = 2          # bytes -> hex string
+_LENGTH_ONLY = 3  # bytes -> "bytes_len:<n>"
+_MESSAGE = 4      # nested message, serialized with its own plan
+_CONTAINER = 5    # repeated and map fields; kept as their string representation like before
+
+_JSON_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+
+_field_plans: Dict[type, Tuple[Tuple[str, int], ...]] = {}
+
+
+def _is_repeated(field: FieldDescriptor) -> bool:
+    is_repeated = getattr(field, 'is_repeated', None)
+    if is_repeated is not None:
+        return is_repeated
+    return field.label == FieldDescriptor.LABEL_REPEATED
+
+
+def _build_field_plan(descriptor: Descriptor) -> Tuple[Tuple[str, int], ...]:
+    plan = []
+    for field in descriptor.fields:
+        if _is_repeated(field):
+            rule = _CONTAINER
+        elif field.type == FieldDescriptor.TYPE_MESSAGE or field.type == FieldDescriptor.TYPE_GROUP:
+            rule = _MESSAGE
+        elif field.type == FieldDescriptor.TYPE_BYTES:
+            if field.name in HEX_BYTES_FIELDS:
+                rule = _HEX
+            elif field.name in LENGTH_ONLY_BYTES_FIELDS:
+                rule = _LENGTH_ONLY
+            else:
+                rule = _BYTES
+        else:
+            rule = _SCALAR
+        plan.append((field.name, rule))
+    return tuple(plan)
+
+
+def _get_field_plan(message: Any):
+    message_type = type(message)
+    plan = _field_plans.get(message_type)
+    if plan is None:
+        descriptor = message.DESCRIPTOR
+        if not isinstance(descriptor, Descriptor):
+            return None
+        plan = _field_plans[message_type] = _build_field_plan(descriptor)
+    return plan
+
+
+def _serialize_bytes(value: bytes) -> str:
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return f"base64:{base64.b64encode(value).decode('utf-8')}"
+
+
+def _serialize_message(message: Any) -> dict:
+    plan = _get_field_plan(message)
+    if plan is None:
+        return _serialize_descriptor_fields(message)
+
+    serializable_dict = {}
+    for field_name, rule in plan:
+        try:
+            value = getattr(message, field_name)
+            if rule == _SCALAR:
+                serializable_dict[field_name] = value
+            elif rule == _MESSAGE:
+                serializable_dict[field_name] = _serialize_message(value)
+            elif rule == _BYTES:
+                serializable_dict[field_name] = _serialize_bytes(value)
+            elif rule == _HEX:
+                serializable_dict[field_name] = value.hex()
+            elif rule == _LENGTH_ONLY:
+                serializable_dict[field_name] = f"bytes_len:{len(value)}"
+            else:
+                serializable_dict[field_name] = str(value)
+        except Exception as e:
+            logger.debug(f"Could not serialize Protobuf field '{field_name}': {e}")
+    return serializable_dict
+
+
+def _serialize_descriptor_fields(obj: Any) -> dict:
+    """Generic path for objects that expose a DESCRIPTOR but are no regular protobuf messages."""
+    serializable_dict = {}
+    for field_descriptor in obj.DESCRIPTOR.fields:
+        field_name = field_descriptor.name
+        try:
+            value = getattr(obj, field_name)
+            if isinstance(value, bytes) and field_name in HEX_BYTES_FIELDS:
+                serializable_dict[field_name] = value.hex()
+            elif isinstance(value, bytes) and field_name in LENGTH_ONLY_BYTES_FIELDS:
+                serializable_dict[field_name] = f"bytes_len:{len(value)}"
+            else:
+                serializable_dict[field_name] = ensure_serializable(value)
+        except Exception as e:
+            logger.debug(f"Could not serialize Protobuf field '{field_name}': {e}")
+    return serializable_dict
+
+
+def ensure_serializable(obj: Any) -> Any:
+    """
+    Converts packets, node infos and protobuf messages into JSON-serializable structures.
+
+    Protobuf messages are converted with a field plan that is built once per message type, and
+    leaves are converted by type instead of trial `json.dumps` calls. Repeated and map fields keep
+    their string representation, as before.
+    """
+    obj_type = type(obj)
+    if obj_type is dict:
+        return {k: ensure_serializable(v) for k, v in obj.items()}
+    if obj_type in _JSON_SCALAR_TYPES:
+        return obj
+    if obj_type is list or obj_type is tuple:
+        return [ensure_serializable(item) for item in obj]
+    if obj_type is bytes:
+        return _serialize_bytes(obj)
+    if obj_type in _field_plans:
+        return _serialize_message(obj)
+
+    if isinstance(obj, dict):
+        return {k: ensure_serializable(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple, set)):
+        return [ensure_serializable(item) for item in obj]
+    elif isinstance(obj, bytes):
+        return _serialize_bytes(obj)
+    elif hasattr(obj, 'DESCRIPTOR') and hasattr(obj.DESCRIPTOR, 'fields') and not isinstance(obj, type):
+        return _serialize_message(obj)
+    elif isinstance(obj, (str, int, float)):
+        return obj
+    logger.warning(
+        f"Object of type {type(obj)} could not be serialized to dict/JSON, falling back to string representation.")
+    return str(obj)
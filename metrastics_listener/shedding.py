@@ -0,0 +1,179 @@
+# metrastics_listener/shedding.py
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Optional, Tuple
+
+from metrastics import metrics
+
+PRIORITY_CRITICAL = 0  # Never shed
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+CRITICAL_PACKET_TYPES = {'Message', 'Routing'}
+COALESCED_PACKET_TYPES = {'Telemetry', 'Position'}
+SAMPLED_PACKET_TYPES = {'Other', 'Encrypted', 'Unknown', 'Binary Data'}
+
+SHED_RECORDS = metrics.counter('metrastics_listener_ingest_shed_total',
+                               'Ingest records dropped under overload.', ['packet_type', 'reason'])
+COALESCED_RECORDS = metrics.counter('metrastics_listener_ingest_coalesced_total',
+                                    'Ingest records merged into a queued record of the same node.', ['packet_type'])
+
+
+def _record_label(record: Any) -> str:
+    if not isinstance(record, dict):
+        return 'control'
+    if record.get('kind') == 'packet':
+        return record.get('packet_type') or 'Unknown'
+    return record.get('kind', 'unknown')
+
+
+def record_policy(record: Any) -> Tuple[int, Optional[tuple], bool]:
+    """
+    Returns (priority, coalesce key, always coalesce) of an ingest record.
+
+    Node updates and duplicate-copy updates are partial updates of one row and are always
+    merged. Telemetry and Position packets of the same node (and metrics variant) are only
+    replaced by the newest sample when the queue is overloaded.
+    """
+    if not isinstance(record, dict):
+        return PRIORITY_CRITICAL, None, False
+    kind = record.get('kind')
+    if kind == 'node':
+        return PRIORITY_NORMAL, ('node', record['node_id']), True
+    if kind == 'duplicate':
+        # Applied after the original packet, which always leaves the queue first.
+        return PRIORITY_LOW, ('duplicate', record['event_id']), True
+
+    packet_type = record.get('packet_type')
+    if packet_type in CRITICAL_PACKET_TYPES:
+        return PRIORITY_CRITICAL, None, False
+    if packet_type in SAMPLED_PACKET_TYPES:
+        return PRIORITY_LOW, None, False
+    if packet_type in COALESCED_PACKET_TYPES and record.get('from_id_str'):
+        payload = record.get('payload')
+        variant = tuple(sorted(payload)) if isinstance(payload, dict) else ()
+        return PRIORITY_NORMAL, ('sample', record['from_id_str'], packet_type, variant), False
+    return PRIORITY_NORMAL, None, False
+
+
+class SheddingQueue:
+    """
+    Bounded ingest buffer with per-packet-type priorities, used in place of queue.Queue by the
+    IngestPipeline.
+
+    Records leave in priority order (FIFO within a priority). Once the queue is more than
+    `high_water` full, Telemetry/Position samples of a node replace the node's queued sample
+    and only every `sample_rate`-th low-value packet (Other, Encrypted, ...) is kept. When the
+    queue is full, the oldest record of a lower priority is evicted to make room; if there is
+    none, the new record is shed. Messages and Routing packets are never shed, even if that
+    takes the queue over its size.
+    """
+
+    def __init__(self, maxsize: int = 5000, high_water: float = 0.5, sample_rate: int = 10):
+        self.maxsize = max(1, int(maxsize))
+        self.high_water = max(1, int(self.maxsize * float(high_water)))
+        self.sample_rate = max(1, int(sample_rate))
+        self._lanes = {priority: deque() for priority in (PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_LOW)}
+        self._index = {}
+        self._size = 0
+        self._sample_counter = 0
+        self._condition = threading.Condition()
+        self.shed_count = 0
+        self.coalesced_count = 0
+        self.last_shed_at: Optional[float] = None
+        self._reported = (0, 0)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None):
+        self.put_nowait(item)
+
+    def put_nowait(self, item: Any):
+        priority, key, always_coalesce = record_policy(item)
+        with self._condition:
+            overloaded = self._size >= self.high_water
+            entry = self._index.get(key) if key is not None else None
+            if entry is not None and (always_coalesce or overloaded):
+                if always_coalesce:
+                    merged = dict(entry[0])
+                    merged['values'] = {**entry[0]['values'], **item['values']}
+                    entry[0] = merged
+                else:
+                    entry[0] = item
+                self.coalesced_count += 1
+                COALESCED_RECORDS.labels(_record_label(item)).inc()
+                return
+
+            if priority == PRIORITY_LOW and key is None and overloaded:
+                self._sample_counter += 1
+                if self._sample_counter % self.sample_rate:
+                    self._shed(item, 'sampled')
+                    return
+
+            if self._size >= self.maxsize and not self._evict_below(priority) and priority != PRIORITY_CRITICAL:
+                self._shed(item, 'rejected')
+                return
+
+            entry = [item, key]
+            self._lanes[priority].append(entry)
+            if key is not None:
+                self._index[key] = entry
+            self._size += 1
+            self._condition.notify()
+
+    def _evict_below(self, priority: int) -> bool:
+        for lane_priority in sorted(self._lanes, reverse=True):
+            if lane_priority <= priority:
+                return False
+            lane = self._lanes[lane_priority]
+            if lane:
+                self._remove_index(lane[0])
+                self._shed(lane.popleft()[0], 'evicted')
+                self._size -= 1
+                return True
+        return False
+
+    def _remove_index(self, entry: list):
+        key = entry[1]
+        if key is not None and self._index.get(key) is entry:
+            del self._index[key]
+
+    def _shed(self, record: Any, reason: str):
+        self.shed_count += 1
+        self.last_shed_at = time.time()
+        SHED_RECORDS.labels(_record_label(record), reason).inc()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        with self._condition:
+            if block and not self._size:
+                self._condition.wait_for(lambda: self._size, timeout)
+            for lane in self._lanes.values():
+                if lane:
+                    entry = lane.popleft()
+                    self._remove_index(entry)
+                    self._size -= 1
+                    return entry[0]
+        raise queue.Empty
+
+    def get_nowait(self) -> Any:
+        return self.get(block=False)
+
+    def take_counts(self) -> Tuple[int, int]:
+        """Returns the records shed and coalesced since the previous call."""
+        with self._condition:
+            counts = (self.shed_count, self.coalesced_count)
+            delta = (counts[0] - self._reported[0], counts[1] - self._reported[1])
+            self._reported = counts
+            return delta
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'queue_depth': self._size,
+                'overloaded': self._size >= self.high_water,
+                'shed': self.shed_count,
+                'coalesced': self.coalesced_count,
+            }
@@ -0,0 +1,268 @@
+# metrastics_listener/supervisor.py
+"""
+asyncio supervisor of the listener process.
+
+One event loop owns the connection of every gateway, the periodic jobs (status heartbeats,
+restart polling, capture flushes) and the long-running services (the Flask send API).
+Everything that blocks - the meshtastic library, the Django ORM, the Flask server - is run in
+the supervisor's thread pool; the event loop itself never touches the database.
+
+Other threads talk to the supervisor through connection_lost(), request_restart() and stop(),
+which are safe to call from anywhere (e.g. from the meshtastic library's pubsub callbacks).
+"""
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from metrastics_listener.gateways import Gateway, GatewayRegistry
+
+logger = logging.getLogger(__name__)
+
+REASON_LOST = 'lost'
+REASON_RESTART = 'restart'
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random = random) -> float:
+    """
+    Seconds to wait before reconnect attempt `attempt` (0 = first attempt after a drop). The
+    first attempt is immediate; later ones double up to `cap`, with half of the delay jittered
+    so gateways that dropped together do not reconnect in lockstep.
+    """
+    if attempt <= 0:
+        return 0.0
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+class _PeriodicJob:
+    def __init__(self, name: str, interval: float, function: Callable[[], None]):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.runs = 0
+        self.failures = 0
+
+
+class _Service:
+    def __init__(self, name: str, run: Callable[[], None], stop: Optional[Callable[[], None]]):
+        self.name = name
+        self.run = run
+        self.stop = stop
+        self.starts = 0
+
+
+class ListenerSupervisor:
+    def __init__(self, gateways: GatewayRegistry, connect: Callable[[Gateway], None],
+                 on_connect_failed: Callable[[Gateway, BaseException], None],
+                 on_restart: Optional[Callable[[Gateway], None]] = None,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0, stable_after: float = 30.0,
+                 service_restart_delay: float = 5.0, rng: Optional[random.Random] = None):
+        """
+        `connect(gateway)` opens the gateway's interface and assigns it to gateway.interface, or
+        raises. A connection that drops within `stable_after` seconds does not reset the backoff,
+        so a flapping gateway is not reconnected in a tight loop.
+        """
+        self.gateways = gateways
+        self._connect = connect
+        self._on_connect_failed = on_connect_failed
+        self._on_restart = on_restart
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.service_restart_delay = service_restart_delay
+        self._rng = rng or random.Random()
+        self._jobs: List[_PeriodicJob] = []
+        self._services: List[_Service] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._pending: Dict[str, str] = {}
+        self._stopping = False
+        self._stopped: Optional[asyncio.Event] = None
+        self.reconnects = 0
+        self.connect_failures = 0
+
+    def add_periodic_job(self, name: str, interval: float, function: Callable[[], None]):
+        """Runs the blocking `function` every `interval` seconds in the thread pool."""
+        self._jobs.append(_PeriodicJob(name, max(0.01, float(interval)), function))
+
+    def add_service(self, name: str, run: Callable[[], None], stop: Optional[Callable[[], None]] = None):
+        """Runs the blocking `run` in the thread pool and restarts it if it returns or fails."""
+        self._services.append(_Service(name, run, stop))
+
+    @property
+    def is_running(self) -> bool:
+        return self._loop is not None and not self._stopping
+
+    # Thread-safe entry points.
+
+    def connection_lost(self, gateway: Gateway):
+        self._notify(gateway.name, REASON_LOST)
+
+    def request_restart(self):
+        for gateway in self.gateways:
+            self._notify(gateway.name, REASON_RESTART)
+
+    def stop(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._begin_stop)
+            except RuntimeError:
+                pass
+
+    def _notify(self, gateway_name: str, reason: str):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake, gateway_name, reason)
+        except RuntimeError:
+            pass  # Loop closed in the meantime.
+
+    def _wake(self, gateway_name: str, reason: str):
+        # A restart outranks a drop that has not been handled yet.
+        if self._pending.get(gateway_name) != REASON_RESTART:
+            self._pending[gateway_name] = reason
+        event = self._wakeups.get(gateway_name)
+        if event is not None:
+            event.set()
+
+    def _begin_stop(self):
+        self._stopping = True
+        for event in self._wakeups.values():
+            event.set()
+        if self._stopped is not None:
+            self._stopped.set()
+
+    # Event loop.
+
+    def run(self):
+        """Runs the supervisor until stop() is called. Blocks the calling thread."""
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._stopped = asyncio.Event()
+        self._wakeups = {gateway.name: asyncio.Event() for gateway in self.gateways}
+        self._executor = ThreadPoolExecutor(max_workers=len(self.gateways) + len(self._services) + 4,
+                                            thread_name_prefix='listener-io')
+        tasks = [asyncio.create_task(self._run_gateway(gateway), name=f'gateway-{gateway.name}')
+                 for gateway in self.gateways]
+        tasks += [asyncio.create_task(self._run_periodic(job), name=f'job-{job.name}') for job in self._jobs]
+        tasks += [asyncio.create_task(self._run_service(service), name=f'service-{service.name}')
+                  for service in self._services]
+        try:
+            await self._stopped.wait()
+        finally:
+            self._stopping = True
+            for service in self._services:
+                if service.stop is not None:
+                    try:
+                        service.stop()
+                    except Exception as e:
+                        logger.error(f"Error stopping {service.name}: {e}")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Connect calls that are still blocked in the meshtastic library are abandoned.
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._loop = None
+
+    async def _call(self, function, *args):
+        return await self._loop.run_in_executor(self._executor, function, *args)
+
+    async def _wait(self, event: asyncio.Event, timeout: Optional[float]) -> bool:
+        """Waits for `event` for up to `timeout` seconds; True if it was set."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run_gateway(self, gateway: Gateway):
+        wakeup = self._wakeups[gateway.name]
+        attempt = 0
+        while not self._stopping:
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, self._rng)
+            if delay:
+                logger.info(f"Gateway {gateway.name}: reconnecting in {delay:.1f}s (attempt {attempt}).")
+                # A restart request cuts the wait short.
+                if await self._wait(wakeup, delay) and self._pending.get(gateway.name) == REASON_RESTART:
+                    attempt = 0
+            if self._stopping:
+                break
+            wakeup.clear()
+            self._pending.pop(gateway.name, None)
+
+            try:
+                await self._call(self._connect, gateway)
+            except Exception as e:
+                attempt += 1
+                self.connect_failures += 1
+                await self._report(self._on_connect_failed, gateway, e)
+                continue
+            connected_at = time.monotonic()
+
+            await wakeup.wait()
+            wakeup.clear()
+            reason = self._pending.pop(gateway.name, REASON_LOST)
+            await self._report(gateway.close_interface)
+            if self._stopping:
+                break
+            self.reconnects += 1
+            if reason == REASON_RESTART:
+                attempt = 0
+                if self._on_restart is not None:
+                    await self._report(self._on_restart, gateway)
+            elif time.monotonic() - connected_at >= self.stable_after:
+                attempt = 0
+            else:
+                attempt += 1
+            logger.info(f"Gateway {gateway.name}: connection {'restart requested' if reason == REASON_RESTART else 'lost'}, reconnecting.")
+
+    async def _report(self, function, *args):
+        """Runs a blocking callback; its errors are logged, they do not stop the gateway loop."""
+        try:
+            await self._call(function, *args)
+        except Exception as e:
+            logger.exception(f"Supervisor callback {getattr(function, '__name__', function)} failed: {e}")
+
+    async def _run_periodic(self, job: _PeriodicJob):
+        next_run = self._loop.time() + job.interval
+        while not self._stopping:
+            await asyncio.sleep(max(0.0, next_run - self._loop.time()))
+            # Fixed rate; runs that were missed while a slow run blocked are skipped, not queued.
+            next_run = max(next_run + job.interval, self._loop.time())
+            try:
+                await self._call(job.function)
+                job.runs += 1
+            except Exception as e:
+                job.failures += 1
+                logger.exception(f"Periodic job {job.name} failed: {e}")
+
+    async def _run_service(self, service: _Service):
+        while not self._stopping:
+            service.starts += 1
+            try:
+                await self._call(service.run)
+            except Exception as e:
+                logger.exception(f"{service.name} failed: {e}")
+            if self._stopping:
+                break
+            logger.warning(f"{service.name} is no longer running! Restarting it in {self.service_restart_delay}s.")
+            await asyncio.sleep(self.service_restart_delay)
+
+    def stats(self) -> dict:
+        return {
+            'running': self.is_running,
+            'reconnects': self.reconnects,
+            'connect_failures': self.connect_failures,
+            'jobs': {job.name: {'interval': job.interval, 'runs': job.runs, 'failures': job.failures}
+                     for job in self._jobs},
+            'services': {service.name: {'starts': service.starts} for service in self._services},
+        }
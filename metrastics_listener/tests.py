@@ -1,3 +1,861 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from meshtastic.protobuf import channel_pb2, mesh_pb2
+
+from metrastics.database import retry_on_lock, run_maintenance, sqlite_options
+from metrastics_commander.dispatcher import CommanderDispatcher
+from metrastics_listener import events, message_search, packet_fixtures
+from metrastics_listener.capture import KIND_NODE_UPDATE, KIND_PACKET, CaptureWriter, read_capture
+from metrastics_listener.counters import (NODE_NAME_CHANGES, NODES, apply_counter_deltas, is_recounted, read_counters,
+                                          rebuild_counters)
+from metrastics_listener.events import EventBroker
+from metrastics_listener.gateways import GatewayRegistry, parse_gateways
+from metrastics_listener.ingest import IngestPipeline
+from metrastics_listener.management.commands.benchmark_serializer import legacy_ensure_serializable
+from metrastics_listener.management.commands import listen_device
+from metrastics_listener.models import (AverageMetricsHistory, ListenerState, Message, Node, Packet, Position,
+                                        RetentionState, Telemetry)
+from metrastics_listener.node_cache import NodeStateCache
+from metrastics_listener.node_names import NodeNameResolver
+from metrastics_listener.outbound import PRIORITY_BULK, OutboundScheduler, split_text
+from metrastics_listener.retention import RetentionManager
+from metrastics_listener.rollups import MetricsRollup, history_points, window_signal_stats
+from metrastics_listener.serialization import ensure_serializable
+from metrastics_listener.shedding import SheddingQueue
+from metrastics_listener.supervisor import ListenerSupervisor, backoff_delay
+
+
+def make_text_packet(packet_id=1001, from_num=0x11223344, text="hello mesh", rx_snr=5.5):
+    return {
+        'from': from_num,
+        'to': 0xFFFFFFFF,
+        'id': packet_id,
+        'rxTime': 1700000000,
+        'rxSnr': rx_snr,
+        'rxRssi': -90,
+        'hopLimit': 3,
+        'channel': 0,
+        'decoded': {'portnum': 'TEXT_MESSAGE_APP', 'payload': text.encode('utf-8')},
+    }
+
+
+def make_position_packet(packet_id=2001, from_num=0x11223344):
+    return {
+        'from': from_num,
+        'to': 0xFFFFFFFF,
+        'id': packet_id,
+        'rxTime': 1700000010,
+        'rxSnr': 4.0,
+        'rxRssi': -95,
+        'decoded': {
+            'portnum': 'POSITION_APP',
+            'position': {'latitudeI': 525200000, 'longitudeI': 134050000, 'altitude': 34, 'time': 1700000005},
+        },
+    }
+
+
+def make_telemetry_packet(packet_id=3001, from_num=0x11223344):
+    return {
+        'from': from_num,
+        'to': 0xFFFFFFFF,
+        'id': packet_id,
+        'rxTime': 1700000020,
+        'decoded': {
+            'portnum': 'TELEMETRY_APP',
+            'telemetry': {'deviceMetrics': {'batteryLevel': 87, 'voltage': 4.01, 'channelUtilization': 12.5}},
+        },
+    }
+
+
+class SerializerTestCase(SimpleTestCase):
+    def test_output_is_identical_to_legacy_serializer(self):
+        channel = channel_pb2.Channel(index=1, settings=channel_pb2.ChannelSettings(
+            psk=bytes(16), name='LongFast', id=0x1234, channel_num=3))
+        samples = [builder() for builder in packet_fixtures.PACKET_BUILDERS.values()]
+        samples += [packet_fixtures.node_update(), channel, {'bytes': b'\xff\x00', 'set': {1}, 'nested': (1.5, None)},
+                    mesh_pb2.MyNodeInfo(my_node_num=42, device_id=b'\x01\x02', pio_env='heltec-v3')]
+        for sample in samples:
+            self.assertEqual(json.dumps(ensure_serializable(sample)), json.dumps(legacy_ensure_serializable(sample)))
+
+
+class IngestBatchTestCase(TestCase):
+    def setUp(self):
+        listen_device.get_node_cache().clear()
+        listen_device.get_deduplicator().clear()
+
+    def test_batch_writes_packets_and_payload_rows(self):
+        records = [listen_device.build_packet_record(p) for p in
+                   (make_text_packet(), make_position_packet(), make_telemetry_packet())]
+        listen_device.flush_ingest_batch(records)
+        listen_device.get_node_cache().flush()
+
+        self.assertEqual(Packet.objects.count(), 3)
+        self.assertEqual(Message.objects.get().text, "hello mesh")
+        self.assertEqual(Position.objects.get().latitude, 52.52)
+        self.assertEqual(Telemetry.objects.get().battery_level, 87)
+        node = Node.objects.get(node_id='!11223344')
+        self.assertEqual(node.battery_level, 87)
+        self.assertEqual(node.altitude, 34)
+
+    def test_counters_follow_ingest_and_match_a_rebuild(self):
+        records = [listen_device.build_packet_record(p) for p in
+                   (make_text_packet(), make_position_packet(), make_telemetry_packet())]
+        listen_device.flush_ingest_batch(records)
+        listen_device.flush_ingest_batch([listen_device.build_packet_record(make_text_packet())])  # Already stored
+
+        stored = read_counters()
+        self.assertEqual(stored['packets'], 3)
+        self.assertEqual(stored['packets.type.Message'], 1)
+        self.assertEqual(stored['packets.portnum.TEXT_MESSAGE_APP'], 1)
+        self.assertEqual(stored['nodes'], 1)
+        # One change per batch that stored something; the repeated packet changed nothing.
+        self.assertEqual(stored['seq.packets'], 1)
+        self.assertEqual(stored['seq.messages'], 1)
+        self.assertEqual({key: value for key, value in rebuild_counters().items() if value},
+                         {key: value for key, value in stored.items() if value and is_recounted(key)})
+
+    def test_committed_batches_are_published_as_events(self):
+        broker = events.get_event_broker()
+        last_event_id = f"{broker.epoch}:{broker.sequence}"
+        records = [listen_device.build_packet_record(p) for p in (make_text_packet(), make_telemetry_packet())]
+        with self.captureOnCommitCallbacks(execute=True):
+            listen_device.flush_ingest_batch(records)
+
+        # A node cache flush that happened to be due publishes 'nodes' as well.
+        published = [event for event in read_events(broker.subscribe(last_event_id)) if event[0] != 'nodes']
+        self.assertEqual([kind for kind, _ in published], ['packet', 'packet', 'counters'])
+        message = published[0][1]
+        self.assertEqual(message['packet_type'], 'Message')
+        self.assertEqual(message['from_node_info']['node_id'], '!11223344')
+        self.assertIsNotNone(message['decoded_json'])
+        self.assertIsNone(published[1][1]['decoded_json'])  # Only messages and positions carry their payload
+        self.assertEqual(published[2][1]['deltas']['packets'], 2)
+
+    def test_failed_batch_is_stored_one_by_one(self):
+        bulk_create = Message.objects.bulk_create
+        failures = []
+
+        def fail_once(*args, **kwargs):
+            if not failures:
+                failures.append(True)
+                raise ValueError("bulk_create failed")
+            return bulk_create(*args, **kwargs)
+
+        records = [listen_device.build_packet_record(p) for p in
+                   (make_text_packet(from_num=0x55667788), make_telemetry_packet(from_num=0x55667788))]
+        Message.objects.bulk_create = fail_once
+        try:
+            listen_device.flush_ingest_batch(records)
+        finally:
+            del Message.objects.bulk_create
+        listen_device.get_node_cache().flush()
+
+        self.assertEqual(failures, [True])
+        self.assertEqual(Packet.objects.count(), 2)
+        self.assertEqual(Message.objects.get().from_node_id_str, '!55667788')
+        # The node created by the rolled-back batch was created again, and its changes written back.
+        self.assertEqual(Node.objects.get(node_id='!55667788').battery_level, 87)
+
+    def test_on_receive_without_pipeline_writes_synchronously(self):
+        listen_device.on_receive_django(make_text_packet(), interface=None)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_received_packets_are_counted_in_metrics(self):
+        received = listen_device.PACKETS_RECEIVED.labels('Message', 'TEXT_MESSAGE_APP')
+        db_writes = listen_device.INGEST_STAGE_SECONDS.labels(stage='db_write')
+        received_before, db_writes_before = received.value(), db_writes.snapshot()[2]
+        listen_device.on_receive_django(make_text_packet(), interface=None)
+        self.assertEqual(received.value(), received_before + 1)
+        self.assertEqual(db_writes.snapshot()[2], db_writes_before + 1)
+
+    def test_shed_records_are_counted_in_listener_state(self):
+        ListenerState.objects.create(singleton_id=1)
+        records = SheddingQueue(maxsize=1, high_water=1.0)
+        records.put_nowait(make_record('Telemetry'))
+        records.put_nowait(make_record('Position'))
+        listen_device._ingest_queue = records
+        try:
+            listen_device.record_ingest_shedding()
+        finally:
+            listen_device._ingest_queue = None
+
+        state = ListenerState.objects.get()
+        self.assertEqual(state.ingest_shed_count, 1)
+        self.assertIsNotNone(state.ingest_last_shed_at)
+
+    def test_rebroadcast_copies_are_counted_instead_of_stored(self):
+        listen_device.on_receive_django(make_text_packet(rx_snr=-3.0), interface=None)
+        listen_device.on_receive_django(make_text_packet(rx_snr=7.25), interface=None)
+        listen_device.on_receive_django(make_text_packet(rx_snr=1.0), interface=None)
+
+        packet = Packet.objects.get()
+        self.assertEqual(packet.copies_heard, 3)
+        self.assertEqual(packet.rx_snr, 7.25)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_reingesting_a_packet_is_idempotent(self):
+        listen_device.on_receive_django(make_text_packet(), interface=None)
+        # Outside the deduplicator's memory, e.g. a replay or a re-delivery after a restart.
+        listen_device.get_deduplicator().clear()
+        with CaptureQueriesContext(connection) as queries:
+            listen_device.on_receive_django(make_text_packet(), interface=None)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('INSERT')])
+        listen_device.get_deduplicator().clear()
+        packet = make_text_packet()
+        packet['rxTime'] += 3600  # Same mesh id, later reception: a different packet
+        listen_device.on_receive_django(packet, interface=None)
+
+        self.assertEqual(Packet.objects.count(), 2)
+        self.assertEqual(Message.objects.count(), 2)
+        first = Packet.objects.get(rx_time=1700000000)
+        gateway_key = listen_device.get_gateways().primary.key
+        self.assertEqual((first.gateway_key, first.mesh_from, first.mesh_id), (gateway_key, 0x11223344, 1001))
+        self.assertEqual(first.event_id, f"pkt_{gateway_key:08x}_11223344_000003e9_1700000000")
+
+    def test_duplicate_in_same_batch_updates_original(self):
+        records = [listen_device.dedupe_packet_record(listen_device.build_packet_record(make_position_packet()))
+                   for _ in range(2)]
+        self.assertEqual([r['kind'] for r in records], ['packet', 'duplicate'])
+        listen_device.flush_ingest_batch(records)
+        self.assertEqual(Packet.objects.get().copies_heard, 2)
+
+    def test_commander_job_is_dispatched_after_commit(self):
+        handled = []
+        dispatcher = CommanderDispatcher(
+            lambda message, node, channel, gateway: handled.append((message.text, node.node_id, gateway)))
+        dispatcher.start()
+        listen_device._commander_dispatcher = dispatcher
+        try:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                listen_device.flush_ingest_batch([listen_device.build_packet_record(make_text_packet())])
+            self.assertEqual(dispatcher.stats()['submitted'], 0)
+            for callback in callbacks:
+                callback()
+            dispatcher.stop(timeout=5)
+        finally:
+            listen_device._commander_dispatcher = None
+        self.assertEqual(handled, [("hello mesh", '!11223344', listen_device.get_gateways().primary.name)])
+
+    def test_node_update_goes_through_node_cache(self):
+        listen_device.on_node_updated_django(
+            {'num': 0x0a0b0c0d, 'user': {'longName': 'Gateway', 'shortName': 'GW'}, 'lastHeard': 1700000000},
+            interface=None)
+        node = Node.objects.get(node_id='!0a0b0c0d')
+        self.assertEqual(node.long_name, 'Gateway')
+        self.assertEqual(node.node_num, 0x0a0b0c0d)
+
+
+class FakeTCPInterface:
+    def __init__(self, hostname, portNumber):
+        self.hostname = hostname
+        self.portNumber = portNumber
+
+
+class MultiGatewayTestCase(TestCase):
+    def setUp(self):
+        listen_device.get_node_cache().clear()
+        listen_device.get_deduplicator().clear()
+        self.gateways = GatewayRegistry(parse_gateways('roof=10.0.0.1:4403,valley=10.0.0.2', 'localhost', 4403))
+        saved_gateways, listen_device._gateways = listen_device._gateways, self.gateways
+
+        def restore():
+            listen_device._gateways = saved_gateways
+        self.addCleanup(restore)
+
+    def test_gateway_list_is_parsed(self):
+        roof, valley = self.gateways
+        self.assertEqual((roof.name, roof.address, roof.state_id), ('roof', '10.0.0.1:4403', 1))
+        self.assertEqual((valley.name, valley.address, valley.state_id), ('valley', '10.0.0.2:4403', 2))
+        self.assertEqual([g.name for g in parse_gateways('', 'radio', 4403)], ['default'])
+        self.assertEqual([g.name for g in parse_gateways('10.0.0.3:4000', 'radio', 4403)], ['10.0.0.3:4000'])
+        with self.assertRaises(ValueError):
+            parse_gateways('a=10.0.0.1,a=10.0.0.2', 'radio', 4403)
+
+    def test_packet_heard_by_two_gateways_is_stored_once(self):
+        roof, valley = self.gateways
+        roof.channel_map, valley.channel_map = {0: 0}, {0: 2}
+        # Matched by address, as events arrive before the interface is assigned to the gateway.
+        self.assertIs(listen_device.resolve_gateway(FakeTCPInterface('10.0.0.2', 4403)), valley)
+
+        listen_device.on_receive_django(make_text_packet(rx_snr=-3.0), FakeTCPInterface('10.0.0.2', 4403))
+        listen_device.on_receive_django(make_text_packet(rx_snr=6.0), FakeTCPInterface('10.0.0.1', 4403))
+
+        packet = Packet.objects.get()
+        self.assertEqual(packet.copies_heard, 2)
+        self.assertEqual(packet.rx_snr, 6.0)
+        # Mapped with the channel map of the gateway that heard the packet first.
+        self.assertEqual(packet.channel, 2)
+
+    def test_connection_events_update_the_gateway_status_row(self):
+        roof, valley = self.gateways
+        listen_device.handle_connection_event(valley, None, "meshtastic.connection.failed", "refused")
+        listen_device.handle_connection_event(roof, None, "meshtastic.connection.lost")
+
+        self.assertEqual(list(ListenerState.objects.order_by('singleton_id').values_list(
+            'singleton_id', 'gateway_name', 'gateway_address', 'status', 'last_error_message')), [
+            (1, 'roof', '10.0.0.1:4403', 'DISCONNECTED', 'Connection lost'),
+            (2, 'valley', '10.0.0.2:4403', 'ERROR', 'refused'),
+        ])
+
+
+class FakeConnectedInterface:
+    def __init__(self):
+        self.socket = object()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ListenerSupervisorTestCase(SimpleTestCase):
+    def start_supervisor(self, connect, **kwargs):
+        self.failures = []
+        self.restarts = []
+        self.gateways = GatewayRegistry(parse_gateways('roof=10.0.0.1,valley=10.0.0.2', 'localhost', 4403))
+        supervisor = ListenerSupervisor(self.gateways, connect,
+                                        on_connect_failed=lambda gateway, error: self.failures.append(gateway.name),
+                                        on_restart=lambda gateway: self.restarts.append(gateway.name),
+                                        backoff_base=0.02, backoff_max=0.05, **kwargs)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+
+        def stop():
+            supervisor.stop()
+            thread.join(timeout=5)
+        self.addCleanup(stop)
+        return supervisor
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Condition not reached in time.")
+            time.sleep(0.01)
+
+    def test_failed_connects_back_off_and_lost_connections_reconnect(self):
+        attempts = {'roof': 0, 'valley': 0}
+
+        def connect(gateway):
+            attempts[gateway.name] += 1
+            if gateway.name == 'valley' and attempts['valley'] < 3:
+                raise ConnectionRefusedError("refused")
+            gateway.interface = FakeConnectedInterface()
+
+        supervisor = self.start_supervisor(connect, stable_after=0)
+        roof, valley = self.gateways
+        self.wait_for(lambda: roof.interface is not None and valley.interface is not None)
+        self.assertEqual(self.failures, ['valley', 'valley'])
+
+        dropped = roof.interface
+        supervisor.connection_lost(roof)
+        self.wait_for(lambda: attempts['roof'] == 2 and roof.interface is not None)
+        self.assertTrue(dropped.closed)
+
+        supervisor.request_restart()
+        self.wait_for(lambda: sorted(self.restarts) == ['roof', 'valley'])
+        self.wait_for(lambda: attempts == {'roof': 3, 'valley': 4})
+        self.assertEqual(supervisor.stats()['reconnects'], 3)
+
+    def test_periodic_jobs_and_services_run_in_the_thread_pool(self):
+        job_threads = []
+        service_stopped = threading.Event()
+        supervisor = ListenerSupervisor(GatewayRegistry(parse_gateways('', 'localhost', 4403)),
+                                        connect=lambda gateway: setattr(gateway, 'interface', FakeConnectedInterface()),
+                                        on_connect_failed=lambda gateway, error: None)
+        supervisor.add_periodic_job('tick', 0.01, lambda: job_threads.append(threading.current_thread().name))
+        supervisor.add_service('server', service_stopped.wait, service_stopped.set)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+        self.wait_for(lambda: len(job_threads) >= 3)
+        supervisor.stop()
+        thread.join(timeout=5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(service_stopped.is_set())
+        self.assertTrue(all(name.startswith('listener-io') for name in job_threads))
+        self.assertEqual(backoff_delay(0, 1.0, 60.0), 0.0)
+        self.assertTrue(30.0 <= backoff_delay(10, 1.0, 60.0) <= 60.0)
+
+
+class NodeStateCacheTestCase(TestCase):
+    def test_repeated_updates_are_coalesced_into_one_update(self):
+        Node.objects.create(node_id='!00000001', node_num=1)
+        cache = NodeStateCache(max_size=10, flush_interval=60)
+        cache.load()
+        for i in range(20):
+            cache.update('!00000001', {'last_heard': 1700000000 + i, 'snr': float(i), 'rssi': -100 + i})
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(cache.flush(), 1)
+        # The flush also bumps the nodes change sequence; only the node writes are coalesced.
+        updates = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE') and '"metrastics_listener_node"' in q['sql']]
+        self.assertEqual(len(updates), 1)
+
+        node = Node.objects.get(node_id='!00000001')
+        self.assertEqual(node.last_heard, 1700000019)
+        self.assertEqual(node.rssi, -81)
+        self.assertEqual(cache.flush(), 0)
+
+    def test_eviction_keeps_cache_bounded(self):
+        cache = NodeStateCache(max_size=2)
+        for i in range(1, 5):
+            cache.get_or_create(f'!0000000{i}', defaults={'node_num': i})
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(Node.objects.count(), 4)
+
+
+class NodeNameResolverTestCase(TestCase):
+    def setUp(self):
+        for i in range(1, 4):
+            Node.objects.create(node_id=f'!0000000{i}', node_num=i, long_name=f'Node {i}', short_name=f'N{i}')
+        self.resolver = NodeNameResolver(check_interval=0)
+
+    def test_a_page_of_ids_is_resolved_with_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            names = self.resolver.resolve(['!00000001', '!00000002', '!00000003', '!00000001', '!00000009', '^all', None])
+        node_queries = [q['sql'] for q in ctx.captured_queries if 'metrastics_listener_node' in q['sql']]
+        self.assertEqual(len(node_queries), 1)
+        self.assertEqual(names['!00000002'], {'long_name': 'Node 2', 'short_name': 'N2', 'node_id': '!00000002'})
+        self.assertIsNone(names['!00000009'])
+        self.assertNotIn('^all', names)
+
+        with self.assertNumQueries(1):  # Only the version check
+            self.resolver.resolve(['!00000001', '!00000009'])
+
+    def test_renamed_and_new_nodes_are_picked_up(self):
+        self.resolver.resolve(['!00000001', '!00000009'])
+        cache = NodeStateCache(flush_interval=60)
+        cache.update('!00000001', {'long_name': 'Renamed'})
+        cache.flush()
+        Node.objects.create(node_id='!00000009', node_num=9, long_name='Newcomer')
+        apply_counter_deltas({NODES: 1})  # As the ingest writer does for the nodes it creates
+
+        names = self.resolver.resolve(['!00000001', '!00000009'])
+        self.assertEqual(names['!00000001']['long_name'], 'Renamed')
+        self.assertEqual(names['!00000009']['long_name'], 'Newcomer')
+        self.assertEqual(self.resolver.stats()['invalidations'], 1)
+
+    def test_repeated_nodeinfo_does_not_count_as_a_rename(self):
+        listen_device.get_node_cache().clear()
+        listen_device.get_deduplicator().clear()
+        for packet_id, long_name in ((5001, 'Hill Relay'), (5002, 'Hill Relay'), (5003, 'Valley Relay')):
+            listen_device.flush_ingest_batch([listen_device.build_packet_record(
+                packet_fixtures.nodeinfo_packet(from_num=0x00000001, long_name=long_name, packet_id=packet_id,
+                                                rx_time=1700000000 + packet_id))])
+            listen_device.get_node_cache().flush()
+        self.assertEqual(read_counters()[NODE_NAME_CHANGES], 2)  # The first name and the rename
+        self.assertEqual(self.resolver.resolve(['!00000001'])['!00000001']['long_name'], 'Valley Relay')
+
+
+@skipUnless(connection.vendor in message_search.VENDORS, 'Message search index')
+class MessageSearchTestCase(TestCase):
+    def setUp(self):
+        listen_device.get_node_cache().clear()
+        listen_device.get_deduplicator().clear()
+
+    def search(self, query, order=message_search.ORDER_RECENT):
+        return [message.text for message in message_search.MessageSearch(query, order=order)[:25]]
+
+    def test_ingested_messages_are_found_by_word_prefixes_and_sender_names(self):
+        listen_device.flush_ingest_batch([listen_device.build_packet_record(p) for p in (
+            make_text_packet(1001, text="Hello world from the hill"),
+            make_text_packet(1002, text="Heading home now"),
+        )])
+        self.assertEqual(self.search('hel wor'), ["Hello world from the hill"])
+        self.assertCountEqual(self.search('!11223344'), ["Heading home now", "Hello world from the hill"])
+        self.assertEqual(message_search.MessageSearch('he').count(), 2)
+
+        cache = listen_device.get_node_cache()
+        cache.update('!11223344', {'long_name': 'Hilltop Relay'})
+        cache.flush()
+        self.assertCountEqual(self.search('hilltop'), ["Heading home now", "Hello world from the hill"])
+        # "hill" is in the text of one message, so it ranks above the sender name match.
+        self.assertEqual(self.search('hill', order=message_search.ORDER_RELEVANCE)[0], "Hello world from the hill")
+
+    def test_rebuild_indexes_existing_messages(self):
+        packet = Packet.objects.create(event_id='search-1', timestamp=1700000000, packet_type='Message')
+        Message.objects.create(packet=packet, text="Imported before the index existed", timestamp=1700000000)
+        self.assertEqual(self.search('imported'), [])
+
+        call_command('rebuild_message_search', chunk_size=1, stdout=io.StringIO())
+        self.assertEqual(self.search('imported'), ["Imported before the index existed"])
+
+
+class DatabaseProfileTestCase(TestCase):
+    def test_sqlite_options_apply_the_pragmas_on_connect(self):
+        options = sqlite_options(busy_timeout=5, synchronous='normal', cache_size_mb=8, mmap_size_mb=0)
+        self.assertEqual(options['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(options['timeout'], 5.0)
+        self.assertIn('PRAGMA journal_mode=WAL', options['init_command'])
+        self.assertIn('PRAGMA synchronous=NORMAL', options['init_command'])
+        self.assertIn('PRAGMA cache_size=-8192', options['init_command'])
+        with self.assertRaises(ValueError):
+            sqlite_options(synchronous='sometimes')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite profile')
+    def test_connections_use_the_profile(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_locked_transactions_are_retried_with_bounded_attempts(self):
+        calls = []
+
+        def flaky(value):
+            calls.append(value)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return value
+
+        self.assertEqual(retry_on_lock(flaky, 'done', attempts=5, backoff=0, backoff_max=0), 'done')
+        self.assertEqual(len(calls), 3)
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            retry_on_lock(flaky, 'done', attempts=1, backoff=0, backoff_max=0)
+        self.assertEqual(len(calls), 2)
+
+        def broken():
+            calls.append('broken')
+            raise OperationalError('no such table: nowhere')
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            retry_on_lock(broken, attempts=5, backoff=0, backoff_max=0)
+        self.assertEqual(calls, ['broken'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite maintenance')
+    def test_maintenance_analyzes_the_database(self):
+        result = run_maintenance(vacuum_pages=10)
+        self.assertFalse(result['skipped'])
+        self.assertIn(result['analyzed'], ('full', 'optimize'))
+        self.assertEqual(run_maintenance()['analyzed'], 'optimize')
+
+
+class RetentionTestCase(TestCase):
+    NOW = 1700000000.0
+    OLD = NOW - 40 * 86400
+
+    def setUp(self):
+        self.node = Node.objects.create(node_id='!00000001', node_num=1)
+        self.manager = RetentionManager(packet_days=30, telemetry_days=7, position_days=7, chunk_size=2,
+                                        chunk_pause=0)
+
+    def test_old_packets_are_deleted_in_chunks_and_messages_kept(self):
+        for i in range(5):
+            Packet.objects.create(event_id=f'old-{i}', timestamp=self.OLD + i, packet_type='Telemetry',
+                                  raw_json={'id': i})
+        message_packet = Packet.objects.create(event_id='old-message', timestamp=self.OLD, packet_type='Message',
+                                               raw_json={'id': 99}, decoded_json={'text': 'hi'})
+        Message.objects.create(packet=message_packet, text='hi', timestamp=self.OLD)
+        Packet.objects.create(event_id='recent', timestamp=self.NOW, packet_type='Telemetry', raw_json={})
+
+        result = self.manager.run(now=self.NOW)['packets']
+
+        self.assertEqual(result['deleted'], 5)
+        self.assertTrue(result['done'])
+        self.assertEqual(sorted(Packet.objects.values_list('event_id', flat=True)), ['old-message', 'recent'])
+        message_packet.refresh_from_db()
+        self.assertIsNone(message_packet.raw_json)
+        self.assertEqual(Message.objects.get().text, 'hi')
+
+    def test_old_telemetry_is_downsampled_to_hourly_means(self):
+        hour = 3600 * int(self.OLD // 3600)
+        for offset, battery, uptime in ((60, 80, 100), (600, 90, 700), (1200, 100, 1300)):
+            Telemetry.objects.create(node=self.node, timestamp=hour + offset, battery_level=battery,
+                                     voltage=battery / 20, uptime_seconds=uptime)
+        Telemetry.objects.create(node=self.node, timestamp=hour + 3600 + 60, battery_level=50)
+        Telemetry.objects.create(node=self.node, timestamp=self.NOW, battery_level=40)
+        Telemetry.objects.create(node=self.node, timestamp=self.NOW + 60, battery_level=41)
+
+        result = self.manager.run(now=self.NOW)['telemetry']
+
+        self.assertEqual((result['deleted'], result['aggregated']), (2, 1))
+        self.assertEqual(Telemetry.objects.count(), 4)
+        mean = Telemetry.objects.get(timestamp=hour)
+        self.assertEqual(mean.battery_level, 90)
+        self.assertAlmostEqual(mean.voltage, 4.5)
+        self.assertEqual(mean.uptime_seconds, 1300)
+        self.assertIsNotNone(RetentionState.objects.get(policy='telemetry').processed_until)
+        self.assertEqual(self.manager.run(now=self.NOW)['telemetry']['deleted'], 0)
+
+    def test_old_positions_are_thinned_to_the_newest_per_bucket(self):
+        start = 600 * int(self.OLD // 600)
+        for offset in (0, 120, 240, 360, 700):
+            Position.objects.create(node=self.node, timestamp=start + offset, latitude=52.5, longitude=13.4)
+
+        result = self.manager.run(now=self.NOW)['positions']
+
+        self.assertEqual(result['deleted'], 3)
+        self.assertEqual(sorted(Position.objects.values_list('timestamp', flat=True)), [start + 360, start + 700])
+
+
+class MetricsRollupTestCase(TestCase):
+    START = 1700000100.0  # Start of a 5 minute bucket
+
+    def test_buckets_are_rolled_up_once_and_combine_to_exact_averages(self):
+        node = Node.objects.create(node_id='!00000001', node_num=1)
+        samples = [(0, 10.0, -80), (60, 4.0, -90), (290, None, -100), (300, -2.0, -110), (650, 6.0, -70)]
+        for i, (offset, snr, rssi) in enumerate(samples):
+            Packet.objects.create(event_id=f'rollup-{i}', timestamp=self.START + offset, rx_snr=snr, rx_rssi=rssi,
+                                  from_node_id_str=f'!0000000{i % 2}')
+        Telemetry.objects.create(node=node, timestamp=self.START + 10, battery_level=80, channel_utilization=10.0)
+        Telemetry.objects.create(node=node, timestamp=self.START + 20, battery_level=101, channel_utilization=20.0)
+
+        rollup = MetricsRollup(bucket_seconds=300, delay=60, max_buckets=10)
+        # Only the first two buckets have been complete for a minute.
+        self.assertEqual(rollup.run(now=self.START + 700), 2)
+        self.assertEqual(rollup.run(now=self.START + 700), 0)
+        first = AverageMetricsHistory.objects.get(timestamp=self.START)
+        self.assertEqual((first.packet_count, first.snr_count, first.active_node_count), (3, 2, 2))
+        self.assertEqual(first.average_battery, 80)  # 101 (powered) is not a battery level
+        self.assertAlmostEqual(first.average_chan_util, 15.0)
+
+        stats = window_signal_stats(self.START, self.START + 600)
+        self.assertAlmostEqual(stats['average_snr'], (10.0 + 4.0 - 2.0) / 3)
+        self.assertAlmostEqual(stats['average_rssi'], (-80 - 90 - 100 - 110) / 4)
+        self.assertEqual(stats['packet_count'], 4)
+
+        history = history_points(self.START, self.START + 600, max_points=1, bucket_seconds=300)
+        self.assertEqual(history['step_seconds'], 600)
+        self.assertEqual(sum(point['packet_count'] for point in history['points']), 4)
+
+
+class IngestPipelineTestCase(TestCase):
+    def test_groups_records_into_batches_and_flushes_on_stop(self):
+        batches = []
+        pipeline = IngestPipeline(flush_callback=batches.append, batch_size=3, flush_interval=5.0)
+        pipeline.start()
+        for i in range(7):
+            self.assertTrue(pipeline.submit(i))
+        pipeline.stop()
+
+        self.assertEqual([item for batch in batches for item in batch], list(range(7)))
+        self.assertTrue(all(len(batch) <= 3 for batch in batches))
+        self.assertFalse(pipeline.is_running)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        pipeline = IngestPipeline(flush_callback=lambda batch: None, max_queue_size=2)
+        self.assertTrue(pipeline.submit(1))
+        self.assertTrue(pipeline.submit(2))
+        self.assertFalse(pipeline.submit(3))
+        self.assertEqual(pipeline.stats()['dropped'], 1)
+
+
+def read_events(stream) -> list:
+    """(kind, data) of the events in the first chunk after the retry field of an event stream."""
+    next(stream)
+    chunk = next(stream)
+    stream.close()
+    published = []
+    for block in chunk.decode('utf-8').strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            published.append((fields['event'], json.loads(fields['data'])))
+    return published
+
+
+class EventBrokerTestCase(SimpleTestCase):
+    def test_reconnecting_subscribers_get_the_missed_events(self):
+        broker = EventBroker(buffer_size=10)
+        broker.publish('packet', {'event_id': 'a'})
+        first_id = f"{broker.epoch}:{broker.sequence}"
+        broker.publish('packet', {'event_id': 'b'})
+        broker.publish('counters', {'deltas': {'packets': 2}})
+
+        self.assertEqual(read_events(broker.subscribe(first_id)),
+                         [('packet', {'event_id': 'b'}), ('counters', {'deltas': {'packets': 2}})])
+        self.assertEqual(read_events(broker.subscribe(f"{broker.epoch}:0"))[0], ('packet', {'event_id': 'a'}))
+        self.assertEqual(broker.subscribers, 0)
+
+    def test_gone_events_and_other_epochs_mean_a_reset(self):
+        broker = EventBroker(buffer_size=2)
+        for index in range(5):
+            broker.publish('packet', {'index': index})
+        self.assertEqual(read_events(broker.subscribe(f"{broker.epoch}:1")), [('reset', {})])
+        self.assertEqual(read_events(broker.subscribe("0:4")), [('reset', {})])
+        self.assertEqual(broker.stats()['resets'], 2)
+
+    def test_idle_streams_get_keep_alives_and_end_on_close(self):
+        broker = EventBroker(keepalive=0.01)
+        stream = broker.subscribe()
+        next(stream)
+        self.assertEqual(next(stream), b': keep-alive\n\n')
+        broker.close()
+        with self.assertRaises(StopIteration):
+            next(stream)
+        self.assertEqual(broker.subscribers, 0)
+
+
+def make_record(packet_type, from_id_str='!11223344', event_id=None, payload=None):
+    return {'kind': 'packet', 'packet_type': packet_type, 'from_id_str': from_id_str,
+            'packet': {'event_id': event_id or f"{packet_type}-{time.monotonic_ns()}"},
+            'payload': payload if payload is not None else {'deviceMetrics': {}}}
+
+
+class SheddingQueueTestCase(SimpleTestCase):
+    def test_messages_are_never_shed(self):
+        records = SheddingQueue(maxsize=4, high_water=1.0)
+        for index in range(3):
+            records.put_nowait(make_record('Telemetry', from_id_str=f'!0000000{index}'))
+        records.put_nowait(make_record('Encrypted'))
+        for _ in range(3):
+            records.put_nowait(make_record('Message'))
+
+        drained = [records.get_nowait()['packet_type'] for _ in range(records.qsize())]
+        # Messages go first; to make room, the encrypted packet and then the oldest telemetry were evicted.
+        self.assertEqual(drained, ['Message', 'Message', 'Message', 'Telemetry'])
+        self.assertEqual(records.stats()['shed'], 3)
+
+    def test_overload_coalesces_samples_and_samples_low_value_packets(self):
+        records = SheddingQueue(maxsize=100, high_water=0.02, sample_rate=5)
+        records.put_nowait(make_record('Position', payload={'latitudeI': 1}))
+        records.put_nowait(make_record('Position', from_id_str='!55667788', payload={'latitudeI': 2}))
+        latest = make_record('Position', payload={'latitudeI': 3})
+        records.put_nowait(latest)
+        for _ in range(10):
+            records.put_nowait(make_record('Other'))
+        records.put_nowait({'kind': 'node', 'node_id': '!11223344', 'values': {'long_name': 'A', 'snr': 1.0}})
+        records.put_nowait({'kind': 'node', 'node_id': '!11223344', 'values': {'snr': 2.0}})
+
+        self.assertIs(records.get_nowait(), latest)
+        self.assertEqual(records.get_nowait()['payload'], {'latitudeI': 2})
+        self.assertEqual(records.get_nowait()['values'], {'long_name': 'A', 'snr': 2.0})
+        self.assertEqual(records.qsize(), 2)
+        self.assertEqual(records.take_counts(), (8, 2))
+        self.assertEqual(records.take_counts(), (0, 0))
+
+
+class OutboundSchedulerTestCase(SimpleTestCase):
+    def test_long_text_is_split_into_numbered_parts(self):
+        parts = split_text("Das Wetter in Berlin ist sonnig. " * 20, max_part_bytes=200, max_parts=5)
+        self.assertEqual(len(parts), 4)
+        self.assertTrue(all(len(part.encode('utf-8')) <= 200 for part in parts))
+        self.assertTrue(parts[0].startswith("1/4 Das Wetter"))
+        self.assertTrue(split_text("x" * 2000, max_part_bytes=200, max_parts=3)[-1].endswith("..."))
+
+    def test_interactive_before_bulk_and_retry(self):
+        sent = []
+        attempts = []
+        failures = {'!b': 1}
+        release = threading.Event()
+
+        def send(text, destination_id, channel_index, want_ack):
+            release.wait(5)
+            attempts.append(destination_id)
+            if failures.get(destination_id):
+                failures[destination_id] -= 1
+                raise ConnectionError("radio busy")
+            sent.append(destination_id)
+
+        scheduler = OutboundScheduler(send, min_interval=0, bitrate_bps=1e6, retry_backoff=0.01)
+        scheduler.start()
+        scheduler.enqueue("first", '!a', priority=PRIORITY_BULK)
+        time.sleep(0.05)  # '!a' is being sent, the rest queues up behind it
+        scheduler.enqueue("bulk", '!c', priority=PRIORITY_BULK)
+        scheduler.enqueue("reply", '!b')
+        release.set()
+        deadline = time.monotonic() + 5
+        while len(sent) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        scheduler.stop()
+
+        # The reply goes before the bulk message; its retry waits for the backoff.
+        self.assertEqual(attempts[:2], ['!a', '!b'])
+        self.assertEqual(sorted(sent), ['!a', '!b', '!c'])
+        stats = scheduler.stats()
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['sent_messages'], 3)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_duty_cycle_budget_delays_sending(self):
+        sent = []
+        # 1% duty cycle with a 10s window allows 0.1s of airtime, one 200 byte part takes ~0.2s at 10 kbit/s.
+        scheduler = OutboundScheduler(lambda *args: sent.append(args), duty_cycle_percent=1, duty_cycle_window=10,
+                                      bitrate_bps=10000, min_interval=0)
+        scheduler.start()
+        scheduler.enqueue("x" * 150, '!a')
+        scheduler.enqueue("y" * 150, '!a')
+        time.sleep(0.2)
+        scheduler.stop()
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(scheduler.stats()['queue_depth'], 1)
+
+
+class ListenerBenchmarkTestCase(SimpleTestCase):
+    def test_results_are_written_as_json(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        channel_map = dict(listen_device.get_gateways().primary.channel_map)
+        call_command('benchmark_listener', '--packets', '20', '--rounds', '1', '--output', output.name,
+                     '--cases', 'classify_packet_type,ensure_serializable,get_node_num_from_id_str,render_response_template',
+                     stdout=io.StringIO())
+
+        with open(output.name) as result_file:
+            report = json.load(result_file)
+        self.assertEqual(list(report['results']), ['classify_packet_type', 'ensure_serializable',
+                                                   'get_node_num_from_id_str', 'render_response_template'])
+        self.assertEqual(report['results']['ensure_serializable']['ops'], 20)
+        self.assertEqual(listen_device.get_gateways().primary.channel_map, channel_map)
+
+    def test_response_template_placeholders_are_replaced(self):
+        node = Node(node_id='!11223344', node_num=0x11223344, long_name="Berlin Mitte Router", battery_level=87)
+        message = Message(text="!status", timestamp=1700000000.0)
+        text = listen_device.render_response_template("<SENDER_LONG_NAME> <SENDER_BATTERY_LEVEL> <LOCATION>",
+                                                      message, node, 0)
+        self.assertEqual(text, "Berlin Mitte Router 87% Position unbekannt")
+
+
+class CaptureReplayTestCase(TestCase):
+    def setUp(self):
+        listen_device.get_node_cache().clear()
+        listen_device.get_deduplicator().clear()
+        capture_file = tempfile.NamedTemporaryFile(suffix='.mtcap', delete=False)
+        capture_file.close()
+        self.path = capture_file.name
+        self.addCleanup(os.remove, self.path)
+
+    def _write_capture(self, packets, node_updates=()):
+        writer = CaptureWriter(self.path)
+        writer.open()
+        for node in node_updates:
+            writer.write_node_update(node)
+        for packet in packets:
+            writer.write_packet(packet)
+        writer.close()
+
+    def test_capture_round_trip(self):
+        packets = packet_fixtures.packet_mix(count=20)
+        self._write_capture(packets, [packet_fixtures.node_update()])
+        events = list(read_capture(self.path))
+
+        self.assertEqual([kind for kind, _, _ in events], [KIND_NODE_UPDATE] + [KIND_PACKET] * 20)
+        self.assertEqual(events[0][2]['user']['longName'], "Berlin Mitte Router")
+        for packet, (_, _, replayed) in zip(packets, events[1:]):
+            self.assertEqual(json.dumps(ensure_serializable(replayed)), json.dumps(ensure_serializable(packet)))
+
+    def test_replay_writes_packets_and_reports_throughput(self):
+        packets = packet_fixtures.packet_mix(count=30)
+        self._write_capture(packets + packets[:5], [packet_fixtures.node_update()])
+        out = io.StringIO()
+        call_command('replay_packets', self.path, stdout=out)
+
+        self.assertEqual(Packet.objects.count(), 30)
+        self.assertTrue(Node.objects.filter(node_id='!11223344').exists())
+        output = out.getvalue()
+        self.assertIn("Events: 36 (35 packets, 1 node updates)", output)
+        self.assertIn("DB queries:", output)
+        self.assertIsNone(listen_device._commander_dispatcher)